@@ -0,0 +1,55 @@
+"""Compare two benchmark reports (micro.py or endpoints.py --out files).
+
+    python benchmarks/compare.py before.json after.json [--threshold 10]
+
+Prints one line per metric with the relative change; exits 1 if any latency
+or per-op time got worse by more than --threshold percent.
+"""
+import sys
+import json
+import argparse
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# metric -> True when larger is better
+ENDPOINT_METRICS = {"p50_ms": False, "p95_ms": False, "p99_ms": False, "rps": True}
+
+
+def _metrics(report: Dict[str, Any]) -> Iterator[Tuple[str, float, bool]]:
+    if report.get("benchmark") == "micro":
+        for r in report.get("results", []):
+            yield r["name"], r["ns_per_op"], False
+    for name, s in (report.get("scenarios") or {}).items():
+        for metric, higher_better in ENDPOINT_METRICS.items():
+            if isinstance(s.get(metric), (int, float)):
+                yield f"{name}.{metric}", float(s[metric]), higher_better
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed regression in percent")
+    args = parser.parse_args(argv)
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)
+
+    old = {name: value for name, value, _ in _metrics(before)}
+    print(f"{(before.get('meta') or {}).get('commit')} -> {(after.get('meta') or {}).get('commit')}")
+    regressions = 0
+    for name, value, higher_better in _metrics(after):
+        if name not in old or not old[name]:
+            continue
+        change = (value - old[name]) / old[name] * 100
+        worse = -change if higher_better else change
+        flag = ""
+        if worse > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{name:50s} {old[name]:>12.2f} -> {value:>12.2f}  {change:+6.1f}%{flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
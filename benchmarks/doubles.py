@@ -0,0 +1,494 @@
+"""In-memory Supabase and Firestore doubles for offline benchmarks.
+
+They implement only the calls supabase_utils and user_api make, keep rows in
+process memory and can add a fixed per-call latency to stand in for the
+network round trip. Install them with install_supabase() / install_firestore()
+before the first request.
+"""
+import re
+import time
+import uuid
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class _Response:
+    def __init__(self, data: Any):
+        self.data = data
+        self.count = len(data) if isinstance(data, list) else None
+
+
+def _split_top(expr: str) -> List[str]:
+    """Split a PostgREST logic body on commas outside parens and quotes."""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(expr):
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and ch == ",":
+            parts.append(expr[start:i])
+            start = i + 1
+    parts.append(expr[start:])
+    return [p for p in parts if p]
+
+
+_OPS: Dict[str, Callable[[Any, Any], bool]] = {
+    "eq": lambda a, b: a == b,
+    "lt": lambda a, b: a is not None and a < b,
+    "gt": lambda a, b: a is not None and a > b,
+    "lte": lambda a, b: a is not None and a <= b,
+    "gte": lambda a, b: a is not None and a >= b,
+}
+
+
+def _coerce(raw: str, sample: Any) -> Any:
+    raw = raw[1:-1] if len(raw) >= 2 and raw[0] == raw[-1] == '"' else raw
+    if isinstance(sample, bool):
+        return raw == "true"
+    if isinstance(sample, int):
+        return int(raw)
+    if isinstance(sample, float):
+        return float(raw)
+    return raw
+
+
+def _predicate(expr: str) -> Callable[[Dict[str, Any]], bool]:
+    m = re.fullmatch(r"(and|or)\((.*)\)", expr)
+    if m:
+        subs = [_predicate(p) for p in _split_top(m.group(2))]
+        join = all if m.group(1) == "and" else any
+        return lambda row: join(p(row) for p in subs)
+    col, op, raw = expr.split(".", 2)
+    test = _OPS[op]
+    return lambda row: test(row.get(col), _coerce(raw, row.get(col)))
+
+
+class _Query:
+    def __init__(self, db: "MemorySupabase", table: str):
+        self._db = db
+        self._table = table
+        self._action = "select"
+        self._payload: Any = None
+        self._columns: Optional[List[str]] = None
+        self._filters: List[Callable[[Dict[str, Any]], bool]] = []
+        self._order: List[Tuple[str, bool]] = []
+        self._limit: Optional[int] = None
+
+    def select(self, columns: str = "*", **_: Any) -> "_Query":
+        self._columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def insert(self, rows: Any, **_: Any) -> "_Query":
+        self._action, self._payload = "insert", rows
+        return self
+
+    def update(self, values: Dict[str, Any]) -> "_Query":
+        self._action, self._payload = "update", values
+        return self
+
+    def eq(self, col: str, value: Any) -> "_Query":
+        self._filters.append(lambda row: row.get(col) == value)
+        return self
+
+    def gte(self, col: str, value: Any) -> "_Query":
+        self._filters.append(lambda row: row.get(col) is not None and row.get(col) >= value)
+        return self
+
+    def or_(self, expr: str) -> "_Query":
+        self._filters.append(_predicate(f"or({expr})"))
+        return self
+
+    def order(self, col: str, desc: bool = False) -> "_Query":
+        self._order.append((col, desc))
+        return self
+
+    def limit(self, n: int) -> "_Query":
+        self._limit = n
+        return self
+
+    def execute(self) -> _Response:
+        self._db._round_trip()
+        with self._db._lock:
+            if self._action == "insert":
+                return _Response(self._db._insert(self._table, self._payload))
+            rows = [r for r in self._db._rows(self._table) if all(f(r) for f in self._filters)]
+            if self._action == "update":
+                for r in rows:
+                    r.update(self._payload)
+                return _Response([dict(r) for r in rows])
+        for col, desc in reversed(self._order):
+            rows.sort(key=lambda r: (r.get(col) is not None, r.get(col)), reverse=desc)
+        if self._limit is not None:
+            rows = rows[: self._limit]
+        if self._columns:
+            rows = [{c: r.get(c) for c in self._columns} for r in rows]
+        return _Response([dict(r) for r in rows])
+
+
+class _Rpc:
+    def __init__(self, db: "MemorySupabase", name: str, params: Dict[str, Any]):
+        self._db, self._name, self._params = db, name, params
+
+    def execute(self) -> _Response:
+        if self._name != "merge_analysis":
+            raise RuntimeError(f"rpc {self._name} not available in the double")
+        self._db._round_trip()
+        p = self._params
+        with self._db._lock:
+            for row in self._db._tables.get("analyses", []):
+                if row.get("id") == p["p_id"]:
+                    perception = dict(row.get("perception") or {})
+                    if p.get("p_objects") is not None:
+                        perception["objects"] = p["p_objects"]
+                    if p.get("p_certainty") is not None:
+                        perception["certainty"] = p["p_certainty"]
+                    row["perception"] = perception
+                    if p.get("p_experience") is not None:
+                        row["experience"] = p["p_experience"]
+                    if p.get("p_confidence") is not None:
+                        row["confidence"] = p["p_confidence"]
+                    return _Response(dict(row))
+        return _Response(None)
+
+
+class _Bucket:
+    def __init__(self, db: "MemorySupabase", name: str):
+        self._db, self._name = db, name
+
+    def upload(self, path: str, file: bytes, file_options: Optional[Dict[str, Any]] = None, **_: Any) -> Dict[str, Any]:
+        self._db._round_trip()
+        key = f"{self._name}/{path}"
+        with self._db._lock:
+            if key in self._db.objects:
+                raise RuntimeError("The resource already exists (Duplicate, 409)")
+            self._db.objects[key] = bytes(file)
+        return {"Key": key}
+
+    def get_public_url(self, path: str) -> str:
+        return f"memory://{self._name}/{path}"
+
+
+class _Storage:
+    def __init__(self, db: "MemorySupabase"):
+        self._db = db
+
+    def from_(self, name: str) -> _Bucket:
+        return _Bucket(self._db, name)
+
+
+class MemorySupabase:
+    """Tables, the discover_cards view, the merge_analysis RPC and one Storage
+    namespace. Thread-safe; one instance is shared by every worker thread."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.objects: Dict[str, bytes] = {}
+        self.storage = _Storage(self)
+
+    def _round_trip(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _insert(self, table: str, rows: Any) -> List[Dict[str, Any]]:
+        out = []
+        for row in rows if isinstance(rows, list) else [rows]:
+            row = dict(row)
+            row.setdefault("id", str(uuid.uuid4()))
+            row.setdefault("created_at", _now())
+            if table == "analyses":
+                row.setdefault("like_count", 0)
+                row.setdefault("feedback_count", 0)
+            elif table in ("likes", "feedback"):
+                counter = "like_count" if table == "likes" else "feedback_count"
+                for a in self._tables.get("analyses", []):
+                    if a.get("id") == row.get("analysis_id"):
+                        a[counter] = a.get(counter, 0) + 1
+            self._tables.setdefault(table, []).append(row)
+            out.append(dict(row))
+        return out
+
+    def _rows(self, table: str) -> List[Dict[str, Any]]:
+        if table == "discover_cards":
+            return [
+                {
+                    "id": r["id"],
+                    "image_url": r.get("image_url"),
+                    "experience": (r.get("experience") or "")[:160],
+                    "confidence": r.get("confidence"),
+                    "created_at": r["created_at"],
+                    "likes": r.get("like_count", 0),
+                }
+                for r in self._tables.get("analyses", [])
+            ]
+        return self._tables.get(table, [])
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    def rpc(self, name: str, params: Dict[str, Any]) -> _Rpc:
+        return _Rpc(self, name, params)
+
+    def seed_analyses(self, n: int) -> List[str]:
+        """Insert n analyses with spread-out timestamps and like counts."""
+        ids = []
+        with self._lock:
+            for i in range(n):
+                ts = datetime.fromtimestamp(1_700_000_000 + i * 60, timezone.utc).isoformat()
+                row = self._insert("analyses", {
+                    "image_url": f"memory://images/{i}.jpg",
+                    "perception": {"objects": ["cup"], "certainty": 0.8},
+                    "experience": "• örnek deneyim " * 8,
+                    "confidence": 0.8,
+                    "created_at": ts,
+                    "like_count": (i * 7919) % 50,
+                })[0]
+                ids.append(row["id"])
+        return ids
+
+    def count(self, table: str) -> int:
+        with self._lock:
+            return len(self._tables.get(table, []))
+
+
+def install_supabase(latency: float = 0.0) -> MemorySupabase:
+    """Route supabase_utils to a fresh in-memory double."""
+    from api import supabase_utils
+
+    db = MemorySupabase(latency)
+    supabase_utils.set_client_factory(lambda: db)
+    return db
+
+
+# --- Firestore / Cloud Storage ---
+
+SERVER_TIMESTAMP = object()
+
+
+class _FieldPath:
+    @staticmethod
+    def document_id() -> str:
+        return "__name__"
+
+
+class _FirestoreTypes:
+    SERVER_TIMESTAMP = SERVER_TIMESTAMP
+    FieldPath = _FieldPath
+
+
+class FirestoreModule:
+    """Stands in for firebase_admin.firestore (only .firestore.* is used)."""
+
+    firestore = _FirestoreTypes
+
+
+class _Doc:
+    def __init__(self, doc_id: str, data: Dict[str, Any]):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self._data)
+
+
+def _pick(data: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for path in fields:
+        src, dst = data, out
+        keys = path.split(".")
+        for k in keys[:-1]:
+            src = src.get(k) if isinstance(src, dict) else None
+            if src is None:
+                break
+            dst = dst.setdefault(k, {})
+        else:
+            if isinstance(src, dict) and keys[-1] in src:
+                dst[keys[-1]] = src[keys[-1]]
+    return out
+
+
+class _FirestoreQuery:
+    def __init__(self, db: "MemoryFirestore", name: str):
+        self._db = db
+        self._name = name
+        self._where: List[Tuple[str, Any]] = []
+        self._order: List[Tuple[str, bool]] = []
+        self._fields: Optional[List[str]] = None
+        self._after: Optional[Dict[str, Any]] = None
+        self._limit: Optional[int] = None
+
+    def _copy(self) -> "_FirestoreQuery":
+        q = _FirestoreQuery(self._db, self._name)
+        q._where, q._order = list(self._where), list(self._order)
+        q._fields, q._after, q._limit = self._fields, self._after, self._limit
+        return q
+
+    def add(self, data: Dict[str, Any]) -> Tuple[Any, Any]:
+        return self._db._add(self._name, data)
+
+    def document(self, doc_id: Optional[str] = None) -> "_DocRef":
+        return _DocRef(self._name, doc_id or uuid.uuid4().hex[:20])
+
+    def where(self, field: str, op: str, value: Any) -> "_FirestoreQuery":
+        assert op == "==", "only equality filters are used"
+        q = self._copy()
+        q._where.append((field, value))
+        return q
+
+    def order_by(self, field: str, direction: str = "ASCENDING") -> "_FirestoreQuery":
+        q = self._copy()
+        q._order.append((field, direction == "DESCENDING"))
+        return q
+
+    def select(self, fields: List[str]) -> "_FirestoreQuery":
+        q = self._copy()
+        q._fields = list(fields)
+        return q
+
+    def start_after(self, values: Dict[str, Any]) -> "_FirestoreQuery":
+        q = self._copy()
+        q._after = values
+        return q
+
+    def limit(self, n: int) -> "_FirestoreQuery":
+        q = self._copy()
+        q._limit = n
+        return q
+
+    def stream(self):
+        self._db._round_trip()
+        with self._db._lock:
+            docs = [
+                (doc_id, data)
+                for doc_id, data in self._db._collections.get(self._name, {}).items()
+                if all(data.get(f) == v for f, v in self._where)
+            ]
+
+        def key(item: Tuple[str, Dict[str, Any]], field: str) -> Any:
+            return item[0] if field == "__name__" else item[1].get(field)
+
+        for field, desc in reversed(self._order):
+            docs.sort(key=lambda item: key(item, field), reverse=desc)
+        if self._after is not None:
+            fields = [f for f, _ in self._order]
+            target = tuple(self._after.get(f) for f in fields)
+            for i, item in enumerate(docs):
+                if tuple(key(item, f) for f in fields) == target:
+                    docs = docs[i + 1:]
+                    break
+        if self._limit is not None:
+            docs = docs[: self._limit]
+        for doc_id, data in docs:
+            yield _Doc(doc_id, _pick(data, self._fields) if self._fields else data)
+
+
+class _DocRef:
+    def __init__(self, collection: str, doc_id: str):
+        self.collection = collection
+        self.id = doc_id
+
+
+class _Batch:
+    """WriteBatch: set() calls are applied together on commit (one round trip)."""
+
+    LIMIT = 500
+
+    def __init__(self, db: "MemoryFirestore"):
+        self._db = db
+        self._writes: List[Tuple[_DocRef, Dict[str, Any]]] = []
+
+    def set(self, ref: _DocRef, data: Dict[str, Any]) -> None:
+        self._writes.append((ref, data))
+
+    def commit(self) -> None:
+        if len(self._writes) > self.LIMIT:
+            raise ValueError(f"maximum {self.LIMIT} writes allowed per request")
+        self._db._round_trip()
+        with self._db._lock:
+            for ref, data in self._writes:
+                self._db._collections.setdefault(ref.collection, {})[ref.id] = self._db._resolve(data)
+        self._db.commits += 1
+
+
+class MemoryFirestore:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._collections: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.commits = 0
+
+    def _round_trip(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _resolve(data: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: (datetime.now(timezone.utc) if v is SERVER_TIMESTAMP else v) for k, v in data.items()}
+
+    def _add(self, name: str, data: Dict[str, Any]) -> Tuple[Any, Any]:
+        self._round_trip()
+        doc_id = uuid.uuid4().hex[:20]
+        data = self._resolve(data)
+        with self._lock:
+            self._collections.setdefault(name, {})[doc_id] = data
+        return None, _Doc(doc_id, data)
+
+    def collection(self, name: str) -> _FirestoreQuery:
+        return _FirestoreQuery(self, name)
+
+    def batch(self) -> _Batch:
+        return _Batch(self)
+
+    def count(self, name: str) -> int:
+        with self._lock:
+            return len(self._collections.get(name, {}))
+
+
+class _Blob:
+    def __init__(self, bucket: "MemoryBucket", name: str):
+        self._bucket = bucket
+        self.name = name
+
+    def upload_from_string(self, data: bytes, content_type: Optional[str] = None, if_generation_match: Any = None) -> None:
+        self._bucket._round_trip()
+        with self._bucket._lock:
+            if if_generation_match == 0 and self.name in self._bucket.objects:
+                from google.api_core.exceptions import PreconditionFailed
+                raise PreconditionFailed(self.name)
+            self._bucket.objects[self.name] = bytes(data)
+
+    def generate_signed_url(self, expiration: Any = None) -> str:
+        return f"memory://bucket/{self.name}"
+
+
+class MemoryBucket:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.objects: Dict[str, bytes] = {}
+
+    def _round_trip(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def blob(self, name: str) -> _Blob:
+        return _Blob(self, name)
+
+
+def install_firestore(latency: float = 0.0) -> Tuple[MemoryFirestore, MemoryBucket]:
+    """Hand user_api in-memory Firestore/Storage instead of initializing Firebase."""
+    from api import user_api
+
+    db, bucket = MemoryFirestore(latency), MemoryBucket(latency)
+    # Same (firestore module, db, bucket) tuple _firebase_clients() builds.
+    user_api._firebase = (FirestoreModule, db, bucket)
+    return db, bucket
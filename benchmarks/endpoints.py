@@ -0,0 +1,298 @@
+"""End-to-end latency/throughput of the API at fixed concurrency, fully offline.
+
+    python benchmarks/endpoints.py [--concurrency 16] [--requests 200]
+        [--latency 0.3] [--jitter 0.1] [--db-latency 0.005]
+        [--providers openai,gemini] [--scenarios analyze,discover] [--out endpoints.json]
+
+Provider calls go over real HTTP to a local FakeProviderServer; Supabase and
+Firestore are replaced by in-memory doubles. Requests are driven in-process
+through httpx's ASGI transport (the app's startup/shutdown hooks run as in
+production), so the numbers cover the app and the provider round trips but
+not uvicorn. Each scenario reports p50/p95/p99 latency and requests/second.
+
+Scenarios:
+  analyze          POST /analyze-photo/, a new image every request (cold caches)
+  analyze-repeat   POST /analyze-photo/ cycling 8 images (perception/experience cache hits)
+  analyze-stream   POST /analyze-photo/stream over a real socket (in-process uvicorn, since
+                   the ASGI transport buffers bodies); also reports time to the
+                   perception event and to the first experience delta
+  chain            analyze_image_chain_async directly, new image every call
+  discover         GET /discover (first page, served from the feed cache)
+  discover-page    GET /discover with a cursor (always reaches the store)
+  feedback         POST /feedback (write-behind buffer)
+  user-analyze     user_api POST /analyze-photo/ with a bearer token
+  event-log        user_api POST /event-log/ (batched Firestore writer)
+"""
+import io
+import os
+import time
+import random
+import socket
+import asyncio
+import argparse
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from common import emit, latency_summary, metadata, use_src
+from fake_providers import FakeProviderServer
+
+SCENARIOS = ["analyze", "analyze-repeat", "analyze-stream", "chain", "discover", "discover-page", "feedback", "user-analyze", "event-log"]
+
+
+def make_images(n: int, width: int, height: int, seed: int = 11) -> List[bytes]:
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    images = []
+    for _ in range(n):
+        img = Image.new("RGB", (width, height), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        draw = ImageDraw.Draw(img)
+        for _ in range(12):
+            x, y = rng.randrange(width), rng.randrange(height)
+            draw.ellipse([x, y, x + rng.randrange(1, width // 3), y + rng.randrange(1, height // 3)],
+                         fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=88)
+        images.append(buf.getvalue())
+    return images
+
+
+async def load(call: Callable[[int], Awaitable[bool]], total: int, concurrency: int) -> Dict[str, Any]:
+    """Run call(i) for i in range(total) with `concurrency` in flight; call returns success."""
+    latencies: List[float] = []
+    errors = 0
+    next_i = 0
+
+    async def worker() -> None:
+        nonlocal next_i, errors
+        while next_i < total:
+            i = next_i
+            next_i += 1
+            start = time.perf_counter()
+            try:
+                ok = await call(i)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "rps": round(total / wall, 2) if wall else None,
+        **latency_summary(latencies),
+    }
+
+
+def _configure_env(server: FakeProviderServer, providers: List[str]) -> None:
+    # Must happen before api modules are imported: they read these at import.
+    for key in ("OPENAI_API_KEY", "GEMINI_API_KEY", "PERCEPTION_CACHE_DB", "EXPERIENCE_CACHE_DB", "STORAGE_INDEX_DB"):
+        os.environ.pop(key, None)
+    if "openai" in providers:
+        os.environ["OPENAI_API_KEY"] = "bench"
+        os.environ["OPENAI_BASE_URL"] = server.url + "/v1"
+    if "gemini" in providers:
+        os.environ["GEMINI_API_KEY"] = "bench"
+        os.environ["GEMINI_API_ENDPOINT"] = server.url
+    os.environ["PROVIDER_ORDER"] = ",".join(providers)
+    os.environ.setdefault("SUPABASE_URL", "memory://bench")
+    os.environ.setdefault("SUPABASE_BUCKET", "images")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+
+    server = FakeProviderServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate).start()
+    providers = [p for p in args.providers.split(",") if p]
+    _configure_env(server, providers)
+    use_src()
+    from doubles import install_supabase
+    from api import agents_chain as ac
+    from api import fastapi_example
+    from api.metrics import STAGES
+
+    store = install_supabase(args.db_latency)
+    seeded = store.seed_analyses(args.seed_rows)
+    images = make_images(args.requests, args.width, args.height)
+    repeat_images = images[:8]
+    report: Dict[str, Any] = {
+        "benchmark": "endpoints",
+        "meta": metadata(),
+        "config": {
+            "providers": providers,
+            "provider_latency_s": args.latency,
+            "provider_jitter_s": args.jitter,
+            "provider_error_rate": args.error_rate,
+            "db_latency_s": args.db_latency,
+            "image": f"{args.width}x{args.height}",
+        },
+        "scenarios": {},
+    }
+
+    app = fastapi_example.app
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            report["active_providers"] = ac._available_providers()
+
+            async def analyze(i: int, pool: List[bytes]) -> bool:
+                files = {"file": (f"{i}.jpg", pool[i % len(pool)], "image/jpeg")}
+                r = await client.post("/analyze-photo/", files=files)
+                return r.status_code == 200
+
+            first = (await client.get("/discover", params={"limit": 20})).json()
+            cursor = first.get("next_cursor")
+
+            scenarios: Dict[str, Callable[[int], Awaitable[bool]]] = {
+                "analyze": lambda i: analyze(i, images),
+                "analyze-repeat": lambda i: analyze(i, repeat_images),
+                "chain": lambda i: _chain(ac, images[(i + 1) % len(images)] + b"\0"),
+                "discover": lambda i: _ok(client.get("/discover", params={"limit": 20})),
+                "discover-page": lambda i: _ok(client.get("/discover", params={"limit": 20, "cursor": cursor})),
+                "feedback": lambda i: _ok(client.post(
+                    "/feedback", json={"analysis_id": seeded[i % len(seeded)], "feedback": "güzel analiz"})),
+            }
+            for name in args.scenarios:
+                if name not in scenarios:
+                    continue
+                if name == "analyze-repeat":
+                    for i in range(len(repeat_images)):
+                        await scenarios[name](i)  # prime the caches
+                report["scenarios"][name] = await load(scenarios[name], args.requests, args.concurrency)
+            if "feedback" in args.scenarios:
+                from api.supabase_utils import flush_writes
+                flush_writes()
+                report["scenarios"]["feedback"]["rows_written"] = store.count("feedback")
+        if "analyze-stream" in args.scenarios:
+            report["scenarios"]["analyze-stream"] = await _analyze_stream(args, app, images)
+    finally:
+        await app.router.shutdown()
+
+    if "user-analyze" in args.scenarios or "event-log" in args.scenarios:
+        report["scenarios"].update(await _user_api(args, images))
+
+    report["provider_requests"] = dict(server.requests)
+    report["stages"] = STAGES.snapshot()
+    server.stop()
+    return report
+
+
+async def _ok(aw: Awaitable[Any]) -> bool:
+    r = await aw
+    return r.status_code == 200
+
+
+async def _chain(ac: Any, image: bytes) -> bool:
+    result = await ac.analyze_image_chain_async(image)
+    return bool(result.get("experience"))
+
+
+async def _analyze_stream(args: argparse.Namespace, app: Any, images: List[bytes]) -> Dict[str, Any]:
+    import httpx
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    # lifespan is already running (startup was called by the caller)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, lifespan="off", log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    first_perception: List[float] = []
+    first_delta: List[float] = []
+    limits = httpx.Limits(max_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120, limits=limits) as client:
+            async def call(i: int) -> bool:
+                # new bytes, so perception and experience are not cache hits from "analyze"
+                files = {"file": (f"{i}.jpg", images[i % len(images)] + b"\2", "image/jpeg")}
+                start = time.perf_counter()
+                seen = set()
+                async with client.stream("POST", "/analyze-photo/stream", files=files) as r:
+                    async for line in r.aiter_lines():
+                        if not line.startswith("event: "):
+                            continue
+                        event = line[7:]
+                        if event == "perception" and event not in seen:
+                            first_perception.append(time.perf_counter() - start)
+                        elif event == "delta" and event not in seen:
+                            first_delta.append(time.perf_counter() - start)
+                        seen.add(event)
+                return r.status_code == 200 and "done" in seen
+
+            result = await load(call, args.requests, args.concurrency)
+    finally:
+        server.should_exit = True
+        await serving
+    result["first_perception"] = latency_summary(first_perception)
+    result["first_delta"] = latency_summary(first_delta)
+    return result
+
+
+async def _user_api(args: argparse.Namespace, images: List[bytes]) -> Dict[str, Any]:
+    """user_api scenarios; its upload path needs firebase-admin's google-api-core."""
+    import httpx
+    from doubles import install_firestore
+    from api import user_api
+    from api.auth_utils import create_access_token
+
+    results: Dict[str, Any] = {}
+    db, _ = install_firestore(args.db_latency)
+    headers = {"Authorization": "Bearer " + create_access_token({"sub": "bench-user", "email": "bench@example.com"})}
+    app = user_api.app
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            async def analyze(i: int) -> bool:
+                files = {"file": (f"{i}.jpg", images[i % len(images)] + b"\1", "image/jpeg")}
+                r = await client.post("/analyze-photo/", files=files, headers=headers)
+                return r.status_code == 200
+
+            if "user-analyze" in args.scenarios:
+                try:
+                    import google.api_core.exceptions  # noqa: F401
+                    results["user-analyze"] = await load(analyze, args.requests, args.concurrency)
+                except ImportError as e:
+                    results["user-analyze"] = {"skipped": f"missing dependency: {e.name}"}
+            if "event-log" in args.scenarios:
+                results["event-log"] = await load(
+                    lambda i: _ok(client.post("/event-log/", json={"type": "bench", "i": i}, headers=headers)),
+                    args.requests, args.concurrency)
+    finally:
+        await app.router.shutdown()
+    if "event-log" in results:
+        # shutdown flushed the writer, so this is every accepted event
+        results["event-log"]["rows_written"] = db.count("event_logs")
+        results["event-log"]["batch_commits"] = db.commits
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--latency", type=float, default=0.3, help="fake provider base latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="extra uniform provider latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of provider calls answered with 500")
+    parser.add_argument("--db-latency", type=float, default=0.005, help="per-call latency of the store doubles (s)")
+    parser.add_argument("--providers", default="openai", help="comma list of openai,gemini")
+    parser.add_argument("--scenarios", type=lambda s: s.split(","), default=SCENARIOS)
+    parser.add_argument("--seed-rows", type=int, default=2000, help="analyses preloaded for discover/feedback")
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--out")
+    args = parser.parse_args(argv)
+    emit(asyncio.run(run(args)), args.out)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,218 @@
+"""Local stand-ins for the OpenAI and Gemini HTTP APIs.
+
+FakeProviderServer answers the two endpoints agents_chain uses, on 127.0.0.1:
+
+    POST /v1/chat/completions                      (OpenAI, incl. stream=true)
+    POST /v1beta/models/<model>:generateContent    (Gemini REST)
+    POST /v1beta/models/<model>:streamGenerateContent
+
+Each response is delayed by latency + uniform(0, jitter) seconds; streamed
+responses spread the delay over their chunks. Requests carrying a JSON
+response format get a perception payload picked deterministically from the
+request body (so identical images get identical answers); everything else
+gets a three-bullet experience text. Point the app at it with
+OPENAI_BASE_URL=<url>/v1 and GEMINI_API_ENDPOINT=<url>.
+"""
+import json
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+OBJECTS = [
+    "cup", "laptop", "keyboard", "brush", "mouse", "fare", "diş fırçası",
+    "paint brush", "canvas", "masa", "lamba", "kitap", "telefon", "bitki",
+]
+SCENES = [
+    ("Bir çalışma masası", "Sabah, ofis"),
+    ("Bir banyo lavabosu", "Akşam, ev"),
+    ("Bir resim atölyesi", "Öğleden sonra, tuval ve palet"),
+    ("Bir mutfak tezgâhı", "Kahvaltı"),
+]
+EXPERIENCE = (
+    "• Masanın pencereye yakın tarafı sabah ışığında daha verimli.\n"
+    "• Kabloları tek bir kanalda toplamak dağınıklığı azaltır.\n"
+    "• Kupayı klavyeden uzak tutmak küçük kazaları önler."
+)
+
+
+def perception_payload(seed: bytes) -> Dict[str, Any]:
+    rng = random.Random(hashlib.sha256(seed).digest())
+    names = rng.sample(OBJECTS, rng.randint(2, 5))
+    scene, context = rng.choice(SCENES)
+    return {
+        "objects": [{"name": n, "subtype": None, "confidence": round(rng.uniform(0.6, 0.99), 2)} for n in names],
+        "scene": scene,
+        "context": context,
+        "certainty": round(rng.uniform(0.55, 0.95), 2),
+        "ambiguous": [],
+    }
+
+
+def _chunks(text: str, n: int) -> List[str]:
+    words = text.split(" ")
+    size = max(1, len(words) // max(1, n))
+    return [" ".join(words[i:i + size]) + (" " if i + size < len(words) else "") for i in range(0, len(words), size)]
+
+
+class FakeProviderServer:
+    """Threaded local HTTP server; use as a context manager or start()/stop()."""
+
+    def __init__(
+        self,
+        latency: float = 0.3,
+        jitter: float = 0.1,
+        error_rate: float = 0.0,
+        stream_chunks: int = 12,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stream_chunks = stream_chunks
+        self._lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeProviderServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-providers", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeProviderServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def _delay(self) -> float:
+        return self.latency + random.uniform(0, self.jitter)
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def _json(self, status: int, body: Dict[str, Any]) -> None:
+                raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def _sse(self, events: List[Dict[str, Any]], delay: float, done: bool) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                step = delay / max(1, len(events))
+                for event in events:
+                    time.sleep(step)
+                    self.wfile.write(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+                    self.wfile.flush()
+                if done:
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+
+            def do_HEAD(self) -> None:
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            do_GET = do_HEAD
+
+            def do_POST(self) -> None:
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                try:
+                    body = json.loads(raw or b"{}")
+                except ValueError:
+                    body = {}
+                path = self.path.split("?", 1)[0]
+                if server.error_rate and random.random() < server.error_rate:
+                    server._count("error")
+                    time.sleep(server._delay())
+                    self._json(500, {"error": {"message": "injected failure", "code": 500}})
+                    return
+                if path.endswith("/chat/completions"):
+                    self._openai(body, raw)
+                elif ":generateContent" in path or ":streamGenerateContent" in path:
+                    self._gemini(body, raw, stream=":streamGenerateContent" in path)
+                else:
+                    self._json(404, {"error": {"message": f"no route {path}"}})
+
+            def _openai(self, body: Dict[str, Any], raw: bytes) -> None:
+                structured = bool(body.get("response_format"))
+                text = json.dumps(perception_payload(raw)) if structured else EXPERIENCE
+                usage = {"prompt_tokens": len(raw) // 4, "completion_tokens": len(text) // 4}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                base = {"id": "chatcmpl-bench", "created": int(time.time()), "model": body.get("model", "fake")}
+                if body.get("stream"):
+                    server._count("openai.stream")
+                    events = [
+                        {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": None}]}
+                        for piece in _chunks(text, server.stream_chunks)
+                    ]
+                    events.append({**base, "object": "chat.completion.chunk",
+                                   "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                    if (body.get("stream_options") or {}).get("include_usage"):
+                        events.append({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+                    self._sse(events, server._delay(), done=True)
+                    return
+                server._count("openai.structured" if structured else "openai.text")
+                time.sleep(server._delay())
+                self._json(200, {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+
+            def _gemini(self, body: Dict[str, Any], raw: bytes, stream: bool) -> None:
+                config = body.get("generationConfig") or body.get("generation_config") or {}
+                structured = "json" in str(config.get("responseMimeType") or config.get("response_mime_type") or "")
+                has_image = b"inlineData" in raw or b"inline_data" in raw
+                text = json.dumps(perception_payload(raw)) if structured and has_image else EXPERIENCE
+                usage = {"promptTokenCount": len(raw) // 4, "candidatesTokenCount": len(text) // 4}
+                usage["totalTokenCount"] = usage["promptTokenCount"] + usage["candidatesTokenCount"]
+
+                def response(piece: str, last: bool) -> Dict[str, Any]:
+                    cand = {"content": {"role": "model", "parts": [{"text": piece}]}, "index": 0}
+                    if last:
+                        cand["finishReason"] = "STOP"
+                    return {"candidates": [cand], "usageMetadata": usage}
+
+                if stream:
+                    server._count("gemini.stream")
+                    pieces = _chunks(text, server.stream_chunks)
+                    self._sse([response(p, i == len(pieces) - 1) for i, p in enumerate(pieces)], server._delay(), done=False)
+                    return
+                server._count("gemini.structured" if structured else "gemini.text")
+                time.sleep(server._delay())
+                self._json(200, response(text, True))
+
+        return Handler
@@ -0,0 +1,139 @@
+"""Microbenchmarks for the per-request hot path that needs no network.
+
+    python benchmarks/micro.py [--scenes 2000] [--repeat 5] [--out micro.json]
+
+Covers label normalization (normalize_scene, _post_rules, _rule_normalize,
+LabelNormalizer.normalize with warm and cold memo), the experience cache key,
+token verification (full vs cached) and image digest/preprocess. Reports the best-of-repeat time per operation.
+"""
+import io
+import time
+import random
+import argparse
+from typing import Any, Callable, Dict, List, Optional
+
+from common import emit, metadata, use_src
+
+use_src()
+
+from api import agents_chain as ac  # noqa: E402
+from api.label_normalizer import LabelNormalizer  # noqa: E402
+
+NOISE = ["cup", "laptop", "lamba", "kitap", "telefon", "bitki", "keyboard", "masa", "pencere", "sandalye"]
+SCENES = ["Bir çalışma masası", "Bir banyo lavabosu", "Bir resim atölyesi", "Bir mutfak", "Bir oturma odası"]
+CONTEXTS = ["klavye ve monitor", "ayna ve tarak", "tuval, boya ve palet", "sabah kahvaltısı", "akşam"]
+
+
+def make_scenes(n: int, seed: int = 7) -> List[Dict[str, Any]]:
+    """Perception-shaped scenes mixing canonical variants, ambiguous words and noise."""
+    rng = random.Random(seed)
+    variants = [v for vs in ac.CANON.values() for v in vs] + list(ac.CANON)
+    scenes = []
+    for _ in range(n):
+        objs = rng.sample(NOISE, rng.randint(1, 4)) + rng.sample(variants, rng.randint(1, 3))
+        if rng.random() < 0.3:
+            objs.append(rng.choice(["brush", "mouse"]))
+        rng.shuffle(objs)
+        scenes.append({
+            "objects": [o.upper() if rng.random() < 0.1 else o for o in objs],
+            "scene": rng.choice(SCENES),
+            "context": rng.choice(CONTEXTS),
+            "certainty": round(rng.uniform(0.4, 0.95), 2),
+        })
+    return scenes
+
+
+def bench(name: str, fn: Callable[[], Any], ops: int, repeat: int, min_time: float) -> Dict[str, Any]:
+    """Time fn() (which performs `ops` operations); loops until a run takes min_time."""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        if time.perf_counter() - start >= min_time or loops >= 1 << 20:
+            break
+        loops *= 2
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    per_op = best / (loops * ops)
+    return {"name": name, "ns_per_op": round(per_op * 1e9, 1), "ops_per_s": round(1 / per_op) if per_op else None}
+
+
+def _jpeg(width: int, height: int, seed: int = 1) -> bytes:
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rng.randrange(width), rng.randrange(height)
+        draw.rectangle([x, y, x + rng.randrange(width // 4), y + rng.randrange(height // 4)],
+                       fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenes", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timed run")
+    parser.add_argument("--out")
+    args = parser.parse_args(argv)
+
+    scenes = make_scenes(args.scenes)
+    object_lists = [[str(o) for o in s["objects"]] for s in scenes]
+    words = [o for objs in object_lists for o in objs]
+    normalized = [ac.normalize_scene(s) for s in scenes]
+    canon = [ac._canonical_scene(s) for s in normalized]
+    results = []
+
+    def run(name: str, fn: Callable[[], Any], ops: int) -> None:
+        results.append(bench(name, fn, ops, args.repeat, args.min_time))
+
+    run("normalize_scene", lambda: [ac.normalize_scene(s) for s in scenes], len(scenes))
+    run("_post_rules", lambda: [ac._post_rules(s) for s in normalized], len(normalized))
+    run("_rule_normalize", lambda: [ac._rule_normalize(o) for o in object_lists], len(object_lists))
+
+    warm = ac.labels.get()
+    run("LabelNormalizer.normalize (memo hit)", lambda: [warm.normalize(w) for w in words], len(words))
+
+    unique = [f"{w} {i}" for i, w in enumerate(words)]
+
+    def cold() -> None:
+        # a fresh normalizer per run (its build is included) so every lookup misses the memo
+        fresh = LabelNormalizer(warm.canon, warm.context)
+        for w in unique:
+            fresh.normalize(w)
+
+    run("LabelNormalizer.normalize (memo miss)", cold, len(unique))
+    blobs = [f"{s['scene']} {s['context']}".lower() for s in scenes]
+    run("LabelNormalizer.context_hits", lambda: [warm.context_hits(b) for b in blobs], len(blobs))
+    run("experience cache key", lambda: [ac._experience_cache_key("openai", c) for c in canon], len(canon))
+
+    from api import auth_utils
+
+    token = auth_utils.create_access_token({"sub": "bench-user", "email": "bench@example.com"})
+    run("verify_token (signature check)", lambda: auth_utils.verify_token(token), 1)
+    auth_utils.verify_token_cached(token)
+    run("verify_token_cached (hit)", lambda: auth_utils.verify_token_cached(token), 1)
+
+    try:
+        photo = _jpeg(1600, 1200)
+    except ImportError:
+        photo = None
+    if photo is not None:
+        run("image_digest (1600x1200 jpeg)", lambda: ac.image_digest(photo), 1)
+        run("preprocess_image (1600x1200 jpeg)", lambda: ac.preprocess_image(photo), 1)
+
+    emit({"benchmark": "micro", "meta": metadata(), "scenes": len(scenes), "results": results}, args.out)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
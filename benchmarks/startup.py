@@ -0,0 +1,180 @@
+"""Cold-start benchmark: import time per module and time to first /health.
+
+Every measurement runs in a fresh interpreter so nothing is already imported.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 5 --max-import-ms 800 --max-health-ms 2500
+
+Prints a JSON report; exits with status 1 when a --max-* threshold is exceeded,
+so it can guard against import-time side effects creeping back in.
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+from common import SRC, emit, metadata
+
+MODULES = [
+    "api.metrics",
+    "api.transport",
+    "api.supabase_utils",
+    "api.agents_chain",
+    "api.fastapi_example",
+    "api.user_api",
+]
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = SRC + (os.pathsep + env["PYTHONPATH"] if env.get("PYTHONPATH") else "")
+    env.setdefault("PYTHONDONTWRITEBYTECODE", "1")
+    return env
+
+
+def _importtime(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=SRC, env=_env(), capture_output=True, text=True, timeout=120,
+    )
+
+
+def _parse_importtime(stderr: str) -> List[tuple]:
+    """(cumulative us, module) per line of -X importtime output."""
+    out = []
+    for line in stderr.splitlines():
+        # "import time:   self [us] | cumulative | imported package"
+        parts = line.split("|")
+        if len(parts) != 3 or not line.startswith("import time:"):
+            continue
+        try:
+            out.append((int(parts[1]), parts[2].strip()))
+        except ValueError:
+            continue
+    return out
+
+
+_baseline: Optional[set] = None
+
+
+def _interpreter_modules() -> set:
+    """Modules a bare interpreter already imports (site, encodings, ...)."""
+    global _baseline
+    if _baseline is None:
+        _baseline = {name for _, name in _parse_importtime(_importtime("import time").stderr)}
+    return _baseline
+
+
+def import_time(module: str) -> Dict[str, Any]:
+    """Wall time of `import module` in a new interpreter, plus its heaviest
+    transitive imports from -X importtime (cumulative microseconds)."""
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {module}; "
+        "print(round((time.perf_counter() - t) * 1000, 2))"
+    )
+    proc = _importtime(code)
+    if proc.returncode != 0:
+        tail = (proc.stderr.strip().splitlines() or ["import failed"])[-1]
+        return {"ok": False, "error": tail}
+    skip = _interpreter_modules()
+    heaviest = sorted((t for t in _parse_importtime(proc.stderr) if t[1] not in skip), reverse=True)
+    return {
+        "ok": True,
+        "ms": float(proc.stdout.strip().splitlines()[-1]),
+        "top": [{"module": name, "ms": round(us / 1000, 2)} for us, name in heaviest[:5]],
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_health(app: str, path: str, timeout: float) -> Optional[float]:
+    """Milliseconds from launching uvicorn until `path` returns 200 (None on timeout)."""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}{path}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=SRC, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                return None
+            try:
+                with urllib.request.urlopen(url, timeout=1) as resp:
+                    if resp.status == 200:
+                        return round((time.perf_counter() - start) * 1000, 2)
+            except Exception:
+                time.sleep(0.01)
+        return None
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def _summary(values: List[float]) -> Dict[str, Any]:
+    if not values:
+        return {"runs": 0}
+    return {
+        "runs": len(values),
+        "median_ms": round(statistics.median(values), 2),
+        "min_ms": round(min(values), 2),
+        "max_ms": round(max(values), 2),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--modules", nargs="*", default=MODULES)
+    parser.add_argument("--app", default="api.fastapi_example:app")
+    parser.add_argument("--path", default="/health")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--max-import-ms", type=float, help="fail if any module's median import exceeds this")
+    parser.add_argument("--max-health-ms", type=float, help="fail if median time to first 200 exceeds this")
+    parser.add_argument("--out", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    report: Dict[str, Any] = {"benchmark": "startup", "meta": metadata(), "imports": {}, "health": {}}
+    failures: List[str] = []
+
+    for module in args.modules:
+        runs = [import_time(module) for _ in range(args.runs)]
+        ok = [r for r in runs if r["ok"]]
+        if not ok:
+            report["imports"][module] = {"error": runs[-1]["error"]}
+            failures.append(f"{module}: import failed")
+            continue
+        entry = _summary([r["ms"] for r in ok])
+        entry["top"] = ok[-1]["top"]
+        report["imports"][module] = entry
+        if args.max_import_ms is not None and entry["median_ms"] > args.max_import_ms:
+            failures.append(f"{module}: import {entry['median_ms']} ms > {args.max_import_ms} ms")
+
+    times = [t for t in (time_to_health(args.app, args.path, args.timeout) for _ in range(args.runs)) if t is not None]
+    report["health"] = {"app": args.app, "path": args.path, **_summary(times)}
+    if not times:
+        failures.append(f"{args.app}: {args.path} never answered")
+    elif args.max_health_ms is not None and report["health"]["median_ms"] > args.max_health_ms:
+        failures.append(f"{args.app}: first {args.path} {report['health']['median_ms']} ms > {args.max_health_ms} ms")
+
+    report["failures"] = failures
+    emit(report, args.out)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,47 +1,370 @@
 import os
+import io
 import json
 import base64
-from typing import Dict, Any, List
+import asyncio
+import hashlib
+import contextvars
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Callable
 import importlib
 
+from .result_cache import ResultCache, content_key
+from .provider_router import ProviderRouter
+from .resilience import CircuitBreaker, budget, deadline, remaining
+from . import transport
+from .metrics import STAGES, timed, timed_await, record_tokens
+from .label_normalizer import LabelNormalizer, LabelSource
+
 # Provider flags (optional)
 USE_OPENAI = bool(os.getenv("OPENAI_API_KEY"))
-USE_GEMINI = bool(os.getenv("GEMINI_API_KEY")) and not USE_OPENAI
+USE_GEMINI = bool(os.getenv("GEMINI_API_KEY"))
+
+OPENAI_MODEL = "gpt-4o-mini"
+GEMINI_MODEL = "gemini-1.5-flash"
+
+# Timeouts: every provider call gets an explicit timeout (never the SDK's
+# multi-minute default) and no SDK-level retries; fallback/hedging across
+# providers is the retry. analyze_image_chain runs under CHAIN_DEADLINE_S and
+# each stage takes its share of whatever is left.
+PROVIDER_TIMEOUT_S = float(os.getenv("PROVIDER_TIMEOUT_S", "20"))
+PROVIDER_MAX_RETRIES = int(os.getenv("PROVIDER_MAX_RETRIES", "0"))
+CHAIN_DEADLINE_S = float(os.getenv("CHAIN_DEADLINE_S", "30"))
+STAGE_BUDGET = {"perception": 0.6, "refine": 0.5, "experience": 1.0}
+MIN_CALL_TIMEOUT = 0.5
+
+breakers = {
+    name: CircuitBreaker(
+        name,
+        failure_threshold=int(os.getenv("BREAKER_FAILURES", "5")),
+        reset_timeout=float(os.getenv("BREAKER_RESET_S", "30")),
+    )
+    for name in ("openai", "gemini")
+}
 
-# Optional clients
-_openai_client = None
-_genai_model = None
+# Optional clients, built on first use (or by the startup warm-up task) so that
+# importing this module stays cheap: no SDK imports, no network, no config.
+_clients_lock = threading.Lock()
+_openai_pair: Any = None  # (sync, async) once built; False if unavailable
+_genai_model: Any = None  # GenerativeModel once built; False if unavailable
 
-# Lazy import OpenAI client
-if USE_OPENAI:
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1"
+# Optional Gemini endpoint override (proxy or local stand-in); uses the REST transport.
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+
+
+def _build_openai() -> Any:
+    global USE_OPENAI
     try:
         openai_mod = importlib.import_module("openai")
         OpenAI = getattr(openai_mod, "OpenAI", None)
-        if OpenAI is not None:
-            _openai_client = OpenAI()
-        else:
+        AsyncOpenAI = getattr(openai_mod, "AsyncOpenAI", None)
+        if OpenAI is None:
             USE_OPENAI = False
+            return False
+        # Shared keep-alive pools from transport
+        sync_client = OpenAI(max_retries=PROVIDER_MAX_RETRIES, http_client=transport.get_client("openai"))
+        async_client = None
+        if AsyncOpenAI is not None:
+            async_client = AsyncOpenAI(max_retries=PROVIDER_MAX_RETRIES, http_client=transport.get_async_client("openai"))
+        return (sync_client, async_client)
     except Exception:
-        _openai_client = None
         USE_OPENAI = False
+        return False
 
-# Lazy import Gemini client
-if USE_GEMINI:
+
+def _build_gemini() -> Any:
+    global USE_GEMINI
     try:
         genai = importlib.import_module("google.generativeai")
         configure = getattr(genai, "configure", None)
         GenerativeModel = getattr(genai, "GenerativeModel", None)
-        if configure and GenerativeModel:
-            configure(api_key=os.getenv("GEMINI_API_KEY"))
-            _genai_model = GenerativeModel(
-                model_name="gemini-1.5-flash",
-                generation_config={"response_mime_type": "application/json"}
+        if not (configure and GenerativeModel):
+            USE_GEMINI = False
+            return False
+        if GEMINI_API_ENDPOINT:
+            configure(
+                api_key=os.getenv("GEMINI_API_KEY"),
+                transport="rest",
+                client_options={"api_endpoint": GEMINI_API_ENDPOINT},
             )
         else:
-            USE_GEMINI = False
+            configure(api_key=os.getenv("GEMINI_API_KEY"))
+        return GenerativeModel(
+            model_name=GEMINI_MODEL,
+            generation_config={"response_mime_type": "application/json"}
+        )
     except Exception:
-        _genai_model = None
         USE_GEMINI = False
+        return False
+
+
+def _openai_clients() -> Any:
+    global _openai_pair
+    if _openai_pair is None:
+        with _clients_lock:
+            if _openai_pair is None:
+                _openai_pair = _build_openai() if USE_OPENAI else False
+    return _openai_pair or (None, None)
+
+
+def _openai() -> Any:
+    return _openai_clients()[0]
+
+
+def _openai_async() -> Any:
+    return _openai_clients()[1]
+
+
+def _gemini() -> Any:
+    global _genai_model
+    if _genai_model is None:
+        with _clients_lock:
+            if _genai_model is None:
+                _genai_model = _build_gemini() if USE_GEMINI else False
+    return _genai_model or None
+
+
+def reset_provider_clients() -> None:
+    """Drop built clients; the next use rebuilds them (on fresh transport pools after shutdown)."""
+    global _openai_pair, _genai_model
+    with _clients_lock:
+        _openai_pair = None
+        _genai_model = None
+
+
+def _build_provider_clients() -> None:
+    _openai_clients()
+    _gemini()
+
+
+async def _ensure_provider_clients() -> None:
+    """Build the provider clients, or wait for the warm-up task's build, on a
+    worker thread. The build imports SDKs under _clients_lock, so async paths
+    must never trigger it from the event loop."""
+    if _openai_pair is None or _genai_model is None:
+        await _run_sync(_build_provider_clients)
+
+
+async def warm_provider_connections() -> None:
+    """Startup task: import/build provider clients in a worker thread and open
+    the OpenAI connection, so neither lands on the first request. Gemini uses
+    its own gRPC channel."""
+    await _ensure_provider_clients()
+    if _openai_async() is not None:
+        await transport.warm("openai", OPENAI_BASE_URL)
+
+
+# Async fallback: when only sync provider clients exist, blocking calls run on
+# a small dedicated pool so they never stall the event loop.
+SYNC_FALLBACK_WORKERS = int(os.getenv("AGENTS_SYNC_WORKERS", "8"))
+_sync_executor: Optional[ThreadPoolExecutor] = None
+_sync_executor_lock = threading.Lock()
+
+
+def _get_sync_executor() -> ThreadPoolExecutor:
+    global _sync_executor
+    if _sync_executor is None:
+        with _sync_executor_lock:
+            if _sync_executor is None:
+                _sync_executor = ThreadPoolExecutor(
+                    max_workers=max(1, SYNC_FALLBACK_WORKERS),
+                    thread_name_prefix="agents-sync",
+                )
+    return _sync_executor
+
+
+async def _run_sync(fn: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking call on the bounded fallback pool, keeping contextvars."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_get_sync_executor(), ctx.run, fn, *args)
+
+
+# Image preprocessing: vision models don't need 4000px photos, and upload to the
+# provider dominates latency. The original bytes still go to storage untouched.
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "1") != "0"
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg").lower()  # jpeg | webp
+
+_PIL: Any = None
+
+
+def _get_pil() -> Any:
+    global _PIL
+    if _PIL is None:
+        try:
+            _PIL = (importlib.import_module("PIL.Image"), importlib.import_module("PIL.ImageOps"))
+        except Exception:
+            _PIL = False
+    return _PIL
+
+
+def image_mime(data: bytes) -> Optional[str]:
+    """Sniff the image type from magic bytes."""
+    head = bytes(data[:16])
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1", b"heim", b"heis"):
+        return "image/heic"
+    return None
+
+
+def preprocess_image(image_bytes: bytes) -> bytes:
+    """Decode once, downscale to IMAGE_MAX_EDGE, drop EXIF and re-encode.
+
+    Returns the input unchanged when Pillow is missing, decoding fails, or the
+    image is already small enough in the target format. Input carrying EXIF
+    (GPS, device info) is always re-encoded, even if that comes out larger.
+    """
+    pil = _get_pil()
+    if not IMAGE_PREPROCESS or not pil:
+        return image_bytes
+    Image, ImageOps = pil
+    fmt = "WEBP" if IMAGE_FORMAT == "webp" else "JPEG"
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        had_exif = bool(img.info.get("exif"))
+        if img.format == fmt and max(img.size) <= IMAGE_MAX_EDGE and not had_exif:
+            return image_bytes
+        if img.format == "JPEG":
+            # Let libjpeg decode at a reduced DCT scale instead of full size.
+            img.draft("RGB", (IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format=fmt, quality=IMAGE_QUALITY, optimize=fmt == "JPEG")
+        data = out.getvalue()
+        if had_exif or len(data) < len(image_bytes):
+            return data
+        return image_bytes
+    except Exception:
+        return image_bytes
+
+
+# Perception results keyed by image content. Bump PERCEPTION_PROMPT_VERSION
+# whenever the perception/refine prompts or post rules change meaningfully.
+PERCEPTION_PROMPT_VERSION = "p2"
+perception_cache = ResultCache(
+    "perception",
+    max_entries=int(os.getenv("PERCEPTION_CACHE_SIZE", "512")),
+    max_bytes=int(os.getenv("PERCEPTION_CACHE_MAX_BYTES", str(4 * 1024 * 1024))),
+    ttl=float(os.getenv("PERCEPTION_CACHE_TTL", "86400")),
+    db_path=os.getenv("PERCEPTION_CACHE_DB") or None,
+)
+
+
+def image_digest(image_bytes: bytes) -> str:
+    """sha256 hex of the raw upload; callers that already hashed can pass it along."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def _provider_tag() -> str:
+    # From the key flags, not the clients: computing a cache key must not build them.
+    tags = []
+    if USE_OPENAI:
+        tags.append(f"openai:{OPENAI_MODEL}")
+    if USE_GEMINI:
+        tags.append(f"gemini:{GEMINI_MODEL}")
+    return "+".join(tags) or "stub"
+
+
+def _perception_cache_key(digest: str) -> str:
+    return content_key(
+        "perception", digest, _provider_tag(), PERCEPTION_PROMPT_VERSION, SINGLE_PASS_PERCEPTION
+    )
+
+
+def _cacheable_perception(scene_json: Dict[str, Any]) -> bool:
+    # Stub answers mean every provider failed; don't pin them for a day.
+    return bool(scene_json) and scene_json.get("provider") != "stub"
+
+
+def _is_timeout(exc: BaseException) -> bool:
+    name = type(exc).__name__.lower()
+    return isinstance(exc, asyncio.TimeoutError) or "timeout" in name or "deadline" in name
+
+
+def _stage_timeout(stage: str) -> float:
+    t = budget(STAGE_BUDGET.get(stage, 1.0), PROVIDER_TIMEOUT_S)
+    return t if t >= MIN_CALL_TIMEOUT else 0.0
+
+
+def _call_provider(provider: str, stage: str, call: Callable[[float], Any]) -> Any:
+    """Run call(timeout) under the provider's breaker and the stage budget; None on skip/failure."""
+    breaker = breakers[provider]
+    timeout = _stage_timeout(stage)
+    if timeout <= 0 or not breaker.allow():
+        return None
+    try:
+        with timed(f"provider.{provider}.{stage}"):
+            resp = call(timeout)
+    except Exception as e:
+        _record_call_failure(breaker, e)
+        return None
+    breaker.record_success()
+    _record_usage(provider, stage, resp)
+    return resp
+
+
+async def _call_provider_async(provider: str, stage: str, call: Callable[[float], Any]) -> Any:
+    breaker = breakers[provider]
+    timeout = _stage_timeout(stage)
+    if timeout <= 0 or not breaker.allow():
+        return None
+    try:
+        with timed(f"provider.{provider}.{stage}"):
+            resp = await asyncio.wait_for(call(timeout), timeout)
+    except asyncio.CancelledError:
+        # Lost a hedge race or the request went away; not the provider's fault.
+        breaker.record_neutral()
+        raise
+    except Exception as e:
+        _record_call_failure(breaker, e)
+        return None
+    breaker.record_success()
+    _record_usage(provider, stage, resp)
+    return resp
+
+
+def _record_usage(provider: str, stage: str, resp: Any) -> None:
+    """Token counts from an OpenAI (usage) or Gemini (usage_metadata) response."""
+    try:
+        usage = getattr(resp, "usage", None)
+        if usage is not None:
+            record_tokens(provider, stage, usage.prompt_tokens or 0, usage.completion_tokens or 0)
+            return
+        meta = getattr(resp, "usage_metadata", None)
+        if meta is not None:
+            record_tokens(provider, stage, meta.prompt_token_count or 0, meta.candidates_token_count or 0)
+    except Exception:
+        pass
+
+
+# Slack for "the chain deadline is used up" when a timeout surfaces.
+DEADLINE_SLACK_S = 0.05
+
+
+def _record_call_failure(breaker: CircuitBreaker, exc: BaseException) -> None:
+    # Only a timeout that coincides with the end of the chain deadline is ours;
+    # a stage budget running out while the deadline still has time left means
+    # the provider hung, and that has to count towards opening the breaker.
+    left = remaining()
+    if _is_timeout(exc) and left is not None and left <= DEADLINE_SLACK_S:
+        breaker.record_neutral()
+    else:
+        breaker.record_failure()
 
 
 STRICT_SPEC = (
@@ -49,6 +372,23 @@ STRICT_SPEC = (
     "objects MUST be array of either strings or {name, confidence} where confidence in 0..1."
 )
 
+# Single-pass mode: ask for the brush/mouse subtype in the first request so the
+# refine hop (a second full image upload) only runs when the model says it
+# could not decide.
+SINGLE_PASS_PERCEPTION = os.getenv("PERCEPTION_SINGLE_PASS", "1") != "0"
+
+STRUCTURED_SPEC = (
+    "Return ONLY JSON with keys: objects (array), scene (string), context (string), certainty (number 0..1), ambiguous (array of strings). "
+    "objects MUST be array of {name, confidence, subtype} where confidence in 0..1. "
+    "For ambiguous objects set subtype: a 'brush' is paintbrush, toothbrush or hairbrush (decide from head/handle/usage cues); "
+    "a 'mouse' is 'computer mouse' unless it is clearly an animal (tail, fur), then 'animal'. "
+    "Use subtype null for unambiguous objects. If you truly cannot decide a subtype, leave it null and put the generic name in ambiguous."
+)
+
+
+def _perception_spec() -> str:
+    return STRUCTURED_SPEC if SINGLE_PASS_PERCEPTION else STRICT_SPEC
+
 
 def _normalize_objects(objs: Any) -> List[str]:  # type: ignore
     names: List[str] = []
@@ -56,82 +396,133 @@ def _normalize_objects(objs: Any) -> List[str]:  # type: ignore
         for x in objs:
             if isinstance(x, str):
                 names.append(x.lower().strip())
+            elif isinstance(x, dict) and x.get("subtype"):
+                names.append(str(x["subtype"]).lower().strip())
             elif isinstance(x, dict) and "name" in x:
                 names.append(str(x["name"]).lower().strip())
     return list({n for n in names if n})
 
 
-def _perception_via_openai(image_bytes: bytes) -> Dict[str, Any]:
-    assert _openai_client is not None
-    b64 = base64.b64encode(image_bytes).decode("utf-8")
+def _parse_perception(text: Optional[str], provider: str) -> Dict[str, Any]:
+    if not text:
+        return {}
+    data = json.loads(text)
+    objects = _normalize_objects(data.get("objects", []))
+    out = {
+        "objects": objects,
+        "scene": data.get("scene", ""),
+        "context": data.get("context", ""),
+        "certainty": data.get("certainty", 0.6),
+        "provider": provider,
+    }
+    ambiguous = data.get("ambiguous")
+    if isinstance(ambiguous, list) and ambiguous:
+        out["ambiguous"] = [str(a).lower().strip() for a in ambiguous if str(a).strip()]
+    return out
+
+
+def _gemini_text(resp: Any) -> Optional[str]:
+    text = None
+    if hasattr(resp, "text") and resp.text:
+        text = resp.text
+    elif hasattr(resp, "candidates") and resp.candidates:
+        cand = resp.candidates[0]
+        parts = getattr(getattr(cand, "content", None), "parts", None)
+        if parts and len(parts) > 0 and hasattr(parts[0], "text"):
+            text = parts[0].text
+    return text
+
+
+def _image_data_url(image_bytes: bytes) -> str:
+    with timed("chain.encode"):
+        b64 = base64.b64encode(image_bytes).decode("utf-8")
+        return f"data:{image_mime(image_bytes) or 'image/jpeg'};base64,{b64}"
+
+
+def _openai_perception_request(image_bytes: bytes) -> Dict[str, Any]:
     prompt = (
         "Analyze the image accurately. "
-        + STRICT_SPEC
+        + _perception_spec()
         + " Be careful with ambiguous items. If a 'brush' appears, decide if it's a paintbrush vs toothbrush vs hairbrush based on head/handle/usage cues. "
           "If a 'mouse' appears, prefer 'bilgisayar faresi' unless it's clearly an animal (tail, fur). "
           "Avoid guessing construction materials unless obvious (bricks, cement bags, helmets). If you are not confident about the scene, describe only the main objects and leave the scene/context blank. Do not guess."
     )
-    try:
-        resp = _openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You produce concise JSON only."},
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}},
-                    ],
-                },
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.1,
-        )
-        content = resp.choices[0].message.content or "{}"
-        data = json.loads(content)
-        objects = _normalize_objects(data.get("objects", []))
-        return {
-            "objects": objects,
-            "scene": data.get("scene", ""),
-            "context": data.get("context", ""),
-            "certainty": data.get("certainty", 0.6),
-            "provider": "openai",
-        }
-    except Exception:
-        return {}
+    return dict(
+        model=OPENAI_MODEL,
+        messages=[
+            {"role": "system", "content": "You produce concise JSON only."},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": _image_data_url(image_bytes)}},
+                ],
+            },
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.1,
+    )
 
 
-def _perception_via_gemini(image_bytes: bytes) -> Dict[str, Any]:
-    assert _genai_model is not None
+def _gemini_perception_request(image_bytes: bytes) -> List[Any]:
     prompt = (
         "Analyze the image accurately. "
-        + STRICT_SPEC
+        + _perception_spec()
         + " Be careful with ambiguous items (brush types, computer mouse vs animal)."
     )
+    return [
+        prompt,
+        {"mime_type": image_mime(image_bytes) or "image/jpeg", "data": image_bytes},
+    ]
+
+
+def _perception_via_openai(image_bytes: bytes) -> Dict[str, Any]:
+    assert _openai() is not None
     try:
-        resp = _genai_model.generate_content([
-            prompt,
-            {"mime_type": "image/jpeg", "data": image_bytes},
-        ])
-        text = None
-        if hasattr(resp, "text") and resp.text:
-            text = resp.text
-        elif hasattr(resp, "candidates") and resp.candidates:
-            cand = resp.candidates[0]
-            parts = getattr(getattr(cand, "content", None), "parts", None)
-            if parts and len(parts) > 0 and hasattr(parts[0], "text"):
-                text = parts[0].text
-        if not text:
+        resp = _call_provider("openai", "perception", lambda t: _openai().chat.completions.create(
+            timeout=t, **_openai_perception_request(image_bytes)))
+        if resp is None:
             return {}
-        data = json.loads(text)
-        objects = _normalize_objects(data.get("objects", []))
-        return {
-            "objects": objects,
-            "scene": data.get("scene", ""),
-            "context": data.get("context", ""),
-            "certainty": data.get("certainty", 0.6),
-            "provider": "gemini",
-        }
+        return _parse_perception(resp.choices[0].message.content or "{}", "openai")
+    except Exception:
+        return {}
+
+
+def _perception_via_gemini(image_bytes: bytes) -> Dict[str, Any]:
+    assert _gemini() is not None
+    try:
+        resp = _call_provider("gemini", "perception", lambda t: _gemini().generate_content(
+            _gemini_perception_request(image_bytes), request_options={"timeout": t}))
+        if resp is None:
+            return {}
+        return _parse_perception(_gemini_text(resp), "gemini")
+    except Exception:
+        return {}
+
+
+async def _perception_via_openai_async(image_bytes: bytes) -> Dict[str, Any]:
+    if _openai_async() is None:
+        return await _run_sync(_perception_via_openai, image_bytes)
+    try:
+        resp = await _call_provider_async("openai", "perception", lambda t: _openai_async().chat.completions.create(
+            timeout=t, **_openai_perception_request(image_bytes)))
+        if resp is None:
+            return {}
+        return _parse_perception(resp.choices[0].message.content or "{}", "openai")
+    except Exception:
+        return {}
+
+
+async def _perception_via_gemini_async(image_bytes: bytes) -> Dict[str, Any]:
+    assert _gemini() is not None
+    if not hasattr(_gemini(), "generate_content_async"):
+        return await _run_sync(_perception_via_gemini, image_bytes)
+    try:
+        resp = await _call_provider_async("gemini", "perception", lambda t: _gemini().generate_content_async(
+            _gemini_perception_request(image_bytes), request_options={"timeout": t}))
+        if resp is None:
+            return {}
+        return _parse_perception(_gemini_text(resp), "gemini")
     except Exception:
         return {}
 
@@ -149,17 +540,48 @@ def _perception_stub(image_bytes: bytes) -> Dict[str, Any]:
 
 
 def perception_agent(image_bytes: bytes) -> Dict[str, Any]:
-    if USE_OPENAI and _openai_client is not None:
+    if _openai() is not None:
         data = _perception_via_openai(image_bytes)
         if data:
             return data
-    if USE_GEMINI and _genai_model is not None:
+    if _gemini() is not None:
         data = _perception_via_gemini(image_bytes)
         if data:
             return data
     return _perception_stub(image_bytes)
 
 
+# One router per stage: perception, refine and experience have very different
+# latency profiles, so each keeps its own histograms and hedge thresholds.
+perception_router = ProviderRouter("perception")
+refine_router = ProviderRouter("refine")
+experience_router = ProviderRouter("experience")
+
+
+def _available_providers() -> List[str]:
+    providers = []
+    if _openai() is not None:
+        providers.append("openai")
+    if _gemini() is not None:
+        providers.append("gemini")
+    # Skip providers whose breaker is open instead of waiting on them.
+    return [p for p in providers if not breakers[p].is_open()]
+
+
+async def perception_agent_async(image_bytes: bytes) -> Dict[str, Any]:
+    calls = {
+        "openai": lambda: _perception_via_openai_async(image_bytes),
+        "gemini": lambda: _perception_via_gemini_async(image_bytes),
+    }
+    await _ensure_provider_clients()
+    providers = _available_providers()
+    if providers:
+        won = await perception_router.race({p: calls[p] for p in providers})
+        if won:
+            return won[1]
+    return _perception_stub(image_bytes)
+
+
 # Disambiguate & normalize labels stage
 CANON = {
     "paintbrush": ["paint brush", "brush", "boya fırçası", "fırça", "şerit fırça"],
@@ -169,27 +591,48 @@ CANON = {
 }
 
 
+# Context keywords for _post_rules
+_KEYBOARD_CTX = {"keyboard", "klavye", "laptop", "bilgisayar", "monitor", "masa", "desk"}
+_PAINT_CTX = {"paint", "boya", "canvas", "tuval", "palette", "palet"}
+_HAIR_CTX = {"hair", "saç", "tarak", "mirror", "ayna"}
+_TOOTH_CTX = {"tooth", "diş", "bathroom", "banyo", "lavabo"}
+
+
+# Label rules are compiled once into automata (label_normalizer). Setting
+# LABELS_PATH to a JSON file {"canon": {...}, "context": {...}} overrides them;
+# the file is re-read when its mtime changes (checked every LABELS_RELOAD_S).
+def _default_labels() -> LabelNormalizer:
+    return LabelNormalizer(
+        CANON,
+        {"paint": _PAINT_CTX, "hair": _HAIR_CTX, "tooth": _TOOTH_CTX, "keyboard": _KEYBOARD_CTX},
+    )
+
+
+labels = LabelSource(
+    _default_labels,
+    path=os.getenv("LABELS_PATH") or None,
+    reload_interval=float(os.getenv("LABELS_RELOAD_S", "5")),
+)
+
+
+def reload_labels(path: Optional[str] = None) -> LabelNormalizer:
+    """Rebuild the label normalizer now (e.g. after editing CANON or the labels file)."""
+    return labels.reload(path)
+
+
 def _rule_normalize(objs: List[str]) -> List[str]:
+    normalize = labels.get().normalize
     out: List[str] = []
     for o in objs:
-        low = o.lower()
-        mapped = None
-        for k, vals in CANON.items():
-            if low == k or any(low == v for v in vals) or any(v in low for v in vals):
-                mapped = k
-                break
-        out.append(mapped or low)
-    # simple cleanups
-    cleaned = []
-    for x in out:
+        x = normalize(o)
+        # simple cleanups
         if x == "brush":
-            cleaned.append("paintbrush")
+            x = "paintbrush"
         elif x == "mouse":
-            cleaned.append("computer mouse")
-        else:
-            cleaned.append(x)
+            x = "computer mouse"
+        out.append(x)
     # de-dup
-    return list(dict.fromkeys(cleaned))
+    return list(dict.fromkeys(out))
 
 
 def normalize_scene(scene: Dict[str, Any]) -> Dict[str, Any]:
@@ -204,55 +647,75 @@ def normalize_scene(scene: Dict[str, Any]) -> Dict[str, Any]:
 
 # Experience agent using available providers, else fallback
 
-def _experience_with_openai(scene_json: Dict[str, Any]) -> str:
-    assert _openai_client is not None
-    
+UI_UX_KEYWORDS = {"arayüz", "ekran görüntüsü", "uygulama", "buton", "web sitesi", "ui", "ux"}
+
+UI_UX_STYLE = (
+    "Sen 'Voyager' adında, deneyimli bir UI/UX uzmanısın. "
+    "Sana sunulan ekran görüntüsünü analiz et ve kullanıcı deneyimini iyileştirecek 3 somut, pratik ve uygulanabilir öneri sun. "
+    "Önerilerin net, kısa ve profesyonel bir dilde olsun. Her öneri '• ' ile başlasın. "
+    "Örnek: '• Ana eylem butonu daha belirgin hale getirilebilir.' veya '• Font boyutu okunabilirliği artırmak için büyütülebilir.'"
+)
+
+VOYAGER_STYLE = (
+    "Sen 'Voyager' adında, bilge ve deneyimli bir gezginsin. "
+    "Gördüğün sahneyi, sanki orayı daha önce defalarca ziyaret etmiş gibi, insani ve samimi bir tonda yorumla. "
+    "3 madde halinde pratik, yaşanmışlık içeren ve başkasının kolayca fark edemeyeceği tavsiyeler ver. "
+    "Gerçekçi ol, abartma, pazarlama dili kullanma. Her madde '• ' ile başlasın.\n"
+    "DİKKAT: Kesinlikle alakasız konulara girme. Örneğin, ofis malzemeleri görüyorsan piknik hakkında konuşma. Sadece sağlanan JSON bağlamına sadık kal."
+)
+
+GEMINI_EXPERIENCE_STYLE = "Türkçe, 3 kısa maddeyle gerçek kullanıcı yorumlarına benzer, abartısız öneriler yaz."
+
+
+def _experience_style(scene_json: Dict[str, Any]) -> str:
     # Check for UI/UX context
-    ui_ux_keywords = {"arayüz", "ekran görüntüsü", "uygulama", "buton", "web sitesi", "ui", "ux"}
     objects_lower = {str(o).lower() for o in scene_json.get("objects", [])}
-    is_ui_ux_context = any(keyword in objects_lower for keyword in ui_ux_keywords)
-
-    if is_ui_ux_context:
-        style = (
-            "Sen 'Voyager' adında, deneyimli bir UI/UX uzmanısın. "
-            "Sana sunulan ekran görüntüsünü analiz et ve kullanıcı deneyimini iyileştirecek 3 somut, pratik ve uygulanabilir öneri sun. "
-            "Önerilerin net, kısa ve profesyonel bir dilde olsun. Her öneri '• ' ile başlasın. "
-            "Örnek: '• Ana eylem butonu daha belirgin hale getirilebilir.' veya '• Font boyutu okunabilirliği artırmak için büyütülebilir.'"
-        )
-    else:
-        style = (
-            "Sen 'Voyager' adında, bilge ve deneyimli bir gezginsin. "
-            "Gördüğün sahneyi, sanki orayı daha önce defalarca ziyaret etmiş gibi, insani ve samimi bir tonda yorumla. "
-            "3 madde halinde pratik, yaşanmışlık içeren ve başkasının kolayca fark edemeyeceği tavsiyeler ver. "
-            "Gerçekçi ol, abartma, pazarlama dili kullanma. Her madde '• ' ile başlasın.\n"
-            "DİKKAT: Kesinlikle alakasız konulara girme. Örneğin, ofis malzemeleri görüyorsan piknik hakkında konuşma. Sadece sağlanan JSON bağlamına sadık kal."
-        )
+    is_ui_ux_context = any(keyword in objects_lower for keyword in UI_UX_KEYWORDS)
+    return UI_UX_STYLE if is_ui_ux_context else VOYAGER_STYLE
+
 
+def _openai_experience_request(scene_json: Dict[str, Any]) -> Dict[str, Any]:
+    style = _experience_style(scene_json)
     prompt = (
         f"{style}\nBağlam: {json.dumps(scene_json, ensure_ascii=False)}\n"
         "Cevap formatı: her satır '• ' ile başlasın."
     )
+    return dict(
+        model=OPENAI_MODEL,
+        messages=[
+            {"role": "system", "content": "You are Voyager, a helpful and wise guide."},
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0.4, # Slightly increased for more creative/human-like responses
+    )
+
+
+def _gemini_experience_request(scene_json: Dict[str, Any]) -> List[Any]:
+    return [
+        GEMINI_EXPERIENCE_STYLE,
+        json.dumps(scene_json, ensure_ascii=False),
+    ]
+
+
+def _experience_with_openai(scene_json: Dict[str, Any]) -> str:
+    assert _openai() is not None
     try:
-        resp = _openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are Voyager, a helpful and wise guide."},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.4, # Slightly increased for more creative/human-like responses
-        )
+        resp = _call_provider("openai", "experience", lambda t: _openai().chat.completions.create(
+            timeout=t, **_openai_experience_request(scene_json)))
+        if resp is None:
+            return ""
         return resp.choices[0].message.content or ""
     except Exception:
         return ""
 
 
 def _experience_with_gemini(scene_json: Dict[str, Any]) -> str:
-    assert _genai_model is not None
+    assert _gemini() is not None
     try:
-        resp = _genai_model.generate_content([
-            "Türkçe, 3 kısa maddeyle gerçek kullanıcı yorumlarına benzer, abartısız öneriler yaz.",
-            json.dumps(scene_json, ensure_ascii=False),
-        ])
+        resp = _call_provider("gemini", "experience", lambda t: _gemini().generate_content(
+            _gemini_experience_request(scene_json), request_options={"timeout": t}))
+        if resp is None:
+            return ""
         if hasattr(resp, "text") and resp.text:
             return resp.text
         return ""
@@ -260,8 +723,103 @@ def _experience_with_gemini(scene_json: Dict[str, Any]) -> str:
         return ""
 
 
-def experience_agent(scene_json: Dict[str, Any]) -> str:
-    scene_json = normalize_scene(scene_json)
+async def _experience_with_openai_async(scene_json: Dict[str, Any]) -> str:
+    if _openai_async() is None:
+        return await _run_sync(_experience_with_openai, scene_json)
+    try:
+        resp = await _call_provider_async("openai", "experience", lambda t: _openai_async().chat.completions.create(
+            timeout=t, **_openai_experience_request(scene_json)))
+        if resp is None:
+            return ""
+        return resp.choices[0].message.content or ""
+    except Exception:
+        return ""
+
+
+async def _experience_with_gemini_async(scene_json: Dict[str, Any]) -> str:
+    assert _gemini() is not None
+    if not hasattr(_gemini(), "generate_content_async"):
+        return await _run_sync(_experience_with_gemini, scene_json)
+    try:
+        resp = await _call_provider_async("gemini", "experience", lambda t: _gemini().generate_content_async(
+            _gemini_experience_request(scene_json), request_options={"timeout": t}))
+        if resp is None:
+            return ""
+        if hasattr(resp, "text") and resp.text:
+            return resp.text
+        return ""
+    except Exception:
+        return ""
+
+
+# Experience memo: many scenes collapse to the same objects/scene/context after
+# normalize_scene/_post_rules, and /refine-analysis resubmits near-identical
+# object lists. Providers are called with the canonical scene so a cached
+# answer is exactly what the provider would have been asked for.
+EXPERIENCE_PROMPT_VERSION = "e1"
+EXPERIENCE_CERTAINTY_BUCKET = float(os.getenv("EXPERIENCE_CERTAINTY_BUCKET", "0.1"))
+experience_cache = ResultCache(
+    "experience",
+    max_entries=int(os.getenv("EXPERIENCE_CACHE_SIZE", "2048")),
+    max_bytes=int(os.getenv("EXPERIENCE_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+    ttl=float(os.getenv("EXPERIENCE_CACHE_TTL", str(7 * 86400))),
+    db_path=os.getenv("EXPERIENCE_CACHE_DB") or None,
+)
+
+
+def _canonical_scene(scene_json: Dict[str, Any]) -> Dict[str, Any]:
+    objs = scene_json.get("objects", [])
+    if not isinstance(objs, list):
+        objs = []
+    names = sorted({str(o).lower().strip() for o in objs if str(o).strip()})
+    certainty = float(scene_json.get("certainty", 0.6) or 0.6)
+    bucket = EXPERIENCE_CERTAINTY_BUCKET
+    if bucket > 0:
+        certainty = round(round(certainty / bucket) * bucket, 2)
+    return {
+        "objects": names,
+        "scene": str(scene_json.get("scene", "") or "").strip(),
+        "context": str(scene_json.get("context", "") or "").strip(),
+        "certainty": certainty,
+    }
+
+
+def _experience_cache_key(provider: str, canon: Dict[str, Any]) -> str:
+    if provider == "openai":
+        model, style = OPENAI_MODEL, _experience_style(canon)
+    else:
+        model, style = GEMINI_MODEL, GEMINI_EXPERIENCE_STYLE
+    # The style text is part of the key, so editing a prompt invalidates old entries.
+    return content_key(
+        "experience", provider, model, EXPERIENCE_PROMPT_VERSION, style,
+        json.dumps(canon, ensure_ascii=False, sort_keys=True),
+    )
+
+
+def _memo_experience(provider: str, canon: Dict[str, Any], call: Callable[[Dict[str, Any]], str]) -> str:
+    key = _experience_cache_key(provider, canon)
+    text = experience_cache.get(key)
+    if text is None:
+        text = call(canon)
+        if text:
+            experience_cache.set(key, text)
+    return text or ""
+
+
+def _memo_lookup(providers: List[str], canon: Dict[str, Any]) -> Optional[str]:
+    for provider in providers:
+        text = experience_cache.get(_experience_cache_key(provider, canon))
+        if text:
+            return text
+    return None
+
+
+def invalidate_experience_cache() -> None:
+    """Drop all memoized experiences (e.g. after a prompt rollout)."""
+    experience_cache.clear()
+
+
+def _low_certainty_experience(scene_json: Dict[str, Any]) -> Optional[str]:
     certainty = float(scene_json.get("certainty", 0.6) or 0.6)
     if certainty < 0.45:
         # Low confidence: be cautious
@@ -271,14 +829,10 @@ def experience_agent(scene_json: Dict[str, Any]) -> str:
             f"• Yakalanan ipuçları: {objs}. Emin olmadığım için ihtiyatlı yorum yapıyorum.\n"
             "• Ben olsam netlik için bir-iki kare daha çekip karşılaştırırdım."
         )
-    if USE_OPENAI and _openai_client is not None:
-        text = _experience_with_openai(scene_json)
-        if text:
-            return text
-    if USE_GEMINI and _genai_model is not None:
-        text = _experience_with_gemini(scene_json)
-        if text:
-            return text
+    return None
+
+
+def _fallback_experience(scene_json: Dict[str, Any]) -> str:
     objs = ", ".join(scene_json.get("objects", [])) or "çeşitli ögeler"
     scene = scene_json.get("scene", "Bir sahne")
     return (
@@ -288,18 +842,253 @@ def experience_agent(scene_json: Dict[str, Any]) -> str:
     )
 
 
+def experience_agent(scene_json: Dict[str, Any]) -> str:
+    scene_json = normalize_scene(scene_json)
+    cautious = _low_certainty_experience(scene_json)
+    if cautious is not None:
+        return cautious
+    canon = _canonical_scene(scene_json)
+    if _openai() is not None:
+        text = _memo_experience("openai", canon, _experience_with_openai)
+        if text:
+            return text
+    if _gemini() is not None:
+        text = _memo_experience("gemini", canon, _experience_with_gemini)
+        if text:
+            return text
+    return _fallback_experience(scene_json)
+
+
+async def experience_agent_async(scene_json: Dict[str, Any]) -> str:
+    scene_json = normalize_scene(scene_json)
+    cautious = _low_certainty_experience(scene_json)
+    if cautious is not None:
+        return cautious
+    canon = _canonical_scene(scene_json)
+    await _ensure_provider_clients()
+    providers = _available_providers()
+    # Memo hits are answered before routing so they don't skew provider latency stats.
+    text = _memo_lookup(providers, canon)
+    if text:
+        return text
+    calls = {
+        "openai": lambda: _experience_with_openai_async(canon),
+        "gemini": lambda: _experience_with_gemini_async(canon),
+    }
+    if providers:
+        won = await experience_router.race({p: calls[p] for p in providers})
+        if won:
+            provider, text = won
+            experience_cache.set(_experience_cache_key(provider, canon), text)
+            return text
+    return _fallback_experience(scene_json)
+
+
+# --- Streaming experience ---
+# on_delta(text) receives each piece as the provider produces it; on_delta(None)
+# means a provider failed mid-stream and what was sent so far must be discarded
+# (the next provider, or the fallback text, starts over).
+DeltaSink = Callable[[Optional[str]], None]
+
+
+def _openai_delta(chunk: Any) -> str:
+    choices = getattr(chunk, "choices", None)
+    if choices:
+        return getattr(choices[0].delta, "content", None) or ""
+    return ""
+
+
+def _gemini_delta(chunk: Any) -> str:
+    try:
+        return _gemini_text(chunk) or ""
+    except Exception:
+        return ""  # chunks without text parts (e.g. only finish_reason)
+
+
+async def _close_stream(stream: Any, chunks: Any) -> None:
+    """Release a provider stream's HTTP response (OpenAI AsyncStream.close,
+    Gemini's async iterator aclose) so its pooled connection goes back now,
+    not when the object is garbage collected."""
+    for obj in (stream, chunks):
+        close = getattr(obj, "close", None) or getattr(obj, "aclose", None)
+        if close is None:
+            continue
+        try:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            pass
+        return
+
+
+async def _call_provider_stream(
+    provider: str, stage: str, open_stream: Callable[[float], Any], delta: Callable[[Any], str], on_delta: DeltaSink
+) -> Optional[str]:
+    """Streaming _call_provider_async: forward deltas to on_delta, return the full
+    text, or None if the provider was skipped or failed. The stage timeout bounds
+    the whole stream, not just the first chunk."""
+    breaker = breakers[provider]
+    timeout = _stage_timeout(stage)
+    if timeout <= 0 or not breaker.allow():
+        return None
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    end = started + timeout
+    parts: List[str] = []
+    last = None
+    stream = chunks = None
+    try:
+        with timed(f"provider.{provider}.{stage}.stream"):
+            stream = await asyncio.wait_for(open_stream(timeout), timeout)
+            chunks = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, end - loop.time()))
+                except StopAsyncIteration:
+                    break
+                last = chunk
+                text = delta(chunk)
+                if text:
+                    if not parts:
+                        STAGES.record(f"provider.{provider}.{stage}.first_token", loop.time() - started)
+                    parts.append(text)
+                    on_delta(text)
+    except asyncio.CancelledError:
+        breaker.record_neutral()
+        raise
+    except Exception as e:
+        _record_call_failure(breaker, e)
+        if parts:
+            on_delta(None)
+        return None
+    finally:
+        if stream is not None:
+            await _close_stream(stream, chunks)
+    breaker.record_success()
+    # OpenAI reports usage on the final chunk; Gemini's last chunk has the totals.
+    _record_usage(provider, stage, last)
+    return "".join(parts) or None
+
+
+async def _stream_experience_openai(canon: Dict[str, Any], on_delta: DeltaSink) -> Optional[str]:
+    if _openai_async() is None:
+        text = await _run_sync(_experience_with_openai, canon)
+        if text:
+            on_delta(text)
+        return text or None
+    return await _call_provider_stream(
+        "openai", "experience",
+        lambda t: _openai_async().chat.completions.create(
+            timeout=t, stream=True, stream_options={"include_usage": True}, **_openai_experience_request(canon)),
+        _openai_delta, on_delta,
+    )
+
+
+async def _stream_experience_gemini(canon: Dict[str, Any], on_delta: DeltaSink) -> Optional[str]:
+    if not hasattr(_gemini(), "generate_content_async"):
+        text = await _run_sync(_experience_with_gemini, canon)
+        if text:
+            on_delta(text)
+        return text or None
+    return await _call_provider_stream(
+        "gemini", "experience",
+        lambda t: _gemini().generate_content_async(
+            _gemini_experience_request(canon), stream=True, request_options={"timeout": t}),
+        _gemini_delta, on_delta,
+    )
+
+
+async def experience_agent_stream(scene_json: Dict[str, Any], on_delta: DeltaSink) -> str:
+    """experience_agent_async, with the text delivered through on_delta as it is
+    generated. Providers are tried one at a time in the experience router's
+    order (no hedging once tokens flow); cached, cautious and fallback texts
+    arrive as one delta. Returns the final text."""
+    scene_json = normalize_scene(scene_json)
+    cautious = _low_certainty_experience(scene_json)
+    if cautious is not None:
+        on_delta(cautious)
+        return cautious
+    canon = _canonical_scene(scene_json)
+    await _ensure_provider_clients()
+    providers = _available_providers()
+    text = _memo_lookup(providers, canon)
+    if text:
+        on_delta(text)
+        return text
+    streams = {"openai": _stream_experience_openai, "gemini": _stream_experience_gemini}
+    for provider in experience_router.order(providers):
+        text = await streams[provider](canon, on_delta)
+        if text:
+            experience_cache.set(_experience_cache_key(provider, canon), text)
+            return text
+    text = _fallback_experience(scene_json)
+    on_delta(text)
+    return text
+
+
 def verifier_agent(scene_json: Dict[str, Any], experience_text: str) -> str:
     # Simple pass-through; could add safety/grounding checks later
     return experience_text
 
 
-def analyze_image_chain(image_bytes: bytes) -> Dict[str, Any]:
-    scene_json = refined_perception_agent(image_bytes)
-    experience_text = experience_agent(scene_json)
-    verified_text = verifier_agent(scene_json, experience_text)
+def analyze_image_chain(
+    image_bytes: bytes, image_hash: Optional[str] = None, deadline_s: Optional[float] = None
+) -> Dict[str, Any]:
+    with deadline(deadline_s or CHAIN_DEADLINE_S):
+        with timed("chain.perception"):
+            scene_json = refined_perception_agent(image_bytes, image_hash)
+        with timed("chain.experience"):
+            experience_text = experience_agent(scene_json)
+    with timed("chain.verify"):
+        verified_text = verifier_agent(scene_json, experience_text)
+    return {"perception": scene_json, "experience": verified_text}
+
+
+async def analyze_image_chain_async(
+    image_bytes: bytes, image_hash: Optional[str] = None, deadline_s: Optional[float] = None
+) -> Dict[str, Any]:
+    """Non-blocking analyze_image_chain for async endpoints."""
+    with deadline(deadline_s or CHAIN_DEADLINE_S):
+        scene_json = await timed_await("chain.perception", refined_perception_agent_async(image_bytes, image_hash))
+        experience_text = await timed_await("chain.experience", experience_agent_async(scene_json))
+    with timed("chain.verify"):
+        verified_text = verifier_agent(scene_json, experience_text)
+    return {"perception": scene_json, "experience": verified_text}
+
+
+async def analyze_image_chain_stream(
+    image_bytes: bytes,
+    on_event: Callable[[str, Any], None],
+    image_hash: Optional[str] = None,
+    deadline_s: Optional[float] = None,
+) -> Dict[str, Any]:
+    """analyze_image_chain_async that reports progress: on_event("perception", scene)
+    as soon as perception is done, then on_event("delta", text or None) while the
+    experience streams (see experience_agent_stream). Returns the same result."""
+    with deadline(deadline_s or CHAIN_DEADLINE_S):
+        scene_json = await timed_await("chain.perception", refined_perception_agent_async(image_bytes, image_hash))
+        on_event("perception", scene_json)
+        experience_text = await timed_await(
+            "chain.experience", experience_agent_stream(scene_json, lambda d: on_event("delta", d))
+        )
+    with timed("chain.verify"):
+        verified_text = verifier_agent(scene_json, experience_text)
     return {"perception": scene_json, "experience": verified_text}
 
 
+def provider_stats() -> Dict[str, Any]:
+    """Breaker states, router latency/error stats, cache and refine counters."""
+    return {
+        "breakers": {name: b.snapshot() for name, b in breakers.items()},
+        "routers": {
+            r.stage: r.snapshot() for r in (perception_router, refine_router, experience_router)
+        },
+        "caches": {c.name: c.stats() for c in (perception_cache, experience_cache)},
+        "refine": refine_stats(),
+    }
+
+
 # --- Ambiguity & refinement additions ---
 AMBIGUOUS_BASE = {"brush", "mouse"}
 
@@ -311,90 +1100,166 @@ REFINE_PROMPT = (
 
 
 def _needs_refine(scene_json: Dict[str, Any]) -> bool:
+    if scene_json.get("ambiguous"):
+        return True
     objs = [o.lower() for o in scene_json.get("objects", []) if isinstance(o, str)]
     return any(o in AMBIGUOUS_BASE for o in objs)
 
 
+# How often the second (refine) vision hop still happens, per analyzed image.
+_refine_stats = {"perceptions": 0, "refines": 0}
+_refine_stats_lock = threading.Lock()
+
+
+def _record_refine(refined: bool) -> None:
+    with _refine_stats_lock:
+        _refine_stats["perceptions"] += 1
+        if refined:
+            _refine_stats["refines"] += 1
+
+
+def refine_stats() -> Dict[str, Any]:
+    with _refine_stats_lock:
+        total = _refine_stats["perceptions"]
+        refines = _refine_stats["refines"]
+    return {
+        "perceptions": total,
+        "refines": refines,
+        "refine_rate": (refines / total) if total else 0.0,
+        "single_pass": SINGLE_PASS_PERCEPTION,
+    }
+
+
+def _openai_refine_request(scene_json: Dict[str, Any], image_bytes: bytes) -> Dict[str, Any]:
+    prompt = (
+        REFINE_PROMPT + "\nÖn Algı JSON:" + json.dumps(scene_json, ensure_ascii=False)
+    )
+    return dict(
+        model=OPENAI_MODEL,
+        messages=[
+            {"role": "system", "content": "You refine existing JSON only."},
+            {"role": "user", "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": _image_data_url(image_bytes)}},
+            ]},
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.0,
+    )
+
+
+def _gemini_refine_request(scene_json: Dict[str, Any], image_bytes: bytes) -> List[Any]:
+    return [
+        REFINE_PROMPT + "\nÖn Algı JSON:" + json.dumps(scene_json, ensure_ascii=False),
+        {"mime_type": image_mime(image_bytes) or "image/jpeg", "data": image_bytes},
+    ]
+
+
+def _parse_refine(text: Optional[str], scene_json: Dict[str, Any]) -> Dict[str, Any]:
+    if text:
+        data = json.loads(text)
+        if data.get("objects"):
+            data["objects"] = _normalize_objects(data["objects"])
+            return data
+    return scene_json
+
+
 def _refine_with_openai(scene_json: Dict[str, Any], image_bytes: bytes) -> Dict[str, Any]:
-    if not (_openai_client and USE_OPENAI):
+    if _openai() is None:
         return scene_json
     try:
-        b64 = base64.b64encode(image_bytes).decode("utf-8")
-        prompt = (
-            REFINE_PROMPT + "\nÖn Algı JSON:" + json.dumps(scene_json, ensure_ascii=False)
-        )
-        resp = _openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You refine existing JSON only."},
-                {"role": "user", "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}},
-                ]},
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.0,
-        )
-        content = resp.choices[0].message.content or "{}"
-        data = json.loads(content)
-        if data.get("objects"):
-            return data
+        resp = _call_provider("openai", "refine", lambda t: _openai().chat.completions.create(
+            timeout=t, **_openai_refine_request(scene_json, image_bytes)))
+        if resp is None:
+            return scene_json
+        return _parse_refine(resp.choices[0].message.content or "{}", scene_json)
     except Exception:
         pass
     return scene_json
 
 
 def _refine_with_gemini(scene_json: Dict[str, Any], image_bytes: bytes) -> Dict[str, Any]:
-    if not (_genai_model and USE_GEMINI):
+    if _gemini() is None:
         return scene_json
     try:
-        resp = _genai_model.generate_content([
-            REFINE_PROMPT + "\nÖn Algı JSON:" + json.dumps(scene_json, ensure_ascii=False),
-            {"mime_type": "image/jpeg", "data": image_bytes},
-        ])
-        text = getattr(resp, "text", None)
-        if not text and getattr(resp, "candidates", None):
-            cand = resp.candidates[0]
-            parts = getattr(getattr(cand, "content", None), "parts", None)
-            if parts and len(parts) > 0 and hasattr(parts[0], "text"):
-                text = parts[0].text
-        if text:
-            data = json.loads(text)
-            if data.get("objects"):
-                return data
+        resp = _call_provider("gemini", "refine", lambda t: _gemini().generate_content(
+            _gemini_refine_request(scene_json, image_bytes), request_options={"timeout": t}))
+        if resp is None:
+            return scene_json
+        return _parse_refine(_gemini_text(resp), scene_json)
     except Exception:
         pass
     return scene_json
 
 
-# Rule-based post adjustments using context keywords
-_KEYBOARD_CTX = {"keyboard", "klavye", "laptop", "bilgisayar", "monitor", "masa", "desk"}
-_PAINT_CTX = {"paint", "boya", "canvas", "tuval", "palette", "palet"}
-_HAIR_CTX = {"hair", "saç", "tarak", "mirror", "ayna"}
-_TOOTH_CTX = {"tooth", "diş", "bathroom", "banyo", "lavabo"}
+async def _refine_with_openai_async(scene_json: Dict[str, Any], image_bytes: bytes) -> Dict[str, Any]:
+    if _openai() is None:
+        return scene_json
+    if _openai_async() is None:
+        return await _run_sync(_refine_with_openai, scene_json, image_bytes)
+    try:
+        resp = await _call_provider_async("openai", "refine", lambda t: _openai_async().chat.completions.create(
+            timeout=t, **_openai_refine_request(scene_json, image_bytes)))
+        if resp is None:
+            return scene_json
+        return _parse_refine(resp.choices[0].message.content or "{}", scene_json)
+    except Exception:
+        pass
+    return scene_json
+
+
+async def _refine_with_gemini_async(scene_json: Dict[str, Any], image_bytes: bytes) -> Dict[str, Any]:
+    if _gemini() is None:
+        return scene_json
+    if not hasattr(_gemini(), "generate_content_async"):
+        return await _run_sync(_refine_with_gemini, scene_json, image_bytes)
+    try:
+        resp = await _call_provider_async("gemini", "refine", lambda t: _gemini().generate_content_async(
+            _gemini_refine_request(scene_json, image_bytes), request_options={"timeout": t}))
+        if resp is None:
+            return scene_json
+        return _parse_refine(_gemini_text(resp), scene_json)
+    except Exception:
+        pass
+    return scene_json
+
+
+async def _refine_async(scene_json: Dict[str, Any], image_bytes: bytes) -> Dict[str, Any]:
+    calls = {
+        "openai": lambda: _refine_with_openai_async(scene_json, image_bytes),
+        "gemini": lambda: _refine_with_gemini_async(scene_json, image_bytes),
+    }
+    await _ensure_provider_clients()
+    providers = _available_providers()
+    if providers:
+        # The refine helpers hand back the input unchanged when they fail.
+        won = await refine_router.race({p: calls[p] for p in providers}, lambda r: r is not scene_json)
+        if won:
+            return won[1]
+    return scene_json
 
 
+# Rule-based post adjustments using context keywords
 def _post_rules(scene_json: Dict[str, Any]) -> Dict[str, Any]:
     objs = [o.lower() for o in scene_json.get("objects", []) if isinstance(o, str)]
-    ctx_blob = (scene_json.get("scene", "") + " " + scene_json.get("context", "")).lower()
-    def has_any(words):
-        return any(w in ctx_blob for w in words)
+    hits = None
     fixed = []
     for o in objs:
         if o == "brush":
-            if has_any(_PAINT_CTX):
+            if hits is None:
+                ctx_blob = (scene_json.get("scene", "") + " " + scene_json.get("context", "")).lower()
+                hits = labels.get().context_hits(ctx_blob)
+            if "paint" in hits:
                 fixed.append("paintbrush")
-            elif has_any(_HAIR_CTX):
+            elif "hair" in hits:
                 fixed.append("hairbrush")
-            elif has_any(_TOOTH_CTX):
+            elif "tooth" in hits:
                 fixed.append("toothbrush")
             else:
                 fixed.append("paintbrush")  # varsayılan daha güvenli
         elif o == "mouse":
-            if has_any(_KEYBOARD_CTX):
-                fixed.append("computer mouse")
-            else:
-                fixed.append("computer mouse")  # hayvanı çok yanlışlama riskine karşı
+            # klavye bağlamı olsa da olmasa da: hayvanı çok yanlışlama riskine karşı
+            fixed.append("computer mouse")
         else:
             fixed.append(o)
     scene_json = dict(scene_json)
@@ -405,13 +1270,44 @@ def _post_rules(scene_json: Dict[str, Any]) -> Dict[str, Any]:
 # Patch perception_agent to include refinement
 orig_perception_agent = perception_agent
 
-def refined_perception_agent(image_bytes: bytes) -> Dict[str, Any]:
+def refined_perception_agent(image_bytes: bytes, image_hash: Optional[str] = None) -> Dict[str, Any]:
+    cache_key = _perception_cache_key(image_hash or image_digest(image_bytes))
+    cached = perception_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    with timed("chain.preprocess"):
+        image_bytes = preprocess_image(image_bytes)
     scene_json = orig_perception_agent(image_bytes)
-    if _needs_refine(scene_json):
-        if USE_OPENAI:
-            scene_json = _refine_with_openai(scene_json, image_bytes)
-        elif USE_GEMINI:
-            scene_json = _refine_with_gemini(scene_json, image_bytes)
+    refine = _needs_refine(scene_json)
+    if refine:
+        with timed("chain.refine"):
+            if USE_OPENAI:
+                scene_json = _refine_with_openai(scene_json, image_bytes)
+            elif USE_GEMINI:
+                scene_json = _refine_with_gemini(scene_json, image_bytes)
+    _record_refine(refine)
+    scene_json = normalize_scene(scene_json)
+    scene_json.pop("ambiguous", None)
+    scene_json = _post_rules(scene_json)
+    if _cacheable_perception(scene_json):
+        perception_cache.set(cache_key, scene_json)
+    return scene_json
+
+
+async def refined_perception_agent_async(image_bytes: bytes, image_hash: Optional[str] = None) -> Dict[str, Any]:
+    cache_key = _perception_cache_key(image_hash or image_digest(image_bytes))
+    cached = perception_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    image_bytes = await timed_await("chain.preprocess", _run_sync(preprocess_image, image_bytes))
+    scene_json = await perception_agent_async(image_bytes)
+    refine = _needs_refine(scene_json)
+    if refine:
+        scene_json = await timed_await("chain.refine", _refine_async(scene_json, image_bytes))
+    _record_refine(refine)
     scene_json = normalize_scene(scene_json)
+    scene_json.pop("ambiguous", None)
     scene_json = _post_rules(scene_json)
+    if _cacheable_perception(scene_json):
+        perception_cache.set(cache_key, scene_json)
     return scene_json
@@ -1,9 +1,26 @@
+import os
+import time
+import hashlib
 import jwt
 from datetime import datetime, timedelta
+from typing import Optional
+
+from .metrics import timed
+from .result_cache import ResultCache
 
 SECRET_KEY = "supersecretkey"
 ALGORITHM = "HS256"
 
+# Verified claims keyed by the token's sha256 (the raw token is never stored).
+# An entry lives until the token's exp, at most AUTH_CACHE_TTL seconds.
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "3600"))
+token_cache = ResultCache(
+    "verified_tokens",
+    max_entries=int(os.getenv("AUTH_CACHE_SIZE", "10000")),
+    max_bytes=int(os.getenv("AUTH_CACHE_MAX_BYTES", str(4 * 1024 * 1024))),
+    ttl=AUTH_CACHE_TTL,
+)
+
 def create_access_token(data: dict, expires_delta: timedelta = timedelta(hours=12)):
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
@@ -16,3 +33,18 @@ def verify_token(token: str):
         return payload
     except jwt.PyJWTError:
         return None
+
+def verify_token_cached(token: str) -> Optional[dict]:
+    """verify_token, checking the signature only the first time a token is seen."""
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    payload = token_cache.get(key)
+    if payload is not None:
+        return payload
+    with timed("auth.verify"):
+        payload = verify_token(token)
+    if payload:
+        exp = payload.get("exp")
+        ttl = AUTH_CACHE_TTL if not isinstance(exp, (int, float)) else min(AUTH_CACHE_TTL, exp - time.time())
+        if ttl > 0:
+            token_cache.set(key, payload, ttl=ttl)
+    return payload
@@ -1,12 +1,54 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from .agents_chain import analyze_image_chain, experience_agent
-from .supabase_utils import upload_image_and_get_url, save_analysis_record, _get_client, update_analysis_record
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from .agents_chain import (
+    analyze_image_chain_async,
+    analyze_image_chain_stream,
+    experience_agent_async,
+    experience_agent_stream,
+    experience_cache,
+    perception_cache,
+    provider_stats,
+    reset_provider_clients,
+    warm_provider_connections,
+)
+from . import transport
+from .supabase_utils import (
+    upload_image_and_get_url,
+    save_analysis_record,
+    save_analysis_records,
+    get_client_async,
+    update_analysis_record,
+    merge_analysis_record,
+    enqueue_insert,
+    insert_rows,
+    close_writers,
+    write_stats,
+    fetch_discover_page,
+    decode_cursor,
+    DISCOVER_SORTS,
+    storage_index,
+)
+from .feed_cache import FeedCache
+from .upload_utils import read_upload, IngestedUpload, UploadLimitMiddleware, MAX_UPLOAD_BYTES, MULTIPART_OVERHEAD
+from .job_queue import JobQueue, QueueFull, make_backend
+from .metrics import STAGES, TOKENS, SERVER_TIMING, ServerTimingMiddleware, render_prometheus, timed, timed_await
 import os
-from typing import Dict, Any, List
+import json
+import asyncio
+from typing import Dict, Any, Awaitable, Callable, List, Optional, Tuple
 
 app = FastAPI()
 
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "10"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# Added before CORS so CORS wraps it and browsers can read the 413.
+app.add_middleware(
+    UploadLimitMiddleware,
+    paths={"/analyze-photos/batch": BATCH_MAX_FILES * (MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD)},
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -15,131 +57,417 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if SERVER_TIMING:
+    app.add_middleware(ServerTimingMiddleware)
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+
+@app.get("/stats")
+async def stats():
+    """Provider breakers/latency, caches, stage timings and job queue state."""
+    return {
+        **provider_stats(),
+        "stages": STAGES.snapshot(),
+        "tokens": TOKENS.snapshot(),
+        "jobs": analysis_jobs.stats(),
+        "writes": write_stats(),
+        "discover_cache": discover_cache.stats(),
+        "http": transport.stats(),
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text format: stage latency histograms and provider token counters."""
+    return PlainTextResponse(
+        render_prometheus(caches=[perception_cache, experience_cache, storage_index]),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+async def _no_upload() -> None:
+    return None
+
+
+async def _infer_and_store(
+    upload: IngestedUpload, on_event: Optional[Callable[[str, Any], None]] = None
+) -> Tuple[Dict[str, Any], Optional[str]]:
+    """Run the analysis chain and the storage upload concurrently; they only meet at insert time."""
+    if on_event is None:
+        chain = analyze_image_chain_async(upload.content, upload.sha256)
+    else:
+        chain = analyze_image_chain_stream(upload.content, on_event, upload.sha256)
+    inference = timed_await("analyze.inference", chain)
+    if os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_BUCKET"):
+        storage = timed_await(
+            "analyze.upload", run_in_threadpool(
+                upload_image_and_get_url, upload.content, upload.filename, upload.sha256, upload.content_type
+            )
+        )
+    else:
+        storage = _no_upload()
+    result, public_url = await asyncio.gather(inference, storage)
+    return result, public_url
+
+
+def _analysis_record(result: Dict[str, Any], public_url: Optional[str]) -> Dict[str, Any]:
+    return {
+        "image_url": public_url,
+        "experience": result.get("experience"),
+        "perception": result.get("perception"),
+        "confidence": result.get("perception", {}).get("certainty", 0.8),
+    }
+
+
+async def _analyze_and_save(
+    upload: IngestedUpload, on_event: Optional[Callable[[str, Any], None]] = None
+) -> Dict[str, Any]:
+    with timed("analyze.total"):
+        result, public_url = await _infer_and_store(upload, on_event)
+        record = _analysis_record(result, public_url)
+
+        with timed("analyze.insert"):
+            saved_record = await run_in_threadpool(save_analysis_record, record)
+
+    if not saved_record:
+        raise HTTPException(status_code=500, detail="Failed to save analysis record.")
+
+    return saved_record
+
+
+# Optional job mode: accept the upload, return a job id, let clients poll /jobs/{id}.
+ANALYZE_JOB_MODE = os.getenv("ANALYZE_JOB_MODE", "0") == "1"
+JOB_LONG_POLL_MAX = 30.0
+
+analysis_jobs = JobQueue(
+    _analyze_and_save,
+    backend=make_backend(),
+    workers=int(os.getenv("JOB_WORKERS", "4")),
+    max_pending=int(os.getenv("JOB_MAX_PENDING", "100")),
+)
+
+
+_background: set = set()
+
+
+def _spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+@app.on_event("startup")
+async def _startup():
+    # Client setup runs in the background so /health answers immediately.
+    _spawn(warm_provider_connections())
+    _spawn(get_client_async())
+    analysis_jobs.start()
+
+
+@app.on_event("shutdown")
+async def _shutdown():
+    for task in list(_background):
+        task.cancel()
+    await analysis_jobs.stop()
+    await run_in_threadpool(close_writers)
+    await transport.shutdown()
+    reset_provider_clients()
+
+
 @app.post("/analyze-photo/")
-async def analyze_photo(file: UploadFile = File(...)):
+async def analyze_photo(file: UploadFile = File(...), job: Optional[bool] = None):
     try:
-        image_bytes = await file.read()
-        result = analyze_image_chain(image_bytes)
-
-        public_url = None
-        if os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_BUCKET"):
-            public_url = upload_image_and_get_url(image_bytes, file.filename or "photo.jpg")
-
-        record: Dict[str, Any] = {
-            "image_url": public_url,
-            "experience": result.get("experience"),
-            "perception": result.get("perception"),
-            "confidence": result.get("perception", {}).get("certainty", 0.8),
-        }
-        
-        saved_record = save_analysis_record(record)
-
-        if not saved_record:
-            raise HTTPException(status_code=500, detail="Failed to save analysis record.")
-
-        return saved_record
+        upload = await read_upload(file)
+        if ANALYZE_JOB_MODE if job is None else job:
+            try:
+                job_id = analysis_jobs.submit(upload)
+            except QueueFull:
+                raise HTTPException(status_code=503, detail="Analysis queue is full.", headers={"Retry-After": "5"})
+            return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued"})
+        return await _analyze_and_save(upload)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/refine-analysis")
-async def refine_analysis(payload: Dict[str, Any]):
+
+def _sse(event: str, data: Any) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n".encode("utf-8")
+
+
+def _event_stream(run: Callable[[Callable[[str, Any], None]], Awaitable[Dict[str, Any]]]) -> StreamingResponse:
+    """Server-Sent Events for run(emit): every emit(event, data) is forwarded, then
+    "done" with run's result or "error". A "delta" with None goes out as "reset"
+    (drop the text received so far). run is a background task, so it still
+    finishes and persists its result if the client disconnects."""
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def emit(event: str, data: Any) -> None:
+        if event == "delta":
+            queue.put_nowait(("delta", {"text": data}) if data is not None else ("reset", {}))
+        else:
+            queue.put_nowait((event, data))
+
+    async def produce() -> None:
+        try:
+            queue.put_nowait(("done", await run(emit)))
+        except HTTPException as e:
+            queue.put_nowait(("error", {"status": e.status_code, "detail": e.detail}))
+        except Exception as e:
+            queue.put_nowait(("error", {"status": 500, "detail": str(e)}))
+
+    _spawn(produce())
+
+    async def stream():
+        while True:
+            event, data = await queue.get()
+            yield _sse(event, data)
+            if event in ("done", "error"):
+                return
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/analyze-photo/stream")
+async def analyze_photo_stream(file: UploadFile = File(...)):
+    """/analyze-photo/ as Server-Sent Events: "perception" as soon as the scene is
+    known, "delta" pieces of the experience text while it is generated, then
+    "done" with the saved row."""
+    upload = await read_upload(file)
+    return _event_stream(lambda emit: _analyze_and_save(upload, emit))
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0.0):
+    """Job status; wait=N long-polls up to N seconds (max 30) for completion."""
+    job_state = await analysis_jobs.wait(job_id, min(max(wait, 0.0), JOB_LONG_POLL_MAX))
+    if job_state is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job_state
+
+def _ndjson(obj: Dict[str, Any]) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+@app.post("/analyze-photos/batch")
+async def analyze_photos_batch(files: List[UploadFile] = File(...)):
+    """Analyze several photos concurrently, streaming one NDJSON line per image as it
+    finishes, then a single bulk insert of all rows: a final "saved" line, or
+    "save_failed" if the insert did not go through. The work runs as a background
+    task, so the rows are still saved if the client disconnects."""
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_FILES} files per batch.")
+
+    # Uploads are closed once this handler returns, so read them all up front.
+    uploads: List[Tuple[int, Optional[IngestedUpload], Optional[HTTPException]]] = []
+    for index, f in enumerate(files):
+        try:
+            uploads.append((index, await read_upload(f), None))
+        except HTTPException as e:
+            uploads.append((index, None, e))
+
+    sem = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run_one(index: int, upload: IngestedUpload) -> Tuple[int, Dict[str, Any], Optional[Dict[str, Any]]]:
+        async with sem:
+            try:
+                result, public_url = await _infer_and_store(upload)
+            except Exception as e:
+                return index, {"index": index, "filename": upload.filename, "status": "error", "detail": str(e)}, None
+        record = _analysis_record(result, public_url)
+        line = {"index": index, "filename": upload.filename, "status": "ok", **record}
+        return index, line, record
+
+    async def produce() -> None:
+        records: List[Tuple[int, Dict[str, Any]]] = []
+        try:
+            for fut in asyncio.as_completed([run_one(i, u) for i, u, _ in uploads if u is not None]):
+                index, line, record = await fut
+                if record is not None:
+                    records.append((index, record))
+                queue.put_nowait(line)
+            records.sort(key=lambda r: r[0])
+            saved = await run_in_threadpool(save_analysis_records, [r for _, r in records]) if records else []
+            if records and not saved:
+                raise RuntimeError("Failed to save analysis records.")
+            queue.put_nowait({
+                "status": "saved",
+                "saved": [
+                    {"index": index, "id": row.get("id")}
+                    for (index, _), row in zip(records, saved)
+                ],
+            })
+        except Exception as e:
+            queue.put_nowait({"status": "save_failed", "detail": str(e), "indices": [i for i, _ in records]})
+
+    _spawn(produce())
+
+    async def stream():
+        for index, upload, error in uploads:
+            if error is not None:
+                yield _ndjson({"index": index, "filename": files[index].filename, "status": "error", "detail": error.detail})
+        while True:
+            line = await queue.get()
+            yield _ndjson(line)
+            if line.get("status") in ("saved", "save_failed"):
+                return
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+async def _apply_correction(payload: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """Validate a refine request and store the corrected objects; returns (analysis_id, new scene)."""
     analysis_id = payload.get("analysis_id")
     corrected_objects = payload.get("corrected_objects")
     
     if not analysis_id or not isinstance(corrected_objects, list):
         raise HTTPException(status_code=400, detail="Missing analysis_id or corrected_objects")
 
+    client = await get_client_async()
+    if not client:
+        raise HTTPException(status_code=500, detail="Could not connect to database.")
+
+    # 1. Store the corrected objects and read back the merged perception (one round trip)
+    row = await run_in_threadpool(
+        merge_analysis_record, analysis_id, objects=corrected_objects, certainty=0.95
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Analysis not found.")
+
+    # 2. Create a new scene JSON with corrected objects, keeping scene/context
+    current_perception = row.get("perception") or {}
+    return analysis_id, {
+        "objects": corrected_objects,
+        "scene": current_perception.get("scene", "bir sahne"),
+        "context": current_perception.get("context", "genel bağlam"),
+        "certainty": 0.95,  # User-corrected, so high certainty
+        "provider": current_perception.get("provider", "refined"),
+    }
+
+
+@app.post("/refine-analysis")
+async def refine_analysis(payload: Dict[str, Any]):
     try:
-        # 1. Fetch existing perception to keep scene/context
-        client = _get_client()
-        if not client:
-            raise HTTPException(status_code=500, detail="Could not connect to database.")
-        
-        db_response = client.table("analyses").select("perception").eq("id", analysis_id).limit(1).execute()
-        if not db_response.data:
-            raise HTTPException(status_code=404, detail="Analysis not found.")
-
-        # 2. Create a new scene JSON with corrected objects
-        current_perception = db_response.data[0].get("perception") or {}
-        new_scene_json = {
-            "objects": corrected_objects,
-            "scene": current_perception.get("scene", "bir sahne"),
-            "context": current_perception.get("context", "genel bağlam"),
-            "certainty": 0.95,  # User-corrected, so high certainty
-            "provider": current_perception.get("provider", "refined"),
-        }
+        analysis_id, new_scene_json = await _apply_correction(payload)
 
         # 3. Regenerate experience with the new scene
-        new_experience = experience_agent(new_scene_json)
-
-        # 4. Update the record in Supabase
-        update_analysis_record(
-            analysis_id=analysis_id,
-            objects=corrected_objects,
-            experience=new_experience,
-            certainty=0.95
-        )
+        new_experience = await experience_agent_async(new_scene_json)
+
+        # 4. Store the new experience
+        await run_in_threadpool(update_analysis_record, analysis_id, experience=new_experience)
 
         return {"success": True, "experience": new_experience, "perception": new_scene_json}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/refine-analysis/stream")
+async def refine_analysis_stream(payload: Dict[str, Any]):
+    """/refine-analysis as Server-Sent Events ("perception", "delta"..., "done");
+    the experience is saved once the stream completes."""
+    try:
+        analysis_id, new_scene_json = await _apply_correction(payload)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def run(emit: Callable[[str, Any], None]) -> Dict[str, Any]:
+        emit("perception", new_scene_json)
+        new_experience = await experience_agent_stream(new_scene_json, lambda d: emit("delta", d))
+        await run_in_threadpool(update_analysis_record, analysis_id, experience=new_experience)
+        return {"success": True, "experience": new_experience, "perception": new_scene_json}
+
+    return _event_stream(run)
+
+
+async def _record_event(table: str, row: Dict[str, Any]) -> None:
+    """Queue a small insert for the write-behind buffer; write it inline if the buffer is full."""
+    if not await get_client_async() or enqueue_insert(table, row):
+        return
+    try:
+        await run_in_threadpool(insert_rows, table, [row])
+    except Exception:
+        pass
+
 
 @app.post("/feedback")
 async def feedback(payload: Dict[str, Any]):
-    client = _get_client()
-    if client:
-        try:
-            client.table("feedback").insert({
-                "analysis_id": payload.get("analysis_id"),
-                "feedback": payload.get("feedback"),
-            }).execute()
-        except Exception:
-            pass
+    await _record_event("feedback", {
+        "analysis_id": payload.get("analysis_id"),
+        "feedback": payload.get("feedback"),
+    })
     return {"ok": True}
 
 @app.post("/like")
 async def like(payload: Dict[str, Any]):
-    client = _get_client()
-    if client:
-        try:
-            client.table("likes").insert({
-                "analysis_id": payload.get("analysis_id"),
-            }).execute()
-        except Exception:
-            pass
+    await _record_event("likes", {
+        "analysis_id": payload.get("analysis_id"),
+    })
     return {"ok": True}
 
 @app.post("/correction")
 async def correction(payload: Dict[str, Any]):
-    client = _get_client()
-    if client:
-        try:
-            # optional: store corrections in feedback table
-            client.table("feedback").insert({
-                "analysis_id": payload.get("analysis_id"),
-                "feedback": f"CORRECTION|original={payload.get('original')}|corrected={payload.get('corrected')}"
-            }).execute()
-        except Exception:
-            pass
+    # optional: store corrections in feedback table
+    await _record_event("feedback", {
+        "analysis_id": payload.get("analysis_id"),
+        "feedback": f"CORRECTION|original={payload.get('original')}|corrected={payload.get('corrected')}"
+    })
     return {"ok": True}
 
+DISCOVER_PAGE_MAX = 50
+DISCOVER_MAX_HOURS = 24 * 30
+discover_cache = FeedCache(
+    ttl=float(os.getenv("DISCOVER_CACHE_TTL", "5")),
+    stale=float(os.getenv("DISCOVER_CACHE_STALE", "60")),
+)
+
+
 @app.get("/discover")
-async def discover():
+async def discover(
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    sort: str = "latest",
+    hours: Optional[int] = None,
+):
+    """Discover cards. sort=latest (default) or popular; hours limits popular to a recent window."""
+    limit = max(1, min(limit, DISCOVER_PAGE_MAX))
+    if sort not in DISCOVER_SORTS:
+        raise HTTPException(status_code=400, detail="Invalid sort.")
+    if hours is not None and not 1 <= hours <= DISCOVER_MAX_HOURS:
+        raise HTTPException(status_code=400, detail="Invalid hours.")
+    if cursor:
+        try:
+            decode_cursor(cursor, sort)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
     try:
-        client = _get_client()
-        if client:
-            data = client.table("analyses").select("*").order("created_at", desc=True).limit(20).execute()
-            return {"analyses": data.data}
+        if await get_client_async():
+            async def load():
+                return await run_in_threadpool(fetch_discover_page, limit, cursor, sort, hours)
+
+            if cursor:
+                page = await load()
+            else:
+                # first pages are what every app open asks for: serve them from memory
+                page = await discover_cache.get((sort, hours, limit), load)
+            if page is not None:
+                return page
     except Exception:
         pass
     return {
         "analyses": [
             {"user": "Ahmet K.", "category": "nature", "likes": 24, "image": "https://images.unsplash.com/photo-1506905925346-21bda4d32df4?w=200", "experience": "Sabah ışığı..."},
             {"user": "Elif S.", "category": "food", "likes": 18, "image": "https://images.unsplash.com/photo-1567620905732-2d1ec7ab7445?w=200", "experience": "Rezervasyon..."}
-        ]
+        ],
+        "next_cursor": None,
     }
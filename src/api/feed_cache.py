@@ -0,0 +1,81 @@
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class FeedCache:
+    """Async stale-while-revalidate cache for hot, slightly-stale-is-fine reads.
+
+    Within ttl an entry is served from memory. Between ttl and ttl + stale it
+    is still served, and one background refresh is started. Past that (or on
+    a miss) callers wait for a fetch; concurrent callers for the same key
+    share a single in-flight fetch. A failed background refresh keeps the
+    stale entry.
+    """
+
+    def __init__(self, ttl: float = 5.0, stale: float = 60.0, max_entries: int = 64):
+        self.ttl = ttl
+        self.stale = stale
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._inflight: Dict[Hashable, "asyncio.Future[Any]"] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _fetch(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> "asyncio.Future[Any]":
+        fut = self._inflight.get(key)
+        if fut is not None:
+            return fut
+
+        async def run() -> Any:
+            try:
+                value = await loader()
+                if len(self._entries) >= self.max_entries and key not in self._entries:
+                    self._entries.pop(next(iter(self._entries)))
+                self._entries[key] = (time.monotonic(), value)
+                return value
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self._inflight.pop(key, None)
+
+        fut = asyncio.ensure_future(run())
+        # background refreshes may have no awaiter; mark their errors retrieved
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = fut
+        return fut
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                self.hits += 1
+                return entry[1]
+            if age < self.ttl + self.stale:
+                self.stale_hits += 1
+                self._fetch(key, loader)
+                return entry[1]
+        self.misses += 1
+        # shield: a cancelled caller must not cancel the fetch others are waiting on
+        return await asyncio.shield(self._fetch(key, loader))
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": round((self.hits + self.stale_hits) / total, 4) if total else 0.0,
+        }
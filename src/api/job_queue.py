@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when max_pending jobs are already waiting."""
+
+
+class JobBackend:
+    """Stores job state (status/result/error). Pending payloads stay in JobQueue."""
+
+    def create(self, job_id: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class InMemoryJobBackend(JobBackend):
+    def __init__(self, max_jobs: int = 1000, ttl: float = 3600.0):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune_locked(self) -> None:
+        cutoff = time.time() - self.ttl
+        while self._jobs:
+            job_id, job = next(iter(self._jobs.items()))
+            finished = job["status"] in (DONE, FAILED)
+            if len(self._jobs) > self.max_jobs or (finished and job["updated_at"] < cutoff):
+                self._jobs.popitem(last=False)
+            else:
+                break
+
+    def create(self, job_id: str) -> Dict[str, Any]:
+        now = time.time()
+        job = {"id": job_id, "status": QUEUED, "result": None, "error": None, "created_at": now, "updated_at": now}
+        with self._lock:
+            self._jobs[job_id] = job
+            self._prune_locked()
+        return dict(job)
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields, updated_at=time.time())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+
+class SQLiteJobBackend(JobBackend):
+    def __init__(self, db_path: str, ttl: float = 3600.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("pragma journal_mode=wal")
+        self._db.execute(
+            "create table if not exists jobs ("
+            "id text primary key, status text, result text, error text, created_at real, updated_at real)"
+        )
+        # Jobs that were queued/running when the process died will never finish.
+        self._db.execute(
+            "update jobs set status = ?, error = ?, updated_at = ? where status in (?, ?)",
+            (FAILED, "interrupted", time.time(), QUEUED, RUNNING),
+        )
+        self._db.commit()
+
+    def create(self, job_id: str) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "insert into jobs (id, status, result, error, created_at, updated_at) values (?, ?, null, null, ?, ?)",
+                (job_id, QUEUED, now, now),
+            )
+            self._writes += 1
+            if self._writes % 256 == 0:
+                self._db.execute(
+                    "delete from jobs where status in (?, ?) and updated_at < ?", (DONE, FAILED, now - self.ttl)
+                )
+            self._db.commit()
+        return {"id": job_id, "status": QUEUED, "result": None, "error": None, "created_at": now, "updated_at": now}
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], ensure_ascii=False, default=str)
+        fields["updated_at"] = time.time()
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self._db.execute(f"update jobs set {cols} where id = ?", (*fields.values(), job_id))
+            self._db.commit()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                "select id, status, result, error, created_at, updated_at from jobs where id = ?", (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            "id": row[0],
+            "status": row[1],
+            "result": json.loads(row[2]) if row[2] else None,
+            "error": row[3],
+            "created_at": row[4],
+            "updated_at": row[5],
+        }
+
+
+def make_backend() -> JobBackend:
+    """JOB_BACKEND=memory (default) or sqlite (JOB_DB_PATH)."""
+    ttl = float(os.getenv("JOB_TTL", "3600"))
+    if os.getenv("JOB_BACKEND", "memory").lower() == "sqlite":
+        return SQLiteJobBackend(os.getenv("JOB_DB_PATH", "jobs.db"), ttl=ttl)
+    return InMemoryJobBackend(max_jobs=int(os.getenv("JOB_MAX_RETAINED", "1000")), ttl=ttl)
+
+
+class JobQueue:
+    """Bounded asyncio job queue with a fixed pool of worker tasks."""
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[Any]],
+        backend: Optional[JobBackend] = None,
+        workers: int = 4,
+        max_pending: int = 100,
+    ):
+        self.handler = handler
+        self.backend = backend or InMemoryJobBackend()
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._done: Dict[str, asyncio.Event] = {}
+
+    def start(self) -> None:
+        """Start worker tasks on the running loop (idempotent)."""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """Give queued jobs drain_timeout seconds to finish, then cancel workers."""
+        if self._queue is not None and self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, payload: Any) -> str:
+        self.start()
+        assert self._queue is not None
+        if self._queue.full():
+            raise QueueFull()
+        job_id = uuid.uuid4().hex
+        self.backend.create(job_id)
+        self._done[job_id] = asyncio.Event()
+        self._queue.put_nowait((job_id, payload))
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.backend.get(job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Long-poll: return the job once finished or after timeout seconds."""
+        event = self._done.get(job_id)
+        if event is not None and timeout > 0:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.backend.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._tasks),
+            "pending": self._queue.qsize() if self._queue else 0,
+            "max_pending": self.max_pending,
+        }
+
+    async def _worker(self) -> None:
+        assert self._queue is not None
+        while True:
+            job_id, payload = await self._queue.get()
+            self.backend.update(job_id, status=RUNNING)
+            try:
+                result = await self.handler(payload)
+                self.backend.update(job_id, status=DONE, result=result)
+            except asyncio.CancelledError:
+                self.backend.update(job_id, status=FAILED, error="cancelled")
+                raise
+            except Exception as e:
+                self.backend.update(job_id, status=FAILED, error=str(getattr(e, "detail", None) or e))
+            finally:
+                event = self._done.pop(job_id, None)
+                if event is not None:
+                    event.set()
+                self._queue.task_done()
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import threading
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+
+
+class _Automaton:
+    """Aho-Corasick automaton over (pattern, value) pairs.
+
+    Each state carries every value whose pattern ends there (fail links
+    already merged), so a single pass over the text finds all matches,
+    overlapping ones included.
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[str, Any]]):
+        goto: List[Dict[str, int]] = [{}]
+        out: List[Set[Any]] = [set()]
+        for pattern, value in patterns:
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append(set())
+                state = nxt
+            out[state].add(value)
+
+        fail = [0] * len(goto)
+        queue = [0]
+        i = 0
+        while i < len(queue):
+            state = queue[i]
+            i += 1
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                if state:
+                    f = fail[state]
+                    while f and ch not in goto[f]:
+                        f = fail[f]
+                    fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] |= out[fail[nxt]]
+        self._goto = goto
+        self._fail = fail
+        self._out: List[FrozenSet[Any]] = [frozenset(o) for o in out]
+
+    def scan(self, text: str) -> Set[Any]:
+        goto, fail, out = self._goto, self._fail, self._out
+        found: Set[Any] = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found |= out[state]
+        return found
+
+
+class LabelNormalizer:
+    """Precompiled form of the canon label rules and context keyword groups.
+
+    normalize() first looks for an exact match: a label equal to a canon key
+    maps to that key, and one equal to a variant maps to that variant's key
+    (earliest key if several list it). Otherwise it answers like checking
+    each canon key in order for `variant in low`: all candidate keys are found
+    in one automaton pass and the earliest key wins. Exact matches come first
+    so that specific labels such as "toothbrush" or "diş fırçası" are not
+    swallowed by a shorter variant ("brush", "fırça") of an earlier key.
+    """
+
+    MEMO_SIZE = 4096
+
+    def __init__(self, canon: Dict[str, Sequence[str]], context: Dict[str, Iterable[str]]):
+        self.canon = {k: list(v) for k, v in canon.items()}
+        self.context = {g: list(words) for g, words in context.items()}
+        self.keys: List[str] = list(self.canon)
+        self._exact: Dict[str, int] = {}
+        patterns: List[Tuple[str, int]] = []
+        for prio, (key, variants) in enumerate(self.canon.items()):
+            self._exact.setdefault(key, prio)
+            patterns.extend((v, prio) for v in variants)
+        for prio, variants in enumerate(self.canon.values()):
+            for v in variants:
+                # keys beat variants: "brush" as a key elsewhere would win over a variant
+                self._exact.setdefault(v, prio)
+        self._variants = _Automaton(patterns)
+        self._context = _Automaton((w, group) for group, words in self.context.items() for w in words)
+        self._memo: Dict[str, str] = {}
+
+    @classmethod
+    def from_file(cls, path: str, defaults: "LabelNormalizer") -> "LabelNormalizer":
+        """JSON: {"canon": {key: [variants, ...]}, "context": {group: [words, ...]}}.
+
+        A section missing from the file keeps the default rules.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("canon") or defaults.canon, data.get("context") or defaults.context)
+
+    def normalize(self, label: str) -> str:
+        low = label.lower()
+        hit = self._memo.get(low)
+        if hit is not None:
+            return hit
+        best = self._exact.get(low)
+        if best is None:
+            for prio in self._variants.scan(low):
+                if best is None or prio < best:
+                    best = prio
+        mapped = self.keys[best] if best is not None else low
+        if len(self._memo) >= self.MEMO_SIZE:
+            self._memo.clear()
+        self._memo[low] = mapped
+        return mapped
+
+    def context_hits(self, text: str) -> Set[str]:
+        """Context groups with at least one keyword occurring in text."""
+        return self._context.scan(text)
+
+
+class LabelSource:
+    """Holds the active LabelNormalizer and hot-reloads it from a data file.
+
+    The file's mtime is checked at most every reload_interval seconds; a file
+    that fails to load keeps the previous normalizer in place.
+    """
+
+    def __init__(
+        self,
+        default_factory: Callable[[], LabelNormalizer],
+        path: Optional[str] = None,
+        reload_interval: float = 5.0,
+    ):
+        self._default_factory = default_factory
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._current: Optional[LabelNormalizer] = None
+        self._defaults: Optional[LabelNormalizer] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+
+    def _file_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.path) if self.path else None
+        except OSError:
+            return None
+
+    def get(self) -> LabelNormalizer:
+        current = self._current
+        if current is not None:
+            if not self.path or time.monotonic() - self._checked_at < self.reload_interval:
+                return current
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if self._defaults is None:
+                self._defaults = self._default_factory()
+            mtime = self._file_mtime()
+            if self._current is None or mtime != self._mtime:
+                self._load_locked(mtime)
+            assert self._current is not None
+            return self._current
+
+    def _load_locked(self, mtime: Optional[float]) -> None:
+        assert self._defaults is not None
+        if self.path and mtime is not None:
+            try:
+                self._current = LabelNormalizer.from_file(self.path, self._defaults)
+                self._mtime = mtime
+                return
+            except Exception:
+                pass
+        if self._current is None:
+            self._current = self._defaults
+        self._mtime = mtime
+
+    def reload(self, path: Optional[str] = None) -> LabelNormalizer:
+        """Force a rebuild (optionally from a new path); defaults are rebuilt too."""
+        with self._lock:
+            if path is not None:
+                self.path = path
+            self._defaults = self._default_factory()
+            self._current = None
+            self._checked_at = time.monotonic()
+            self._load_locked(self._file_mtime())
+            assert self._current is not None
+            return self._current
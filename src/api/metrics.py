@@ -0,0 +1,248 @@
+import os
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Awaitable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+# Latency histogram buckets (seconds) for /metrics.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class StageStats:
+    """Process-wide latency aggregates per named stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            s = self._stats.get(stage)
+            if s is None:
+                s = self._stats[stage] = {"count": 0, "total": 0.0, "max": 0.0, "buckets": [0] * len(BUCKETS)}
+            s["count"] += 1
+            s["total"] += seconds
+            if seconds > s["max"]:
+                s["max"] = seconds
+            i = bisect.bisect_left(BUCKETS, seconds)
+            if i < len(BUCKETS):
+                s["buckets"][i] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                stage: {
+                    "count": int(s["count"]),
+                    "avg_ms": round(s["total"] / s["count"] * 1000, 2) if s["count"] else 0.0,
+                    "max_ms": round(s["max"] * 1000, 2),
+                }
+                for stage, s in self._stats.items()
+            }
+
+    def histograms(self) -> Dict[str, Tuple[List[int], int, float]]:
+        """stage -> (cumulative bucket counts, count, sum)."""
+        with self._lock:
+            out = {}
+            for stage, s in self._stats.items():
+                cumulative, running = [], 0
+                for n in s["buckets"]:
+                    running += n
+                    cumulative.append(running)
+                out[stage] = (cumulative, int(s["count"]), s["total"])
+            return out
+
+
+STAGES = StageStats()
+
+
+class TokenUsage:
+    """Provider token counters by (provider, stage)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usage: Dict[Tuple[str, str], Dict[str, int]] = {}
+
+    def record(self, provider: str, stage: str, prompt: int, completion: int) -> None:
+        with self._lock:
+            u = self._usage.get((provider, stage))
+            if u is None:
+                u = self._usage[(provider, stage)] = {"calls": 0, "prompt": 0, "completion": 0}
+            u["calls"] += 1
+            u["prompt"] += prompt
+            u["completion"] += completion
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {f"{p}.{s}": dict(u) for (p, s), u in self._usage.items()}
+
+    def items(self) -> List[Tuple[str, str, Dict[str, int]]]:
+        with self._lock:
+            return [(p, s, dict(u)) for (p, s), u in self._usage.items()]
+
+
+TOKENS = TokenUsage()
+
+
+class Trace:
+    """Spans recorded for one request. Shared by reference with every task and
+    worker thread that inherits the request's context, hence the lock."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, name: str, start: float, seconds: float, **attrs: Any) -> None:
+        span = {"name": name, "start_ms": round((start - self.started) * 1000, 2), "ms": round(seconds * 1000, 2)}
+        if attrs:
+            span.update(attrs)
+        with self._lock:
+            self.spans.append(span)
+
+    def totals(self) -> Dict[str, float]:
+        """Summed milliseconds per span name, in first-seen order."""
+        out: Dict[str, float] = {}
+        with self._lock:
+            for s in self.spans:
+                out[s["name"]] = out.get(s["name"], 0.0) + s["ms"]
+        return out
+
+
+# Active request trace; None (the default) keeps timed() to aggregates only.
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("request_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+@contextmanager
+def tracing() -> Iterator[Trace]:
+    """Collect spans for everything run in this context (and tasks/threads copied from it)."""
+    trace = Trace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGES.record(stage, elapsed)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(stage, start, elapsed)
+
+
+async def timed_await(stage: str, aw: Awaitable[T]) -> T:
+    """Await aw under timed(stage); handy inside asyncio.gather."""
+    with timed(stage):
+        return await aw
+
+
+def record_tokens(provider: str, stage: str, prompt: int, completion: int) -> None:
+    TOKENS.record(provider, stage, prompt, completion)
+    trace = _trace.get()
+    if trace is not None:
+        now = time.perf_counter()
+        trace.add(f"tokens.{provider}.{stage}", now, 0.0, prompt_tokens=prompt, completion_tokens=completion)
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus(prefix: str = "mechaminds", caches: Iterable[Any] = ()) -> str:
+    """Stage latency histograms, token counters and (for each cache object with
+    a ResultCache-style stats()) lookup counters in Prometheus text format."""
+    lines = [
+        f"# HELP {prefix}_stage_seconds Latency of named pipeline stages.",
+        f"# TYPE {prefix}_stage_seconds histogram",
+    ]
+    for stage, (cumulative, count, total) in sorted(STAGES.histograms().items()):
+        label = _label(stage)
+        for bound, n in zip(BUCKETS, cumulative):
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{label}",le="{bound}"}} {n}')
+        lines.append(f'{prefix}_stage_seconds_bucket{{stage="{label}",le="+Inf"}} {count}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{label}"}} {total:.6f}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{label}"}} {count}')
+    lines += [
+        f"# HELP {prefix}_provider_tokens_total Tokens reported by provider responses.",
+        f"# TYPE {prefix}_provider_tokens_total counter",
+    ]
+    usage = sorted(TOKENS.items())
+    for provider, stage, u in usage:
+        for kind in ("prompt", "completion"):
+            lines.append(
+                f'{prefix}_provider_tokens_total{{provider="{_label(provider)}",stage="{_label(stage)}",kind="{kind}"}} {u[kind]}'
+            )
+    lines += [
+        f"# HELP {prefix}_provider_calls_total Provider responses that carried usage data.",
+        f"# TYPE {prefix}_provider_calls_total counter",
+    ]
+    for provider, stage, u in usage:
+        lines.append(f'{prefix}_provider_calls_total{{provider="{_label(provider)}",stage="{_label(stage)}"}} {u["calls"]}')
+    cache_stats = [c.stats() for c in caches]
+    if cache_stats:
+        lines += [
+            f"# HELP {prefix}_cache_lookups_total Cache lookups by result.",
+            f"# TYPE {prefix}_cache_lookups_total counter",
+        ]
+        for s in cache_stats:
+            name = _label(s["name"])
+            lines.append(f'{prefix}_cache_lookups_total{{cache="{name}",result="hit"}} {s["hits"] + s.get("disk_hits", 0)}')
+            lines.append(f'{prefix}_cache_lookups_total{{cache="{name}",result="miss"}} {s["misses"]}')
+        lines += [
+            f"# HELP {prefix}_cache_entries Entries currently held in memory.",
+            f"# TYPE {prefix}_cache_entries gauge",
+        ]
+        for s in cache_stats:
+            lines.append(f'{prefix}_cache_entries{{cache="{_label(s["name"])}"}} {s["entries"]}')
+    return "\n".join(lines) + "\n"
+
+
+def server_timing(trace: Trace, limit: int = 20) -> str:
+    """Server-Timing header value: summed duration per span name."""
+    parts = []
+    for name, ms in list(trace.totals().items())[:limit]:
+        if name.startswith("tokens."):
+            continue
+        token = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+        parts.append(f"{token};dur={ms:.1f}")
+    parts.append(f"total;dur={(time.perf_counter() - trace.started) * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware: trace each HTTP request and report its spans in a
+    Server-Timing response header. Only installed when SERVER_TIMING=1, so
+    untraced requests pay nothing beyond the aggregate counters."""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope.get("type") != "http":
+            await self.app(scope, receive, send)
+            return
+        with tracing() as trace:
+            async def send_with_timing(message: Dict[str, Any]) -> None:
+                if message.get("type") == "http.response.start":
+                    headers = list(message.get("headers") or [])
+                    headers.append((b"server-timing", server_timing(trace).encode("latin-1")))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_with_timing)
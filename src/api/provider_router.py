@@ -0,0 +1,172 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "1") != "0"
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.9"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "10"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "3"))
+PROVIDER_ORDER = [p.strip() for p in os.getenv("PROVIDER_ORDER", "openai,gemini").split(",") if p.strip()]
+
+# Below this many samples a provider's numbers are too noisy to act on.
+MIN_SAMPLES = 20
+
+
+class ProviderStats:
+    """Rolling latency samples and success/error outcomes for one provider."""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.hedged = 0
+        self.wins = 0
+
+    def record(self, ok: bool, seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self.calls += 1
+            self._outcomes.append(ok)
+            if ok and seconds is not None:
+                self._latencies.append(seconds)
+            if not ok:
+                self.errors += 1
+
+    def record_censored(self, seconds: float) -> None:
+        """A call cancelled after losing a race: we only know it took at least this long."""
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < MIN_SAMPLES:
+                return None
+            data = sorted(self._latencies)
+        return data[min(len(data) - 1, int(q * len(data)))]
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return 1.0 - sum(self._outcomes) / len(self._outcomes)
+
+    def snapshot(self) -> Dict[str, Any]:
+        p50, p90, p99 = self.quantile(0.5), self.quantile(0.9), self.quantile(0.99)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate(), 4),
+            "hedged": self.hedged,
+            "wins": self.wins,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p90_ms": round(p90 * 1000, 1) if p90 is not None else None,
+            "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+        }
+
+
+class ProviderRouter:
+    """Runs the same request against several providers, hedging on slow answers.
+
+    The primary is started first. If it has not produced a valid answer after
+    its HEDGE_QUANTILE latency (clamped to HEDGE_MIN/MAX_DELAY), the next
+    provider is started as well. The first valid answer wins and the rest are
+    cancelled. A failed answer starts the next provider immediately, which
+    keeps the old "try OpenAI, then Gemini" behaviour when hedging is off.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.stats: Dict[str, ProviderStats] = {}
+
+    def _stats(self, provider: str) -> ProviderStats:
+        s = self.stats.get(provider)
+        if s is None:
+            s = self.stats.setdefault(provider, ProviderStats())
+        return s
+
+    def order(self, providers: List[str]) -> List[str]:
+        def rank(p: str) -> Tuple[int, float, int]:
+            s = self._stats(p)
+            p50 = s.quantile(0.5)
+            configured = PROVIDER_ORDER.index(p) if p in PROVIDER_ORDER else len(PROVIDER_ORDER)
+            if p50 is None:
+                return (1, 0.0, configured)
+            # Penalize flaky providers so a fast-but-failing one stops leading.
+            return (0, p50 * (1 + 4 * s.error_rate()), configured)
+
+        ranks = {p: rank(p) for p in providers}
+        # Only reorder by measured latency once every candidate has enough samples.
+        if any(r[0] for r in ranks.values()):
+            return sorted(providers, key=lambda p: ranks[p][2])
+        return sorted(providers, key=lambda p: ranks[p])
+
+    def hedge_delay(self, provider: str) -> Optional[float]:
+        if not HEDGE_REQUESTS:
+            return None
+        q = self._stats(provider).quantile(HEDGE_QUANTILE)
+        if q is None:
+            return HEDGE_DEFAULT_DELAY
+        return min(max(q, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+    async def race(
+        self,
+        calls: Dict[str, Callable[[], Awaitable[Any]]],
+        is_valid: Callable[[Any], bool] = bool,
+    ) -> Optional[Tuple[str, Any]]:
+        """Return (provider, result) for the first valid result, or None."""
+        order = self.order(list(calls))
+        pending: Dict["asyncio.Task[Any]", Tuple[str, float]] = {}
+        next_idx = 0
+
+        last_launch = 0.0
+
+        def launch() -> None:
+            nonlocal next_idx, last_launch
+            name = order[next_idx]
+            next_idx += 1
+            if pending:
+                self._stats(name).hedged += 1
+            last_launch = time.perf_counter()
+            pending[asyncio.ensure_future(calls[name]())] = (name, last_launch)
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if next_idx < len(order):
+                    delay = self.hedge_delay(order[next_idx - 1])
+                    if delay is not None:
+                        timeout = max(0.0, last_launch + delay - time.perf_counter())
+                done, _ = await asyncio.wait(set(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    launch()
+                    continue
+                for task in done:
+                    name, started = pending.pop(task)
+                    elapsed = time.perf_counter() - started
+                    try:
+                        result = task.result()
+                    except Exception:
+                        result = None
+                    if result is not None and is_valid(result):
+                        stats = self._stats(name)
+                        stats.record(True, elapsed)
+                        stats.wins += 1
+                        return name, result
+                    self._stats(name).record(False)
+                if not pending and next_idx < len(order):
+                    launch()
+            return None
+        finally:
+            now = time.perf_counter()
+            for task, (name, started) in pending.items():
+                task.cancel()
+                self._stats(name).record_censored(now - started)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {name: s.snapshot() for name, s in self.stats.items()}
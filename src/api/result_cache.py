@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+def content_key(*parts: Any) -> str:
+    """Stable sha256 key over bytes/str parts (bytes are hashed as-is)."""
+    h = hashlib.sha256()
+    for p in parts:
+        if isinstance(p, (bytes, bytearray, memoryview)):
+            h.update(p)
+        else:
+            h.update(str(p).encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+class ResultCache:
+    """LRU + TTL cache for JSON-serializable results, with an optional SQLite tier.
+
+    Values are stored serialized, so callers always get a fresh copy and
+    size-based eviction can use the encoded length.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 512,
+        max_bytes: int = 8 * 1024 * 1024,
+        ttl: float = 3600.0,
+        db_path: Optional[str] = None,
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._mem: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str) -> None:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            db = sqlite3.connect(db_path, check_same_thread=False)
+            db.execute("pragma journal_mode=wal")
+            db.execute(
+                "create table if not exists cache (ns text, key text, value text, expires real, primary key (ns, key))"
+            )
+            db.execute("delete from cache where expires < ?", (time.time(),))
+            db.commit()
+            self._db = db
+        except Exception:
+            self._db = None
+
+    def _evict_locked(self) -> None:
+        while self._mem and (len(self._mem) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, raw) = self._mem.popitem(last=False)
+            self._bytes -= len(raw)
+            self.evictions += 1
+
+    def _put_mem_locked(self, key: str, expires: float, raw: str) -> None:
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old[1])
+        self._mem[key] = (expires, raw)
+        self._bytes += len(raw)
+        self._evict_locked()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                expires, raw = entry
+                if expires >= now:
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(raw)
+                del self._mem[key]
+                self._bytes -= len(raw)
+            if self._db is not None:
+                try:
+                    row = self._db.execute(
+                        "select value, expires from cache where ns = ? and key = ?", (self.name, key)
+                    ).fetchone()
+                except Exception:
+                    row = None
+                if row and row[1] >= now:
+                    self._put_mem_locked(key, row[1], row[0])
+                    self.disk_hits += 1
+                    return json.loads(row[0])
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        try:
+            raw = json.dumps(value, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._put_mem_locked(key, expires, raw)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "insert or replace into cache (ns, key, value, expires) values (?, ?, ?, ?)",
+                        (self.name, key, raw, expires),
+                    )
+                    self._db_writes += 1
+                    if self._db_writes % 256 == 0:
+                        self._db.execute("delete from cache where expires < ?", (time.time(),))
+                    self._db.commit()
+                except Exception:
+                    pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            self._bytes = 0
+            if self._db is not None:
+                try:
+                    self._db.execute("delete from cache where ns = ?", (self.name,))
+                    self._db.commit()
+                except Exception:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self._mem),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": ((self.hits + self.disk_hits) / lookups) if lookups else 0.0,
+                "disk": self._db is not None,
+            }
@@ -1,62 +1,143 @@
 import os
+import asyncio
+import json
+import hashlib
+import base64
+import threading
 import uuid
-from datetime import datetime
-from typing import Optional, Dict, Any
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, Callable, List, Tuple
 import importlib
 
-# Lazy-loaded Supabase client (optional dependency)
+from .result_cache import ResultCache
+from .metrics import timed
+from .write_buffer import WriteBehindBuffer
+
+# Lazy-loaded Supabase client (optional dependency), one per process. Its
+# PostgREST and Storage clients sit on httpx sessions, which are safe to share
+# between threadpool workers, so every thread reuses the same keep-alive
+# connections instead of paying its own TLS handshakes.
 _SUPABASE: Optional[Any] = None  # type: ignore[name-defined]
+_client_lock = threading.Lock()
+_client_factory: Optional[Callable[[], Optional[Any]]] = None
 
 BUCKET_NAME = os.getenv("SUPABASE_BUCKET", "images")
 
 
+def _default_client_factory() -> Optional[Any]:
+    supabase_mod = importlib.import_module("supabase")
+    create_client = getattr(supabase_mod, "create_client", None)
+    if create_client is None:
+        return None
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_KEY") or os.getenv("SUPABASE_ANON_KEY")
+    if not url or not key:
+        return None
+    return create_client(url, key)
+
+
+def set_client_factory(factory: Optional[Callable[[], Optional[Any]]]) -> None:
+    """Override how the Supabase client is built (None restores the default); drops the cached client."""
+    global _client_factory, _SUPABASE
+    with _client_lock:
+        _client_factory = factory
+        _SUPABASE = None
+
+
 def _get_client() -> Optional[Any]:  # type: ignore[valid-type]
-    """Return Supabase client if env and package exist; otherwise None."""
+    """Return the shared Supabase client if env and package exist; otherwise None."""
     global _SUPABASE
     if _SUPABASE is not None:
         return _SUPABASE
-    try:
-        supabase_mod = importlib.import_module("supabase")
-        create_client = getattr(supabase_mod, "create_client", None)
-        if create_client is None:
-            return None
-        url = os.getenv("SUPABASE_URL")
-        key = os.getenv("SUPABASE_SERVICE_KEY") or os.getenv("SUPABASE_ANON_KEY")
-        if not url or not key:
-            return None
-        _SUPABASE = create_client(url, key)
+    with _client_lock:
+        if _SUPABASE is None:
+            try:
+                _SUPABASE = (_client_factory or _default_client_factory)()
+            except Exception:
+                return None
         return _SUPABASE
-    except Exception:
+
+
+async def get_client_async() -> Optional[Any]:
+    """_get_client for the event loop: the first call (import, config, or waiting
+    for the startup build) runs on a worker thread instead of blocking the loop."""
+    if _SUPABASE is not None:
+        return _SUPABASE
+    if _client_factory is None and not os.getenv("SUPABASE_URL"):
         return None
+    return await asyncio.to_thread(_get_client)
+
+
+# Known content hash -> public URL, so re-uploads of the same image skip Storage.
+storage_index = ResultCache(
+    "storage_urls",
+    max_entries=int(os.getenv("STORAGE_INDEX_SIZE", "4096")),
+    max_bytes=int(os.getenv("STORAGE_INDEX_MAX_BYTES", str(2 * 1024 * 1024))),
+    ttl=float(os.getenv("STORAGE_INDEX_TTL", str(30 * 24 * 3600))),
+    db_path=os.getenv("STORAGE_INDEX_DB") or None,
+)
+
+def _is_duplicate(e: Exception) -> bool:
+    """Storage answers 409 'Duplicate' when the object already exists (upsert=False)."""
+    text = str(e)
+    return "Duplicate" in text or "already exists" in text
+
+
+def content_path(sha256: str, ext: str) -> str:
+    """Content-addressed object path: identical bytes always map to the same key."""
+    return f"sha256/{sha256[:2]}/{sha256}.{ext}"
 
 
-def upload_image_and_get_url(content: bytes, filename: str = "photo.jpg") -> Optional[str]:
-    """Upload bytes to Supabase Storage and return public URL (or None)."""
+def upload_image_and_get_url(
+    content: bytes,
+    filename: str = "photo.jpg",
+    sha256: Optional[str] = None,
+    content_type: Optional[str] = None,
+) -> Optional[str]:
+    """Upload bytes to Supabase Storage and return public URL (or None).
+
+    Objects are stored under their content hash and uploaded only if absent,
+    so the same image is kept once however often it is analyzed.
+    """
     client = _get_client()
     if not client:
         return None
-    ext = (filename.split(".")[-1].lower() if "." in filename else "jpg") or "jpg"
-    path = f"{datetime.utcnow().strftime('%Y/%m/%d')}/{uuid.uuid4().hex}.{ext}"
+    digest = sha256 or hashlib.sha256(content).hexdigest()
+    index_key = f"{BUCKET_NAME}:{digest}"
+    known = storage_index.get(index_key)
+    if known:
+        return known
+    if content_type and content_type.startswith("image/"):
+        ext = content_type.split("/", 1)[1].replace("jpeg", "jpg")
+    else:
+        ext = (filename.split(".")[-1].lower() if "." in filename else "jpg") or "jpg"
+    mime = content_type or f"image/{ext}"
+    path = content_path(digest, ext)
     bucket = client.storage.from_(BUCKET_NAME)
     # supabase-py v1/v2 compatibility
-    try:
-        bucket.upload(path, content, {"contentType": f"image/{ext}", "upsert": False})
-    except TypeError:
+    with timed("supabase.upload"):
         try:
-            bucket.upload(path=path, file=content, file_options={"content-type": f"image/{ext}"}, upsert=False)
-        except Exception:
-            return None
-    except Exception:
-        return None
+            bucket.upload(path, content, {"contentType": mime, "upsert": False})
+        except TypeError:
+            try:
+                bucket.upload(path=path, file=content, file_options={"content-type": mime}, upsert=False)
+            except Exception as e:
+                if not _is_duplicate(e):
+                    return None
+        except Exception as e:
+            if not _is_duplicate(e):
+                return None
 
     try:
         pub = bucket.get_public_url(path)
         if isinstance(pub, dict):
             # v2 sometimes returns {'data': {'publicUrl': '...'}}
-            return (pub.get("data") or {}).get("publicUrl") or pub.get("publicUrl")
-        return pub
+            pub = (pub.get("data") or {}).get("publicUrl") or pub.get("publicUrl")
     except Exception:
         return None
+    if pub:
+        storage_index.set(index_key, pub)
+    return pub
 
 
 def save_analysis_record(record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
@@ -65,10 +146,11 @@ def save_analysis_record(record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     if not client:
         return None
     try:
-        try:
-            resp = client.table("analyses").insert(record, returning="representation").execute()
-        except TypeError:
-            resp = client.table("analyses").insert(record).execute()
+        with timed("supabase.insert"):
+            try:
+                resp = client.table("analyses").insert(record, returning="representation").execute()
+            except TypeError:
+                resp = client.table("analyses").insert(record).execute()
         data = getattr(resp, "data", None)
         if not data and isinstance(resp, dict):
             data = resp.get("data")
@@ -79,6 +161,108 @@ def save_analysis_record(record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         return None
 
 
+def save_analysis_records(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Bulk insert into 'analyses' in one request; returns inserted rows in order (or [])."""
+    client = _get_client()
+    if not client or not records:
+        return []
+    try:
+        with timed("supabase.insert_many"):
+            try:
+                resp = client.table("analyses").insert(records, returning="representation").execute()
+            except TypeError:
+                resp = client.table("analyses").insert(records).execute()
+        data = getattr(resp, "data", None)
+        if not data and isinstance(resp, dict):
+            data = resp.get("data")
+        return data if isinstance(data, list) else []
+    except Exception:
+        return []
+
+
+# Set to False once PostgREST reports the merge_analysis RPC missing
+# (migration 0003 not applied); we then stay on the select-then-update path.
+_MERGE_RPC = True
+
+
+def _merge_via_select(
+    client: Any,
+    analysis_id: str,
+    objects: Optional[list],
+    experience: Optional[str],
+    certainty: Optional[float],
+) -> Optional[Dict[str, Any]]:
+    if objects is None and certainty is None and experience is not None:
+        # Nothing to merge: a plain update, no read needed
+        resp = client.table("analyses").update({"experience": experience}).eq("id", analysis_id).execute()
+        data = getattr(resp, "data", None)
+        return data[0] if isinstance(data, list) and data else {"id": analysis_id, "experience": experience}
+    existing = client.table("analyses").select("*").eq("id", analysis_id).limit(1).execute()
+    existing_data = getattr(existing, "data", None) or (existing.get("data") if isinstance(existing, dict) else None)
+    if not existing_data:
+        return None
+    row = dict(existing_data[0])
+    updates: Dict[str, Any] = {}
+    if objects is not None or certainty is not None:
+        perception = dict(row.get("perception") or {})
+        if objects is not None:
+            perception["objects"] = objects
+        if certainty is not None:
+            perception["certainty"] = certainty
+            updates["confidence"] = certainty
+        updates["perception"] = perception
+    if experience is not None:
+        updates["experience"] = experience
+    if updates:
+        client.table("analyses").update(updates).eq("id", analysis_id).execute()
+    row.update(updates)
+    return row
+
+
+def merge_analysis_record(
+    analysis_id: str,
+    objects: Optional[list] = None,
+    experience: Optional[str] = None,
+    certainty: Optional[float] = None,
+) -> Optional[Dict[str, Any]]:
+    """Merge perception.objects/certainty, experience, confidence into an 'analyses' row.
+
+    One round trip through the merge_analysis RPC; returns the updated row, or
+    None if Supabase is not configured or the row does not exist. Database
+    errors (network, permissions, invalid id) are raised, not reported as a
+    missing row.
+    """
+    global _MERGE_RPC
+    client = _get_client()
+    if not client:
+        return None
+    if _MERGE_RPC:
+        try:
+            with timed("supabase.merge"):
+                resp = client.rpc(
+                    "merge_analysis",
+                    {
+                        "p_id": analysis_id,
+                        "p_objects": objects,
+                        "p_certainty": certainty,
+                        "p_experience": experience,
+                        "p_confidence": certainty,
+                    },
+                ).execute()
+            data = getattr(resp, "data", None)
+            if data is None and isinstance(resp, dict):
+                data = resp.get("data")
+            if isinstance(data, list):
+                data = data[0] if data else None
+            # A missing row comes back as a composite of nulls
+            return data if isinstance(data, dict) and data.get("id") else None
+        except Exception as e:
+            if getattr(e, "code", None) != "PGRST202":
+                raise
+            _MERGE_RPC = False
+    return _merge_via_select(client, analysis_id, objects, experience, certainty)
+
+
 def update_analysis_record(
     analysis_id: str,
     objects: Optional[list] = None,
@@ -86,35 +270,179 @@ def update_analysis_record(
     certainty: Optional[float] = None,
 ) -> bool:
     """Update 'analyses' row fields: perception.objects/certainty, experience, confidence."""
-    client = _get_client()
-    if not client:
+    if objects is None and experience is None and certainty is None:
+        return True
+    try:
+        return merge_analysis_record(analysis_id, objects=objects, experience=experience, certainty=certainty) is not None
+    except Exception:
         return False
+
+
+DISCOVER_COLUMNS = "id,image_url,experience,confidence,created_at,likes"
+DISCOVER_SNIPPET = 160
+# Keyset columns per sort order, all descending; the last ones break ties.
+DISCOVER_SORTS: Dict[str, Tuple[str, ...]] = {
+    "latest": ("created_at", "id"),
+    "popular": ("likes", "created_at", "id"),
+}
+_DISCOVER_VIEW = True
+
+
+def encode_cursor(row: Dict[str, Any], sort: str = "latest") -> str:
+    raw = json.dumps([row.get(k) for k in DISCOVER_SORTS[sort]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str = "latest") -> List[Any]:
+    """Inverse of encode_cursor; raises ValueError on anything malformed."""
     try:
-        updates: Dict[str, Any] = {}
-        # Merge perception json
-        if objects is not None or certainty is not None:
-            perception: Dict[str, Any] = {}
-            try:
-                existing = client.table("analyses").select("perception").eq("id", analysis_id).limit(1).execute()
-                existing_data = getattr(existing, "data", None) or (existing.get("data") if isinstance(existing, dict) else None)
-                if existing_data:
-                    perception = dict(existing_data[0].get("perception") or {})
-            except Exception:
-                perception = {}
-            if objects is not None:
-                perception["objects"] = objects
-            if certainty is not None:
-                perception["certainty"] = certainty
-                updates["confidence"] = certainty
-            updates["perception"] = perception
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+    keys = DISCOVER_SORTS[sort]
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError("invalid cursor")
+    # The values end up inside a PostgREST filter, so parse every one and
+    # hand back its canonical form instead of the client's string.
+    out: List[Any] = []
+    for k, v in zip(keys, values):
+        if not isinstance(v, int if k == "likes" else str) or isinstance(v, bool):
+            raise ValueError("invalid cursor")
+        try:
+            if k == "created_at":
+                v = datetime.fromisoformat(v).isoformat()
+            elif k == "id":
+                v = str(uuid.UUID(v))
+        except ValueError as e:
+            raise ValueError("invalid cursor") from e
+        out.append(v)
+    return out
 
-        if experience is not None:
-            updates["experience"] = experience
 
-        if not updates:
-            return True
+def _keyset_filter(keys: Tuple[str, ...], values: List[Any]) -> str:
+    """PostgREST or=() body for (k1, k2, ...) < (v1, v2, ...) with every key descending."""
 
-        client.table("analyses").update(updates).eq("id", analysis_id).execute()
-        return True
-    except Exception:
+    def cond(k: str, op: str, v: Any) -> str:
+        return f"{k}.{op}.{v}" if isinstance(v, int) else f'{k}.{op}."{v}"'
+
+    parts = []
+    for i, key in enumerate(keys):
+        terms = [cond(k, "eq", v) for k, v in zip(keys[:i], values[:i])] + [cond(key, "lt", values[i])]
+        parts.append(terms[0] if len(terms) == 1 else f"and({','.join(terms)})")
+    return ",".join(parts)
+
+
+def fetch_discover_page(
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    sort: str = "latest",
+    hours: Optional[int] = None,
+) -> Optional[Dict[str, Any]]:
+    """One page of Discover cards, keyset-paginated on DISCOVER_SORTS[sort].
+
+    sort="latest" is newest first; sort="popular" is most liked first, optionally
+    only analyses from the last `hours`. Returns {"analyses": [...],
+    "next_cursor": str|None}, or None without a client. Reads the
+    discover_cards view (migrations 0004/0005); if it is missing, latest falls
+    back to projecting the card columns from 'analyses' without likes.
+    """
+    global _DISCOVER_VIEW
+    client = _get_client()
+    if not client:
+        return None
+    keys = DISCOVER_SORTS[sort]
+    after = decode_cursor(cursor, sort) if cursor else None
+
+    def query(source: str, columns: str, keys: Tuple[str, ...]) -> List[Dict[str, Any]]:
+        q = client.table(source).select(columns)
+        if hours:
+            since = datetime.now(timezone.utc) - timedelta(hours=hours)
+            q = q.gte("created_at", since.isoformat())
+        if after:
+            q = q.or_(_keyset_filter(keys, after))
+        for k in keys:
+            q = q.order(k, desc=True)
+        with timed("supabase.discover"):
+            resp = q.limit(limit + 1).execute()
+        return list(getattr(resp, "data", None) or [])
+
+    rows: Optional[List[Dict[str, Any]]] = None
+    if _DISCOVER_VIEW:
+        try:
+            rows = query("discover_cards", DISCOVER_COLUMNS, keys)
+        except Exception as e:
+            if getattr(e, "code", None) not in ("PGRST205", "42P01"):
+                raise
+            _DISCOVER_VIEW = False
+    if rows is None:
+        if sort != "latest":
+            raise RuntimeError("discover_cards view missing; apply migration 0005")
+        rows = query("analyses", "id,image_url,experience,confidence,created_at", keys)
+        for r in rows:
+            r["experience"] = (r.get("experience") or "")[:DISCOVER_SNIPPET]
+            r.setdefault("likes", 0)
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    for r in rows:
+        # the app's card reads `image`
+        r["image"] = r.get("image_url")
+    return {"analyses": rows, "next_cursor": encode_cursor(rows[-1], sort) if more and rows else None}
+
+
+def insert_rows(table: str, rows: List[Dict[str, Any]]) -> None:
+    """Bulk insert without asking for rows back. Raises on failure (used by the write buffer)."""
+    client = _get_client()
+    if not client:
+        raise RuntimeError("Supabase client not configured")
+    with timed(f"supabase.insert.{table}"):
+        try:
+            client.table(table).insert(rows, returning="minimal").execute()
+        except TypeError:
+            client.table(table).insert(rows).execute()
+
+
+# Write-behind buffers for small fire-and-forget inserts (feedback, likes,
+# corrections), one per table so every flush is a single all-or-nothing insert.
+_writers: Dict[str, WriteBehindBuffer] = {}
+_writers_lock = threading.Lock()
+
+
+def _writer(table: str) -> WriteBehindBuffer:
+    w = _writers.get(table)
+    if w is None:
+        with _writers_lock:
+            w = _writers.get(table)
+            if w is None:
+                w = _writers[table] = WriteBehindBuffer(
+                    f"supabase.{table}",
+                    lambda rows: insert_rows(table, rows),
+                    max_batch=int(os.getenv("WRITE_BATCH_SIZE", "100")),
+                    flush_interval=float(os.getenv("WRITE_FLUSH_S", "0.25")),
+                    max_queue=int(os.getenv("WRITE_MAX_QUEUE", "10000")),
+                    max_retries=int(os.getenv("WRITE_MAX_RETRIES", "3")),
+                )
+    return w
+
+
+def enqueue_insert(table: str, row: Dict[str, Any]) -> bool:
+    """Queue a row for a batched insert. False if Supabase is off or the buffer is full."""
+    if not _get_client():
         return False
+    return _writer(table).enqueue(row)
+
+
+def flush_writes(timeout: float = 5.0) -> bool:
+    """Wait until all queued inserts are written; True if every buffer drained."""
+    return all([w.flush(timeout) for w in list(_writers.values())])
+
+
+def close_writers(timeout: float = 10.0) -> None:
+    """Flush and stop the write buffers (app shutdown)."""
+    for w in list(_writers.values()):
+        w.close(timeout)
+
+
+def write_stats() -> Dict[str, Any]:
+    return {table: w.stats() for table, w in _writers.items()}
@@ -0,0 +1,284 @@
+import os
+import ipaddress
+import threading
+import importlib.util
+import urllib.request
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+import httpx
+
+# Shared, long-lived HTTP connection pools. Each upstream service gets its own
+# named pool so its connection limit is effectively a per-host limit
+# (HTTP_<NAME>_MAX_CONNECTIONS overrides the default for one service).
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "90"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+# HTTP/2 needs the optional `h2` package (pip install httpx[http2]).
+HTTP2 = os.getenv("HTTP2", "1") != "0" and importlib.util.find_spec("h2") is not None
+
+
+class PoolStats:
+    """In-flight/peak request counts for one pool; saturated counts requests
+    that started while every connection was already busy (they queue)."""
+
+    def __init__(self, name: str, max_connections: int):
+        self.name = name
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.requests = 0
+        self.errors = 0
+        self.saturated = 0
+
+    def begin(self) -> None:
+        with self._lock:
+            if self.in_flight >= self.max_connections:
+                self.saturated += 1
+            self.in_flight += 1
+            self.requests += 1
+            self.peak = max(self.peak, self.in_flight)
+
+    def end(self, ok: bool) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if not ok:
+                self.errors += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_connections": self.max_connections,
+                "in_flight": self.in_flight,
+                "peak": self.peak,
+                "requests": self.requests,
+                "errors": self.errors,
+                "saturated": self.saturated,
+            }
+
+
+class _CountingStream(httpx.SyncByteStream):
+    """Response body wrapper that ends the request's count when the body is closed."""
+
+    def __init__(self, inner: Any, stats: PoolStats):
+        self._inner = inner
+        self._stats = stats
+        self._ok = True
+        self._closed = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            for chunk in self._inner:
+                yield chunk
+        except BaseException:
+            self._ok = False
+            raise
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._inner.close()
+        finally:
+            self._stats.end(self._ok)
+
+
+class _AsyncCountingStream(httpx.AsyncByteStream):
+    def __init__(self, inner: Any, stats: PoolStats):
+        self._inner = inner
+        self._stats = stats
+        self._ok = True
+        self._closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self._inner:
+                yield chunk
+        except BaseException:
+            self._ok = False
+            raise
+
+    async def aclose(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._inner.aclose()
+        finally:
+            self._stats.end(self._ok)
+
+
+class _CountingTransport(httpx.BaseTransport):
+    """Counts a request as in flight from send until its response is closed,
+    so streamed bodies keep their connection counted while they are read."""
+
+    def __init__(self, inner: httpx.BaseTransport, stats: PoolStats):
+        self._inner = inner
+        self._stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self._stats.begin()
+        try:
+            response = self._inner.handle_request(request)
+        except BaseException:
+            self._stats.end(False)
+            raise
+        response.stream = _CountingStream(response.stream, self._stats)
+        return response
+
+    def close(self) -> None:
+        self._inner.close()
+
+
+class _AsyncCountingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, inner: httpx.AsyncBaseTransport, stats: PoolStats):
+        self._inner = inner
+        self._stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._stats.begin()
+        try:
+            response = await self._inner.handle_async_request(request)
+        except BaseException:
+            self._stats.end(False)
+            raise
+        response.stream = _AsyncCountingStream(response.stream, self._stats)
+        return response
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+_lock = threading.Lock()
+_sync: Dict[str, httpx.Client] = {}
+_async: Dict[str, httpx.AsyncClient] = {}
+_stats: Dict[str, PoolStats] = {}
+
+
+def _limits(name: str) -> httpx.Limits:
+    key = name.upper().replace("-", "_")
+    return httpx.Limits(
+        max_connections=int(os.getenv(f"HTTP_{key}_MAX_CONNECTIONS", str(HTTP_MAX_CONNECTIONS))),
+        max_keepalive_connections=int(os.getenv(f"HTTP_{key}_MAX_KEEPALIVE", str(HTTP_MAX_KEEPALIVE))),
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _pool_stats(name: str, limits: httpx.Limits) -> PoolStats:
+    s = _stats.get(name)
+    if s is None:
+        s = _stats[name] = PoolStats(name, limits.max_connections or 0)
+    return s
+
+
+def _env_proxies() -> Dict[str, Optional[str]]:
+    """Mount patterns for HTTP(S)_PROXY/ALL_PROXY/NO_PROXY (None = go direct).
+
+    httpx ignores the proxy environment once a client gets its own transport,
+    so the pools rebuild the same routing as httpx's trust_env default.
+    """
+    info = urllib.request.getproxies()
+    mounts: Dict[str, Optional[str]] = {}
+    for scheme in ("http", "https", "all"):
+        url = info.get(scheme)
+        if url:
+            mounts[f"{scheme}://"] = url if "://" in url else f"http://{url}"
+    for host in (h.strip() for h in info.get("no", "").split(",")):
+        if host == "*":
+            return {}
+        if not host:
+            continue
+        if "://" in host:
+            mounts[host] = None
+            continue
+        try:
+            ip = ipaddress.ip_address(host)
+        except ValueError:
+            mounts["all://localhost" if host.lower() == "localhost" else f"all://*{host}"] = None
+        else:
+            mounts[f"all://[{host}]" if ip.version == 6 else f"all://{host}"] = None
+    return mounts
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def get_client(name: str) -> httpx.Client:
+    """Shared sync client for one upstream service (thread-safe, pooled)."""
+    client = _sync.get(name)
+    if client is not None and not client.is_closed:
+        return client
+    with _lock:
+        client = _sync.get(name)
+        if client is None or client.is_closed:
+            limits = _limits(name)
+            stats = _pool_stats(f"{name}.sync", limits)
+
+            def counted(proxy: Optional[str] = None) -> httpx.BaseTransport:
+                return _CountingTransport(httpx.HTTPTransport(limits=limits, http2=HTTP2, proxy=proxy), stats)
+
+            client = _sync[name] = httpx.Client(
+                transport=counted(),
+                mounts={k: counted(v) if v else None for k, v in _env_proxies().items()},
+                timeout=_timeout(),
+            )
+        return client
+
+
+def get_async_client(name: str) -> httpx.AsyncClient:
+    """Shared async client for one upstream service (use from the app's event loop)."""
+    client = _async.get(name)
+    if client is not None and not client.is_closed:
+        return client
+    with _lock:
+        client = _async.get(name)
+        if client is None or client.is_closed:
+            limits = _limits(name)
+            stats = _pool_stats(f"{name}.async", limits)
+
+            def counted(proxy: Optional[str] = None) -> httpx.AsyncBaseTransport:
+                return _AsyncCountingTransport(httpx.AsyncHTTPTransport(limits=limits, http2=HTTP2, proxy=proxy), stats)
+
+            client = _async[name] = httpx.AsyncClient(
+                transport=counted(),
+                mounts={k: counted(v) if v else None for k, v in _env_proxies().items()},
+                timeout=_timeout(),
+            )
+        return client
+
+
+async def warm(name: str, url: Optional[str]) -> None:
+    """Open a connection (DNS + TCP + TLS) to url ahead of the first real request."""
+    if not url:
+        return
+    try:
+        await get_async_client(name).head(url)
+    except Exception:
+        pass
+
+
+async def shutdown() -> None:
+    """Close every pool (FastAPI shutdown). Clients are recreated on next use."""
+    with _lock:
+        sync_clients = list(_sync.values())
+        async_clients = list(_async.values())
+        _sync.clear()
+        _async.clear()
+    for c in sync_clients:
+        try:
+            c.close()
+        except Exception:
+            pass
+    for ac in async_clients:
+        try:
+            await ac.aclose()
+        except Exception:
+            pass
+
+
+def stats() -> Dict[str, Any]:
+    return {"http2": HTTP2, "pools": {name: s.snapshot() for name, s in _stats.items()}}
@@ -0,0 +1,136 @@
+import os
+import json
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, UploadFile
+
+from .agents_chain import image_mime
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(5 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Room for multipart boundaries and part headers on top of the file itself.
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def too_large_message(max_bytes: int) -> str:
+    return f"File is larger than {max_bytes // (1024 * 1024)}MB."
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware: answer 413 for multipart requests whose Content-Length is
+    over the limit, before the body is received. By the time an endpoint (or a
+    dependency) runs, Starlette has already received and spooled the whole
+    form, so read_upload alone can only bound memory, not the transfer.
+
+    max_bytes applies to every multipart request; paths overrides it per route
+    (e.g. batch uploads). Chunked bodies without a Content-Length still get
+    through to read_upload's per-file check.
+    """
+
+    def __init__(
+        self,
+        app: Any,
+        max_bytes: int = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+        paths: Optional[Dict[str, int]] = None,
+        detail: Optional[str] = None,
+    ):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = paths or {}
+        self.detail = detail or too_large_message(MAX_UPLOAD_BYTES)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope.get("type") == "http":
+            headers = dict(scope.get("headers") or [])
+            length = headers.get(b"content-length", b"")
+            if headers.get(b"content-type", b"").startswith(b"multipart/") and length.isdigit():
+                if int(length) > self.paths.get(scope.get("path", ""), self.max_bytes):
+                    body = json.dumps({"detail": self.detail}, ensure_ascii=False).encode("utf-8")
+                    await send({
+                        "type": "http.response.start",
+                        "status": 413,
+                        "headers": [
+                            (b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode("latin-1")),
+                            (b"connection", b"close"),
+                        ],
+                    })
+                    await send({"type": "http.response.body", "body": body})
+                    return
+        await self.app(scope, receive, send)
+
+
+@dataclass
+class IngestedUpload:
+    """A fully read upload: one immutable buffer plus what we learned while reading it."""
+    content: bytes
+    sha256: str
+    content_type: str
+    filename: str
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+    @property
+    def view(self) -> memoryview:
+        return memoryview(self.content)
+
+    @property
+    def extension(self) -> str:
+        """File extension for the sniffed type (jpg/png/webp/gif/heic)."""
+        return self.content_type.split("/", 1)[-1].replace("jpeg", "jpg")
+
+
+async def read_upload(
+    file: UploadFile,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    too_large_detail: Optional[str] = None,
+    unsupported_detail: str = "Unsupported image type.",
+) -> IngestedUpload:
+    """Read an UploadFile in chunks, rejecting oversized or non-image uploads
+    without holding more than max_bytes in memory.
+
+    The content hash is computed while reading and the chunks are joined once,
+    so the rest of the pipeline shares a single buffer. The upload is already
+    spooled by Starlette at this point; UploadLimitMiddleware is what stops an
+    oversized request before its body is transferred.
+    """
+    if too_large_detail is None:
+        too_large_detail = too_large_message(max_bytes)
+    declared = getattr(file, "size", None)
+    if declared is not None and declared > max_bytes:
+        raise HTTPException(status_code=413, detail=too_large_detail)
+
+    digest = hashlib.sha256()
+    chunks: List[bytes] = []
+    total = 0
+    mime: Optional[str] = None
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise HTTPException(status_code=413, detail=too_large_detail)
+        digest.update(chunk)
+        chunks.append(chunk)
+        if mime is None and total >= 16:
+            mime = image_mime(chunks[0] if len(chunks[0]) >= 16 else b"".join(chunks))
+            if mime is None:
+                raise HTTPException(status_code=415, detail=unsupported_detail)
+
+    if mime is None:
+        # Tiny upload (<16 bytes) or empty body.
+        raise HTTPException(status_code=415, detail=unsupported_detail)
+
+    content = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+    return IngestedUpload(
+        content=content,
+        sha256=digest.hexdigest(),
+        content_type=mime,
+        filename=file.filename or "photo.jpg",
+    )
@@ -2,25 +2,38 @@ from dotenv import load_dotenv
 load_dotenv()
 from fastapi import FastAPI, Request, Header, UploadFile, File
 
-def get_current_user(authorization: str = Header(None)):
+async def get_current_user(authorization: str = Header(None)):
     """
     JWT token doğrulama dependency. Token geçersizse HTTPException döner.
+    İmza yalnızca token ilk görüldüğünde doğrulanır; sonrası önbellekten
+    (token süresi dolana kadar). async olduğundan threadpool'a da gitmez.
     """
     if not authorization:
         raise HTTPException(status_code=401, detail="Token gerekli")
     token = authorization.replace("Bearer ", "")
-    payload = verify_token(token)
+    payload = verify_token_cached(token)
     if not payload:
         raise HTTPException(status_code=401, detail="Geçersiz veya süresi dolmuş token")
     return payload
 from fastapi import HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from api.auth_utils import create_access_token, verify_token
+from fastapi.responses import PlainTextResponse
+from api.auth_utils import create_access_token, verify_token_cached, token_cache
 import os
-import firebase_admin
-from firebase_admin import credentials, storage, firestore
-from .agents_chain import analyze_image_chain
-from langchain_community.llms import OpenAI
+import threading
+from .agents_chain import analyze_image_chain_async, reset_provider_clients, warm_provider_connections
+from . import transport
+from .upload_utils import read_upload, UploadLimitMiddleware
+from .metrics import timed, timed_await, render_prometheus, SERVER_TIMING, ServerTimingMiddleware
+from .result_cache import ResultCache
+from .write_buffer import WriteBehindBuffer, is_bad_request
+from fastapi.concurrency import run_in_threadpool
+import asyncio
+import json
+import uuid
+import base64
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
 
 
 
@@ -28,6 +41,150 @@ from langchain_community.llms import OpenAI
 
 app = FastAPI()
 
+# Firebase başlatma. firebase_admin içe aktarımı ve istemci kurulumu soğuk
+# başlangıcı saniyelerce uzattığından ilk kullanımda (veya açılıştan sonra
+# arka planda) yapılır.
+FIREBASE_CRED_PATH = os.getenv("FIREBASE_CRED_PATH", "firebase_service_account.json")
+FIREBASE_STORAGE_BUCKET = os.getenv("FIREBASE_STORAGE_BUCKET", "your-bucket-name.appspot.com")
+_firebase_lock = threading.Lock()
+_firebase: Optional[tuple] = None  # (firestore modülü, db, bucket)
+
+
+def _firebase_clients() -> tuple:
+    global _firebase
+    if _firebase is None:
+        with _firebase_lock:
+            if _firebase is None:
+                import firebase_admin
+                from firebase_admin import credentials, storage, firestore
+                if not firebase_admin._apps:
+                    cred = credentials.Certificate(FIREBASE_CRED_PATH)
+                    firebase_admin.initialize_app(cred, {
+                        'storageBucket': FIREBASE_STORAGE_BUCKET
+                    })
+                _firebase = (firestore, firestore.client(), storage.bucket())
+    return _firebase
+
+
+def _db() -> Any:
+    return _firebase_clients()[1]
+
+
+def _bucket() -> Any:
+    return _firebase_clients()[2]
+
+
+def _server_timestamp() -> Any:
+    # Firestore SERVER_TIMESTAMP fix
+    return _firebase_clients()[0].firestore.SERVER_TIMESTAMP
+
+
+def _field_path() -> Any:
+    return _firebase_clients()[0].firestore.FieldPath
+
+
+# Firestore write-behind: event log ve feedback belgeleri istek başına bir
+# round trip yerine batch() commit'leriyle yazılır (Firestore sınırı: batch
+# başına 500 yazma). Belge id'si kuyruğa alırken seçildiğinden tekrar
+# denenen bir batch kopya üretmez, aynı belgenin üzerine yazar.
+FIRESTORE_BATCH_LIMIT = 500
+# Kuyruk dolunca: "inline" belgeyi istek içinde yazar (geri basınç), "drop"
+# atar ve sayar. Event loglar analitik olduğundan varsayılan olarak atılabilir.
+FIRESTORE_OVERFLOW = {
+    "event_logs": os.getenv("EVENT_LOG_OVERFLOW", "drop"),
+    "feedback": "inline",
+}
+_fs_writers: Dict[str, WriteBehindBuffer] = {}
+_fs_writers_lock = threading.Lock()
+
+
+def _commit_documents(collection: str, docs: List[Tuple[str, Dict[str, Any]]]) -> None:
+    db = _db()
+    coll = db.collection(collection)
+    batch = db.batch()
+    for doc_id, data in docs:
+        batch.set(coll.document(doc_id), data)
+    batch.commit()
+
+
+def _firestore_bad_request(exc: BaseException) -> bool:
+    # Firestore'da 409 (Aborted) veri hatası değil, işlem çakışmasıdır: tekrar denenir.
+    if getattr(exc, "code", None) == 409:
+        return False
+    return is_bad_request(exc)
+
+
+def _fs_writer(collection: str) -> WriteBehindBuffer:
+    w = _fs_writers.get(collection)
+    if w is None:
+        with _fs_writers_lock:
+            w = _fs_writers.get(collection)
+            if w is None:
+                w = _fs_writers[collection] = WriteBehindBuffer(
+                    f"firestore.{collection}",
+                    lambda docs: _commit_documents(collection, docs),
+                    max_batch=min(int(os.getenv("FIRESTORE_BATCH_SIZE", "500")), FIRESTORE_BATCH_LIMIT),
+                    flush_interval=float(os.getenv("FIRESTORE_FLUSH_S", "0.5")),
+                    max_queue=int(os.getenv("FIRESTORE_MAX_QUEUE", "5000")),
+                    max_retries=int(os.getenv("FIRESTORE_MAX_RETRIES", "3")),
+                    is_bad_item=_firestore_bad_request,
+                )
+    return w
+
+
+async def _write_document(collection: str, data: Dict[str, Any]) -> bool:
+    """Belgeyi toplu yazım kuyruğuna alır. Kuyruk doluysa koleksiyonun taşma
+    politikası uygulanır: inline yazım ya da atma (False döner).
+
+    timestamp kuyruğa alma anıdır (UTC). SERVER_TIMESTAMP yazımın ulaştığı anı
+    verirdi, bu da kesinti sonrası saniyeler/dakikalar kayabilir; ayrıca
+    Firebase istemcisini event loop üzerinde kurdurmaz.
+    """
+    doc = (uuid.uuid4().hex, {**data, "timestamp": datetime.now(timezone.utc)})
+    if _fs_writer(collection).enqueue(doc):
+        return True
+    if FIRESTORE_OVERFLOW.get(collection) == "drop":
+        return False
+    await run_in_threadpool(_commit_documents, collection, [doc])
+    return True
+
+
+def _close_fs_writers(timeout: float = 10.0) -> None:
+    for w in list(_fs_writers.values()):
+        w.close(timeout)
+
+
+_background: set = set()
+
+
+def _spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def _warm_firebase() -> None:
+    try:
+        await run_in_threadpool(_firebase_clients)
+    except Exception:
+        pass  # ilk istek tekrar dener ve hatayı döndürür
+
+
+@app.on_event("startup")
+async def _open_connections():
+    # İstemciler arka planda hazırlanır; ilk istekler kurulumu beklemez.
+    _spawn(warm_provider_connections())
+    _spawn(_warm_firebase())
+
+
+@app.on_event("shutdown")
+async def _close_connections():
+    for task in list(_background):
+        task.cancel()
+    await run_in_threadpool(_close_fs_writers)
+    await transport.shutdown()
+    reset_provider_clients()
+
 
 # Basit admin yetkilendirme (örnek)
 ADMIN_EMAILS = ["admin@mechaminds.com"]
@@ -43,48 +200,50 @@ async def get_event_logs(payload: dict = Depends(get_current_user)):
     """
     if not is_admin(payload):
         raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
+    def fetch():
+        logs = _db().collection("event_logs").order_by("timestamp", direction="DESCENDING").limit(100).stream()
+        return [l.to_dict() for l in logs]
+
     try:
-        logs = db.collection("event_logs").order_by("timestamp", direction="DESCENDING").limit(100).stream()
-        log_list = [l.to_dict() for l in logs]
-        return {"logs": log_list}
+        return {"logs": await run_in_threadpool(fetch)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Event logları alınamadı: {str(e)}")
 
+@app.get("/admin/write-stats/")
+async def get_write_stats(payload: dict = Depends(get_current_user)):
+    """
+    Admin: Firestore toplu yazım kuyruklarının durumu (derinlik, batch'ler, atılanlar).
+    """
+    if not is_admin(payload):
+        raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
+    return {
+        name: {"overflow": FIRESTORE_OVERFLOW.get(name, "inline"), **w.stats()}
+        for name, w in _fs_writers.items()
+    }
+
 @app.post("/event-log/")
 async def add_event_log(request: Request, payload: dict = Depends(get_current_user)):
     """
-    Kullanıcı veya sistem event logunu Firestore'a kaydeder.
+    Kullanıcı veya sistem event logunu Firestore'a kaydeder (toplu yazım
+    kuyruğu üzerinden; kuyruk doluysa EVENT_LOG_OVERFLOW politikası geçerli).
     """
     data = await request.json()
     event_type = data.get("type")
     event_detail = data.get("detail")
     try:
-        db.collection("event_logs").add({
+        await _write_document("event_logs", {
             "user_id": payload.get("sub"),
             "email": payload.get("email"),
             "type": event_type,
             "detail": event_detail,
-            "timestamp": SERVER_TIMESTAMP
         })
         return {"success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Event log kaydı başarısız: {str(e)}")
 
 
-# Firestore SERVER_TIMESTAMP fix
-SERVER_TIMESTAMP = firestore.firestore.SERVER_TIMESTAMP
-
-# Firebase başlatma
-FIREBASE_CRED_PATH = os.getenv("FIREBASE_CRED_PATH", "firebase_service_account.json")
-FIREBASE_STORAGE_BUCKET = os.getenv("FIREBASE_STORAGE_BUCKET", "your-bucket-name.appspot.com")
-if not firebase_admin._apps:
-    cred = credentials.Certificate(FIREBASE_CRED_PATH)
-    firebase_admin.initialize_app(cred, {
-        'storageBucket': FIREBASE_STORAGE_BUCKET
-    })
-db = firestore.client()
-bucket = storage.bucket()
-
+# CORS'tan önce eklenir; CORS onu sarar ve tarayıcı 413'ü okuyabilir.
+app.add_middleware(UploadLimitMiddleware, detail="Dosya boyutu 5MB'dan büyük olamaz.")
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -93,9 +252,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if SERVER_TIMING:
+    app.add_middleware(ServerTimingMiddleware)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus formatında aşama süreleri ve sağlayıcı token sayaçları."""
+    return PlainTextResponse(
+        render_prometheus(caches=[token_cache, photo_url_index]), media_type="text/plain; version=0.0.4"
+    )
+
 fake_users_db = {}
 user_photos = {}
 
+# İmzalı URL süresi; yerel indeks URL'leri süresi dolmadan bir gün önce bırakır.
+PHOTO_URL_TTL = timedelta(days=7)
+photo_url_index = ResultCache(
+    "photo_urls",
+    max_entries=int(os.getenv("PHOTO_URL_INDEX_SIZE", "4096")),
+    ttl=(PHOTO_URL_TTL - timedelta(days=1)).total_seconds(),
+)
+
 def is_nsfw_or_violent(photo_bytes):
     # Basit NSFW/şiddet kontrolü (örnek)
     if b'nsfw' in photo_bytes or b'violent' in photo_bytes:
@@ -111,23 +289,49 @@ async def analyze_photo(
     Fotoğraf analiz endpointi. Dosya boyutu limiti ve hata yönetimi eklenmiştir.
     """
     google_id = payload.get("sub")
-    photo_bytes = await file.read()
-    if len(photo_bytes) > 5 * 1024 * 1024:
-        raise HTTPException(status_code=413, detail="Dosya boyutu 5MB'dan büyük olamaz.")
+    upload = await read_upload(
+        file,
+        too_large_detail="Dosya boyutu 5MB'dan büyük olamaz.",
+        unsupported_detail="Desteklenmeyen görsel formatı.",
+    )
+    photo_bytes = upload.content
     if is_nsfw_or_violent(photo_bytes):
         raise HTTPException(status_code=400, detail="Uygunsuz fotoğraf. Bu tür içerikleri analiz edemiyoruz.")
-    try:
-        blob = bucket.blob(f"photos/{google_id}/{file.filename}")
-        blob.upload_from_string(photo_bytes, content_type=file.content_type or 'application/octet-stream')
-        photo_url = blob.generate_signed_url(expiration=3600*24*7)
-        experience = analyze_image_chain(photo_bytes)
-        db.collection("photo_analysis").add({
+    def store_photo():
+        # İçerik adresli yol: aynı fotoğraf kullanıcı başına bir kez saklanır.
+        index_key = f"{google_id}:{upload.sha256}"
+        known = photo_url_index.get(index_key)
+        if known:
+            return known
+        from google.api_core.exceptions import PreconditionFailed
+        blob = _bucket().blob(f"photos/{google_id}/{upload.sha256}.{upload.extension}")
+        try:
+            blob.upload_from_string(photo_bytes, content_type=upload.content_type, if_generation_match=0)
+        except PreconditionFailed:
+            pass  # zaten yüklenmiş
+        url = blob.generate_signed_url(expiration=PHOTO_URL_TTL)
+        photo_url_index.set(index_key, url)
+        return url
+
+    def insert_analysis(experience, photo_url):
+        # _db()/_server_timestamp() Firebase'i kurabilir; event loop'ta çağrılmaz.
+        _db().collection("photo_analysis").add({
             "user_id": google_id,
             "photo_url": photo_url,
             "filename": file.filename,
             "experience": experience,
-            "timestamp": SERVER_TIMESTAMP
+            "timestamp": _server_timestamp()
         })
+
+    try:
+        # Storage upload ve model çıkarımı paralel; sonuçlar yalnızca kayıtta birleşir.
+        with timed("user_api.analyze.total"):
+            experience, photo_url = await asyncio.gather(
+                timed_await("user_api.analyze.inference", analyze_image_chain_async(photo_bytes, upload.sha256)),
+                timed_await("user_api.analyze.upload", run_in_threadpool(store_photo)),
+            )
+            with timed("user_api.analyze.insert"):
+                await run_in_threadpool(insert_analysis, experience, photo_url)
         return {"experience": experience, "photo_url": photo_url}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Fotoğraf analizi başarısız: {str(e)}")
@@ -147,26 +351,99 @@ async def feedback(
     if not feedback_text or len(feedback_text) < 5:
         raise HTTPException(status_code=400, detail="Feedback en az 5 karakter olmalı.")
     try:
-        db.collection("feedback").add({
+        await _write_document("feedback", {
             "user_id": google_id,
             "feedback": feedback_text,
-            "timestamp": SERVER_TIMESTAMP
         })
         user_feedback.setdefault(google_id, []).append(feedback_text)
         return {"success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Feedback kaydı başarısız: {str(e)}")
 
+HISTORY_PAGE_MAX = 50
+HISTORY_SNIPPET = 140
+# Only what the history list shows; the full analysis stays in the document.
+HISTORY_SUMMARY_FIELDS = [
+    "photo_url",
+    "filename",
+    "timestamp",
+    "experience.experience",
+    "experience.perception.objects",
+]
+
+
+def _encode_history_cursor(doc) -> str:
+    ts = (doc.to_dict() or {}).get("timestamp")
+    raw = json.dumps([ts.isoformat() if ts else None, doc.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_history_cursor(cursor: str) -> dict:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, doc_id = json.loads(raw)
+        return {"timestamp": datetime.fromisoformat(ts), "__name__": str(doc_id)}
+    except Exception:
+        raise HTTPException(status_code=400, detail="Geçersiz sayfa imleci.")
+
+
+def _history_summary(doc) -> dict:
+    data = doc.to_dict() or {}
+    result = data.get("experience") or {}
+    text = result.get("experience") if isinstance(result, dict) else None
+    perception = result.get("perception") if isinstance(result, dict) else None
+    ts = data.get("timestamp")
+    return {
+        "id": doc.id,
+        "photo_url": data.get("photo_url"),
+        "filename": data.get("filename"),
+        "timestamp": ts.isoformat() if ts else None,
+        "objects": (perception or {}).get("objects", []),
+        "snippet": (text or "")[:HISTORY_SNIPPET],
+    }
+
+
 @app.get("/photo-history/")
-async def photo_history(payload: dict = Depends(get_current_user)):
+async def photo_history(
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    full: bool = False,
+    payload: dict = Depends(get_current_user),
+):
     """
-    Kullanıcının fotoğraf analiz geçmişi endpointi. Hata yönetimi eklenmiştir.
+    Kullanıcının fotoğraf analiz geçmişi, en yeniden eskiye sayfalı.
+    Varsayılan olarak özet döner; full=true tüm analiz kaydını döndürür.
+    Sonraki sayfa için yanıttaki next_cursor gönderilir.
     """
     google_id = payload.get("sub")
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+    after = _decode_history_cursor(cursor) if cursor else None
+
+    def fetch():
+        # Composite index: user_id ASC, timestamp DESC (firestore.indexes.json)
+        query = (
+            _db().collection("photo_analysis")
+            .where("user_id", "==", google_id)
+            .order_by("timestamp", direction="DESCENDING")
+            .order_by(_field_path().document_id(), direction="DESCENDING")
+        )
+        if not full:
+            query = query.select(HISTORY_SUMMARY_FIELDS)
+        if after:
+            query = query.start_after(after)
+        return list(query.limit(limit + 1).stream())
+
     try:
-        analyses = db.collection("photo_analysis").where("user_id", "==", google_id).stream()
-        photo_list = [a.to_dict() for a in analyses]
-        return {"photos": photo_list}
+        with timed("user_api.photo_history"):
+            docs = await run_in_threadpool(fetch)
+        more = len(docs) > limit
+        docs = docs[:limit]
+        if full:
+            photo_list = [{"id": d.id, **(d.to_dict() or {})} for d in docs]
+        else:
+            photo_list = [_history_summary(d) for d in docs]
+        next_cursor = _encode_history_cursor(docs[-1]) if more and docs else None
+        return {"photos": photo_list, "next_cursor": next_cursor}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Fotoğraf geçmişi alınamadı: {str(e)}")
 @app.post("/login/")
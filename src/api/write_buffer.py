@@ -0,0 +1,285 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from .metrics import STAGES
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses that say "try again later" rather than "this payload is wrong".
+_RETRYABLE_STATUS = {408, 425, 429}
+# 4xx that refuse every write regardless of the row (credentials, permissions,
+# missing table): treated like an outage so the rows wait for a fix.
+_STORE_WIDE_STATUS = {401, 403, 404, 405}
+
+
+def is_bad_request(exc: BaseException) -> bool:
+    """True when a failed write was refused because of its data (so retrying the
+    same rows is pointless and a bad row can be isolated), False for outages:
+    connection errors, timeouts, 5xx, refusals that hit every row
+    (401/403/404, SQLSTATE 42501 or a missing table) and anything unrecognized.
+
+    Understands HTTP status attributes (httpx responses, google-api-core's
+    integer ``code``), PostgREST SQLSTATE codes (class 22 data exception,
+    class 23 constraint violation) and client-side ValueError/TypeError from
+    serializing a payload.
+    """
+    if isinstance(exc, (ValueError, TypeError)):
+        return True
+    for status in (
+        getattr(exc, "status_code", None),
+        getattr(getattr(exc, "response", None), "status_code", None),
+        getattr(exc, "code", None),
+    ):
+        if isinstance(status, int) and not isinstance(status, bool):
+            return 400 <= status < 500 and status not in _RETRYABLE_STATUS | _STORE_WIDE_STATUS
+        if isinstance(status, str) and len(status) == 5 and status[:2] in ("22", "23"):
+            return True
+    return False
+
+
+class WriteBehindBuffer:
+    """Collects small writes and flushes them in batches from a background thread.
+
+    A batch is flushed once max_batch items are waiting or the oldest item has
+    waited flush_interval seconds. flush_fn receives the list of items and must
+    raise on failure, and should write a batch all-or-nothing.
+
+    is_bad_item(exc) classifies a failure. An outage (connection error,
+    timeout, 5xx) is retried up to max_retries times with exponential backoff,
+    then the batch goes back to the front of the queue and flushing pauses,
+    longer after each consecutive failed flush (up to max_pause). A refusal of
+    the data (4xx, validation) is not retried; the batch is bisected to find
+    the rows that fail on their own, which are rejected and counted, even when
+    the whole batch was bad, so they never hold up the rows queued behind
+    them. Refusals that are not about a row (permissions, schema) classify as
+    outages and keep the rows queued, and if the store goes away during
+    bisection the unsettled rows are requeued, not rejected. Delivery is
+    at-least-once: a batch whose write landed but whose reply was lost is
+    written again.
+
+    enqueue() returns False when max_queue items are waiting so callers can
+    fall back to writing inline instead of growing memory without bound.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush_fn: Callable[[List[Any]], None],
+        max_batch: int = 100,
+        flush_interval: float = 0.25,
+        max_queue: int = 10000,
+        max_retries: int = 3,
+        retry_backoff: float = 0.2,
+        max_pause: float = 30.0,
+        is_bad_item: Callable[[BaseException], bool] = is_bad_request,
+    ):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.max_batch = max(1, max_batch)
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_retries = max(0, max_retries)
+        self.retry_backoff = retry_backoff
+        self.max_pause = max_pause
+        self.is_bad_item = is_bad_item
+        self._items: Deque[Any] = deque()
+        self._oldest = 0.0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._flushing = 0
+        self._force = False
+        self._pause_until = 0.0
+        self._failed_flushes = 0
+        self.enqueued = 0
+        self.flushed = 0
+        self.batches = 0
+        self.retries = 0
+        self.rejected = 0
+        self.requeued = 0
+        self.full = 0
+        self.lost = 0
+        self._flush_count = 0
+        self._flush_total = 0.0
+        self._flush_max = 0.0
+
+    def _start_locked(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f"write-buffer-{self.name}", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, item: Any) -> bool:
+        with self._cond:
+            if self._closed or len(self._items) >= self.max_queue:
+                self.full += 1
+                return False
+            if not self._items:
+                self._oldest = time.monotonic()
+            self._items.append(item)
+            self.enqueued += 1
+            self._start_locked()
+            # First item arms the flush timer; a full batch flushes right away.
+            if len(self._items) == 1 or len(self._items) >= self.max_batch:
+                self._cond.notify()
+            return True
+
+    def _take_batch_locked(self) -> List[Any]:
+        n = min(self.max_batch, len(self._items))
+        batch = [self._items.popleft() for _ in range(n)]
+        self._oldest = time.monotonic() if self._items else 0.0
+        self._flushing += len(batch)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if not self._items:
+                        self._force = False
+                        if self._closed:
+                            return
+                    if self._items and now >= self._pause_until and (
+                        self._closed
+                        or self._force
+                        or len(self._items) >= self.max_batch
+                        or now - self._oldest >= self.flush_interval
+                    ):
+                        break
+                    if not self._items:
+                        wait = None
+                    else:
+                        due = self._oldest + self.flush_interval
+                        if self._closed or self._force or len(self._items) >= self.max_batch:
+                            due = now  # only the retry pause is left to wait out
+                        wait = max(self._pause_until, due) - now
+                    self._cond.wait(wait)
+                batch = self._take_batch_locked()
+            self._deliver(batch)
+
+    def _attempt(self, batch: List[Any]) -> Optional[Exception]:
+        """Write the batch, retrying outages; returns the last error or None."""
+        delay = self.retry_backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.flush_fn(batch)
+                return None
+            except Exception as e:
+                if self.is_bad_item(e) or attempt == self.max_retries:
+                    logger.warning("write buffer %s: flush of %d failed: %s", self.name, len(batch), e)
+                    return e
+                self.retries += 1
+                time.sleep(delay)
+                delay *= 2
+        return None
+
+    def _isolate(self, batch: List[Any], rejected: List[Any], pending: List[Any]) -> None:
+        """Bisect a batch refused for its data (its own write already failed).
+
+        Items that fail alone go to rejected. Once the store fails with an
+        outage nothing more is attempted: that half and everything not yet
+        tried go to pending.
+        """
+        if len(batch) == 1:
+            rejected.extend(batch)
+            return
+        mid = len(batch) // 2
+        for half in (batch[:mid], batch[mid:]):
+            if pending:
+                pending.extend(half)
+                continue
+            try:
+                self.flush_fn(half)
+            except Exception as e:
+                if self.is_bad_item(e):
+                    self._isolate(half, rejected, pending)
+                else:
+                    pending.extend(half)
+
+    def _deliver(self, batch: List[Any]) -> None:
+        start = time.perf_counter()
+        err = self._attempt(batch)
+        rejected: List[Any] = []
+        leftover: List[Any] = []
+        if err is not None:
+            if self.is_bad_item(err):
+                self._isolate(batch, rejected, leftover)
+            else:
+                leftover = batch
+        written = len(batch) - len(rejected) - len(leftover)
+        elapsed = time.perf_counter() - start
+        STAGES.record(f"write_buffer.{self.name}.flush", elapsed)
+        with self._cond:
+            self._flushing -= len(batch)
+            self._flush_count += 1
+            self._flush_total += elapsed
+            self._flush_max = max(self._flush_max, elapsed)
+            if written:
+                self.batches += 1
+                self.flushed += written
+            self.rejected += len(rejected)
+            if not leftover:
+                self._failed_flushes = 0
+            elif self._closed:
+                # Shutdown flush could not reach the store; nothing left to retry with.
+                self.lost += len(leftover) + len(self._items)
+                logger.error(
+                    "write buffer %s: dropping %d items at shutdown", self.name, len(leftover) + len(self._items)
+                )
+                self._items.clear()
+            else:
+                self.requeued += len(leftover)
+                self._items.extendleft(reversed(leftover))
+                self._oldest = time.monotonic()
+                pause = self.retry_backoff * (2 ** (self.max_retries + min(self._failed_flushes, 16)))
+                self._failed_flushes += 1
+                self._pause_until = time.monotonic() + min(self.max_pause, pause)
+            self._cond.notify_all()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Block until everything enqueued so far is written (or timeout); True if drained."""
+        end = time.monotonic() + timeout
+        with self._cond:
+            self._force = True
+            self._cond.notify_all()
+            while self._items or self._flushing:
+                left = end - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+            return True
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stop accepting items, flush what is queued and stop the thread."""
+        with self._cond:
+            self._closed = True
+            self._pause_until = 0.0
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        with self._cond:
+            if self._items:
+                self.lost += len(self._items)
+                logger.error("write buffer %s: %d items not flushed before shutdown", self.name, len(self._items))
+                self._items.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            n = self._flush_count
+            return {
+                "depth": len(self._items) + self._flushing,
+                "enqueued": self.enqueued,
+                "flushed": self.flushed,
+                "batches": self.batches,
+                "retries": self.retries,
+                "requeued": self.requeued,
+                "rejected": self.rejected,
+                "full": self.full,
+                "lost": self.lost,
+                "flush_avg_ms": round(self._flush_total / n * 1000, 2) if n else 0.0,
+                "flush_max_ms": round(self._flush_max * 1000, 2),
+            }
@@ -0,0 +1,25 @@
+-- Atomic partial update for analyses: merges perception keys server-side and
+-- sets experience/confidence in one statement, returning the updated row.
+-- Replaces the select-then-update round trip in update_analysis_record and
+-- avoids lost updates when two refinements race.
+create or replace function public.merge_analysis(
+  p_id uuid,
+  p_objects jsonb default null,
+  p_certainty numeric default null,
+  p_experience text default null,
+  p_confidence numeric default null
+) returns public.analyses
+language sql
+as $$
+  update public.analyses
+     set perception = coalesce(perception, '{}'::jsonb)
+                      || jsonb_strip_nulls(jsonb_build_object('objects', p_objects, 'certainty', p_certainty)),
+         experience = coalesce(p_experience, experience),
+         confidence = coalesce(p_confidence, confidence)
+   where id = p_id
+  returning *;
+$$;
+
+-- Server-side only (service key); clients keep going through the API.
+revoke execute on function public.merge_analysis(uuid, jsonb, numeric, text, numeric) from public, anon, authenticated;
+grant execute on function public.merge_analysis(uuid, jsonb, numeric, text, numeric) to service_role;
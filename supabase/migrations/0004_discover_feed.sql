@@ -0,0 +1,24 @@
+-- Discover feed: keyset pagination on (created_at, id) and a card projection.
+
+-- Supports `order by created_at desc, id desc` with the
+-- (created_at, id) < (cursor) predicate used for paging.
+create index if not exists idx_analyses_created_id on public.analyses (created_at desc, id desc);
+
+-- Card fields only: no perception JSONB, experience cut to a snippet, like
+-- count computed server-side (idx_likes_analysis keeps the lateral count to an
+-- index lookup per card).
+create or replace view public.discover_cards
+with (security_invoker = true) as
+select
+  a.id,
+  a.image_url,
+  left(a.experience, 160) as experience,
+  a.confidence,
+  a.created_at,
+  coalesce(l.likes, 0) as likes
+from public.analyses a
+left join lateral (
+  select count(*)::int as likes from public.likes where likes.analysis_id = a.id
+) l on true;
+
+grant select on public.discover_cards to anon, authenticated, service_role;
@@ -0,0 +1,99 @@
+-- Denormalized engagement counters on analyses, kept in sync by statement-level
+-- triggers on likes/feedback. A bulk insert of N rows (the API batches them)
+-- costs one grouped UPDATE instead of N row-level trigger calls.
+
+alter table public.analyses
+  add column if not exists like_count integer not null default 0,
+  add column if not exists feedback_count integer not null default 0;
+
+-- Security definer: inserts come from anon/authenticated roles that have no
+-- UPDATE policy on analyses, so the counter update must run as the owner.
+create or replace function public.likes_count_ins() returns trigger
+language plpgsql security definer set search_path = public as $$
+begin
+  update analyses a
+     set like_count = a.like_count + d.n
+    from (select analysis_id, count(*)::int as n from new_rows
+           where analysis_id is not null group by analysis_id) d
+   where a.id = d.analysis_id;
+  return null;
+end $$;
+
+create or replace function public.likes_count_del() returns trigger
+language plpgsql security definer set search_path = public as $$
+begin
+  update analyses a
+     set like_count = greatest(a.like_count - d.n, 0)
+    from (select analysis_id, count(*)::int as n from old_rows
+           where analysis_id is not null group by analysis_id) d
+   where a.id = d.analysis_id;
+  return null;
+end $$;
+
+create or replace function public.feedback_count_ins() returns trigger
+language plpgsql security definer set search_path = public as $$
+begin
+  update analyses a
+     set feedback_count = a.feedback_count + d.n
+    from (select analysis_id, count(*)::int as n from new_rows
+           where analysis_id is not null group by analysis_id) d
+   where a.id = d.analysis_id;
+  return null;
+end $$;
+
+create or replace function public.feedback_count_del() returns trigger
+language plpgsql security definer set search_path = public as $$
+begin
+  update analyses a
+     set feedback_count = greatest(a.feedback_count - d.n, 0)
+    from (select analysis_id, count(*)::int as n from old_rows
+           where analysis_id is not null group by analysis_id) d
+   where a.id = d.analysis_id;
+  return null;
+end $$;
+
+revoke execute on function public.likes_count_ins(), public.likes_count_del(),
+  public.feedback_count_ins(), public.feedback_count_del() from public, anon, authenticated;
+
+-- Block writers while triggers are installed and counters backfilled, so no
+-- row is counted twice or missed.
+lock table public.likes, public.feedback in share row exclusive mode;
+
+drop trigger if exists likes_count_ins on public.likes;
+create trigger likes_count_ins after insert on public.likes
+  referencing new table as new_rows for each statement execute function public.likes_count_ins();
+drop trigger if exists likes_count_del on public.likes;
+create trigger likes_count_del after delete on public.likes
+  referencing old table as old_rows for each statement execute function public.likes_count_del();
+drop trigger if exists feedback_count_ins on public.feedback;
+create trigger feedback_count_ins after insert on public.feedback
+  referencing new table as new_rows for each statement execute function public.feedback_count_ins();
+drop trigger if exists feedback_count_del on public.feedback;
+create trigger feedback_count_del after delete on public.feedback
+  referencing old table as old_rows for each statement execute function public.feedback_count_del();
+
+-- Backfill
+update public.analyses a set like_count = s.n
+  from (select analysis_id, count(*)::int as n from public.likes group by analysis_id) s
+ where a.id = s.analysis_id;
+update public.analyses a set feedback_count = s.n
+  from (select analysis_id, count(*)::int as n from public.feedback group by analysis_id) s
+ where a.id = s.analysis_id;
+
+-- "Most liked" (optionally within the last N hours): walk the index in
+-- like_count order and stop after LIMIT rows that pass the created_at filter.
+-- created_at/id also make it usable for keyset paging.
+create index if not exists idx_analyses_popular on public.analyses (like_count desc, created_at desc, id desc);
+
+-- Cards read the counter instead of counting likes per row.
+create or replace view public.discover_cards
+with (security_invoker = true) as
+select
+  a.id,
+  a.image_url,
+  left(a.experience, 160) as experience,
+  a.confidence,
+  a.created_at,
+  a.like_count as likes,
+  a.feedback_count
+from public.analyses a;
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The API is imported as the `api` package from src/, as uvicorn does.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
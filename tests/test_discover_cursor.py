@@ -0,0 +1,55 @@
+import json
+import base64
+import uuid
+
+import pytest
+
+from api.supabase_utils import decode_cursor, encode_cursor, _keyset_filter, DISCOVER_SORTS
+
+ROW = {"id": str(uuid.uuid4()), "created_at": "2024-05-01T12:34:56.789012+00:00", "likes": 7}
+
+
+def _raw_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("sort", sorted(DISCOVER_SORTS))
+def test_cursor_round_trip(sort: str):
+    assert decode_cursor(encode_cursor(ROW, sort), sort) == [ROW[k] for k in DISCOVER_SORTS[sort]]
+
+
+@pytest.mark.parametrize("values", [
+    ['2024-05-01T00:00:00+00:00",id.gt.0,created_at.gt."2000-01-01', ROW["id"]],
+    ["yesterday", ROW["id"]],
+    [ROW["created_at"], '1",created_at.gt."2000'],
+    [ROW["created_at"], "not-a-uuid"],
+    [ROW["created_at"], 5],
+    [ROW["created_at"]],
+])
+def test_crafted_latest_cursor_is_rejected(values):
+    with pytest.raises(ValueError):
+        decode_cursor(_raw_cursor(values), "latest")
+
+
+@pytest.mark.parametrize("likes", ["7", True, 1.5])
+def test_popular_cursor_needs_integer_likes(likes):
+    with pytest.raises(ValueError):
+        decode_cursor(_raw_cursor([likes, ROW["created_at"], ROW["id"]]), "popular")
+
+
+def test_filter_uses_canonical_values():
+    upper = ROW["id"].upper()
+    values = decode_cursor(_raw_cursor(["2024-05-01T12:34:56Z", "{%s}" % upper]), "latest")
+    assert _keyset_filter(DISCOVER_SORTS["latest"], values) == (
+        f'created_at.lt."2024-05-01T12:34:56+00:00",'
+        f'and(created_at.eq."2024-05-01T12:34:56+00:00",id.lt."{ROW["id"]}")'
+    )
+
+
+def test_discover_answers_400_for_a_crafted_cursor():
+    TestClient = pytest.importorskip("fastapi.testclient").TestClient
+    from api.fastapi_example import app
+
+    cursor = _raw_cursor(['2024-05-01T00:00:00+00:00",id.gt.0,created_at.gt."2000-01-01', ROW["id"]])
+    resp = TestClient(app).get("/discover", params={"cursor": cursor})
+    assert resp.status_code == 400
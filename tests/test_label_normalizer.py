@@ -0,0 +1,117 @@
+import os
+import json
+import itertools
+from typing import Dict, List
+
+import pytest
+
+from api import agents_chain as ac
+from api.label_normalizer import LabelNormalizer, LabelSource
+
+CONTEXT = {"paint": ac._PAINT_CTX, "hair": ac._HAIR_CTX, "tooth": ac._TOOTH_CTX, "keyboard": ac._KEYBOARD_CTX}
+VARIANTS = [v for vals in ac.CANON.values() for v in vals]
+
+
+def old_canon_loop(label: str, canon: Dict[str, List[str]]) -> str:
+    """The CANON loop _rule_normalize used before the automaton."""
+    low = label.lower()
+    for k, vals in canon.items():
+        if low == k or any(low == v for v in vals) or any(v in low for v in vals):
+            return k
+    return low
+
+
+def reference(label: str, canon: Dict[str, List[str]]) -> str:
+    """old_canon_loop, except exact key/variant matches win first (user-004)."""
+    low = label.lower()
+    for k in canon:
+        if low == k:
+            return k
+    for k, vals in canon.items():
+        if low in vals:
+            return k
+    return old_canon_loop(label, canon)
+
+
+def old_context_hits(text: str) -> set:
+    return {g for g, words in CONTEXT.items() if any(w in text for w in words)}
+
+
+LABELS = sorted(set(
+    list(ac.CANON) + VARIANTS
+    + [v.upper() for v in VARIANTS]
+    + ["", "cup", "Brush", "paint brush set", "wireless mouse", "electric toothbrush",
+       "tooth brush holder", "computer-mouse pad", "mousepad", "fırçalar", "brushes"]
+))
+
+
+@pytest.fixture(scope="module")
+def normalizer() -> LabelNormalizer:
+    return LabelNormalizer(ac.CANON, CONTEXT)
+
+
+@pytest.mark.parametrize("label", LABELS)
+def test_normalize_matches_the_canon_loops(normalizer: LabelNormalizer, label: str):
+    assert normalizer.normalize(label) == reference(label, ac.CANON)
+    # memoized answer is the same
+    assert normalizer.normalize(label) == reference(label, ac.CANON)
+
+
+def test_combined_labels_match_the_canon_loops(normalizer: LabelNormalizer):
+    for a, b in itertools.permutations(VARIANTS + list(ac.CANON), 2):
+        label = f"{a} {b}"
+        assert normalizer.normalize(label) == old_canon_loop(label, ac.CANON), label
+
+
+@pytest.mark.parametrize("label", [l for l in LABELS if l.lower() not in ac.CANON and l.lower() not in VARIANTS])
+def test_labels_without_an_exact_match_are_unchanged(normalizer: LabelNormalizer, label: str):
+    assert normalizer.normalize(label) == old_canon_loop(label, ac.CANON)
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "masada bir laptop ve klavye",
+    "banyoda lavabo ve ayna",
+    "tuval üzerinde boya, palet",
+    "saç tarağı ve diş macunu, desk lamp",
+    "bathroom mirror canvas keyboard",
+    "unrelated outdoor scene",
+    "PAINT in caps",
+])
+def test_context_hits_match_keyword_loops(normalizer: LabelNormalizer, text: str):
+    assert normalizer.context_hits(text) == old_context_hits(text)
+
+
+def _write(path, canon: Dict[str, List[str]], mtime: float) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"canon": canon}, f)
+    os.utime(path, (mtime, mtime))
+
+
+def test_source_reloads_on_mtime_change_and_keeps_rules_on_bad_file(tmp_path):
+    path = tmp_path / "labels.json"
+    _write(path, {"cup": ["mug"]}, 1_000_000)
+    source = LabelSource(lambda: LabelNormalizer(ac.CANON, CONTEXT), path=str(path), reload_interval=0)
+
+    first = source.get()
+    assert first.normalize("coffee mug") == "cup"
+    # context section missing from the file: defaults stay
+    assert first.context_hits("banyo") == {"tooth"}
+    assert source.get() is first
+
+    path.write_text("{not json", encoding="utf-8")
+    os.utime(path, (1_000_100, 1_000_100))
+    assert source.get() is first
+
+    _write(path, {"glass": ["mug"]}, 1_000_200)
+    assert source.get().normalize("coffee mug") == "glass"
+
+
+def test_source_falls_back_to_defaults_without_a_usable_file(tmp_path):
+    path = tmp_path / "labels.json"
+    path.write_text("[]", encoding="utf-8")
+    source = LabelSource(lambda: LabelNormalizer(ac.CANON, CONTEXT), path=str(path), reload_interval=0)
+    assert source.get().normalize("tooth brush") == "toothbrush"
+
+    missing = LabelSource(lambda: LabelNormalizer(ac.CANON, CONTEXT), path=str(tmp_path / "nope.json"))
+    assert missing.get().normalize("fare") == "computer mouse"
@@ -0,0 +1,71 @@
+import json
+import asyncio
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import pytest
+
+from api import agents_chain as ac
+from api.result_cache import ResultCache
+
+
+class FakeCompletions:
+    def __init__(self, answer: Dict[str, Any]):
+        self.answer = answer
+        self.calls = 0
+
+    async def create(self, **_: Any) -> Any:
+        self.calls += 1
+        message = SimpleNamespace(content=json.dumps(self.answer))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+@pytest.fixture
+def openai_answer(monkeypatch: pytest.MonkeyPatch):
+    """Route perception to a fake async OpenAI client answering with the given JSON."""
+    def install(answer: Dict[str, Any]) -> FakeCompletions:
+        completions = FakeCompletions(answer)
+        client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        monkeypatch.setattr(ac, "USE_OPENAI", True)
+        monkeypatch.setattr(ac, "USE_GEMINI", False)
+        monkeypatch.setattr(ac, "_openai_pair", (object(), client))
+        monkeypatch.setattr(ac, "_genai_model", False)
+        monkeypatch.setattr(ac, "SINGLE_PASS_PERCEPTION", True)
+        monkeypatch.setattr(ac, "perception_cache", ResultCache("perception-test"))
+        return completions
+    return install
+
+
+def _perceive(image: bytes) -> Dict[str, Any]:
+    return asyncio.run(ac.refined_perception_agent_async(image))
+
+
+@pytest.mark.parametrize("objects,scene,expected", [
+    ([{"name": "brush", "confidence": 0.9, "subtype": "toothbrush"}, {"name": "sink", "confidence": 0.8, "subtype": None}],
+     "Bir banyo lavabosu", ["toothbrush", "sink"]),
+    ([{"name": "brush", "confidence": 0.9, "subtype": "hairbrush"}, {"name": "mirror", "confidence": 0.7, "subtype": None}],
+     "Bir tuval ve palet olan atölye", ["hairbrush", "mirror"]),
+    ([{"name": "brush", "confidence": 0.9, "subtype": "paintbrush"}], "Bir banyo", ["paintbrush"]),
+    ([{"name": "mouse", "confidence": 0.9, "subtype": "computer mouse"}], "Bir çalışma masası", ["computer mouse"]),
+])
+def test_single_pass_subtypes_survive_the_chain(openai_answer, objects: List[Dict[str, Any]], scene: str, expected: List[str]):
+    fake = openai_answer({"objects": objects, "scene": scene, "context": "", "certainty": 0.9, "ambiguous": []})
+    before = ac.refine_stats()["refines"]
+    result = _perceive(b"subtype-test " + json.dumps(objects).encode())
+    assert sorted(result["objects"]) == sorted(expected)
+    # the subtype answered the question: no second vision hop
+    assert fake.calls == 1
+    assert ac.refine_stats()["refines"] == before
+
+
+@pytest.mark.parametrize("label,expected", [
+    ("toothbrush", "toothbrush"),
+    ("hairbrush", "hairbrush"),
+    ("diş fırçası", "toothbrush"),
+    ("saç fırçası", "hairbrush"),
+    ("tooth brush", "toothbrush"),
+    ("brush", "paintbrush"),
+    ("fırça", "paintbrush"),
+])
+def test_exact_labels_beat_shorter_variants(label: str, expected: str):
+    assert ac.normalize_scene({"objects": [label]})["objects"] == [expected]
@@ -0,0 +1,46 @@
+import io
+
+import pytest
+
+from api import agents_chain as ac
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _jpeg(size, quality, exif=None) -> bytes:
+    # noise compresses badly, so re-encoding at a higher quality grows the file
+    img = Image.effect_noise(size, 80).convert("RGB")
+    out = io.BytesIO()
+    kwargs = {"exif": exif} if exif is not None else {}
+    img.save(out, format="JPEG", quality=quality, **kwargs)
+    return out.getvalue()
+
+
+def _gps_exif() -> bytes:
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"  # Make
+    exif[0x8825] = {1: "N", 2: (41.0, 1.0, 2.0)}  # GPSInfo
+    return exif.tobytes()
+
+
+@pytest.fixture(autouse=True)
+def jpeg_target(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(ac, "IMAGE_PREPROCESS", True)
+    monkeypatch.setattr(ac, "IMAGE_FORMAT", "jpeg")
+    monkeypatch.setattr(ac, "IMAGE_QUALITY", 95)
+
+
+def test_exif_is_stripped_even_when_reencoding_is_larger():
+    original = _jpeg((64, 64), quality=5, exif=_gps_exif())
+    assert Image.open(io.BytesIO(original)).info.get("exif")
+    assert len(_jpeg((64, 64), quality=95)) > len(original)
+
+    result = ac.preprocess_image(original)
+
+    assert result != original
+    assert not Image.open(io.BytesIO(result)).info.get("exif")
+
+
+def test_small_image_without_exif_is_passed_through():
+    original = _jpeg((64, 64), quality=5)
+    assert ac.preprocess_image(original) == original
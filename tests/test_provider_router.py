@@ -0,0 +1,171 @@
+import asyncio
+from typing import Any, Dict, Optional
+
+import pytest
+
+from api import agents_chain as ac
+from api import provider_router as pr
+from api.provider_router import ProviderRouter
+from api.resilience import CLOSED, CircuitBreaker
+
+HEDGE = 0.05
+
+
+class FakeProvider:
+    """Async provider answering `result` (or raising `error`) after `delay` seconds."""
+
+    def __init__(self, delay: float = 0.0, result: Any = "ok", error: Optional[Exception] = None):
+        self.delay = delay
+        self.result = result
+        self.error = error
+        self.started = 0
+        self.cancelled = 0
+
+    async def __call__(self) -> Any:
+        self.started += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+@pytest.fixture(autouse=True)
+def hedge_settings(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(pr, "HEDGE_REQUESTS", True)
+    monkeypatch.setattr(pr, "HEDGE_DEFAULT_DELAY", HEDGE)
+    monkeypatch.setattr(pr, "PROVIDER_ORDER", ["a", "b", "c"])
+
+
+def _race(router: ProviderRouter, providers: Dict[str, FakeProvider], **kw: Any):
+    async def run():
+        result = await router.race(dict(providers), **kw)
+        # let cancelled losers unwind before looking at them
+        await asyncio.sleep(0)
+        return result
+
+    return asyncio.run(run())
+
+
+def test_fast_primary_wins_without_hedging():
+    a, b = FakeProvider(0.0, "A"), FakeProvider(0.0, "B")
+    router = ProviderRouter("t")
+    assert _race(router, {"a": a, "b": b}) == ("a", "A")
+    assert (a.started, b.started) == (1, 0)
+    assert router.stats["a"].wins == 1
+    assert "b" not in router.stats or router.stats["b"].hedged == 0
+
+
+def test_slow_primary_is_hedged_and_the_loser_cancelled():
+    a, b = FakeProvider(5.0, "A"), FakeProvider(0.0, "B")
+    router = ProviderRouter("t")
+    assert _race(router, {"a": a, "b": b}) == ("b", "B")
+    assert (a.started, b.started) == (1, 1)
+    assert a.cancelled == 1
+    assert router.stats["b"].hedged == 1
+    snap = router.stats["a"].snapshot()
+    # the loser is neither a success nor an error, only a lower bound on latency
+    assert (snap["calls"], snap["errors"]) == (0, 0)
+    assert len(router.stats["a"]._latencies) == 1
+    assert router.stats["a"]._latencies[0] >= HEDGE
+
+
+def test_hedge_waits_for_the_delay():
+    a, b = FakeProvider(HEDGE / 5, "A"), FakeProvider(0.0, "B")
+    assert _race(ProviderRouter("t"), {"a": a, "b": b}) == ("a", "A")
+    assert b.started == 0
+
+
+@pytest.mark.parametrize("primary", [
+    FakeProvider(0.0, result=None),
+    FakeProvider(0.0, result={}),
+    FakeProvider(0.0, error=RuntimeError("boom")),
+])
+def test_invalid_or_failed_answer_falls_back_immediately(monkeypatch: pytest.MonkeyPatch, primary: FakeProvider):
+    monkeypatch.setattr(pr, "HEDGE_DEFAULT_DELAY", 5.0)
+    b = FakeProvider(0.0, {"objects": ["cup"]})
+    router = ProviderRouter("t")
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        result = await router.race({"a": primary, "b": b})
+        return result, loop.time() - t0
+
+    result, took = asyncio.run(run())
+    assert result == ("b", {"objects": ["cup"]})
+    assert took < 1.0
+    assert router.stats["a"].errors == 1
+    assert router.stats["b"].hedged == 0
+
+
+def test_custom_validity_check():
+    a, b = FakeProvider(0.0, {"objects": []}), FakeProvider(0.0, {"objects": ["cup"]})
+    router = ProviderRouter("t")
+    assert _race(router, {"a": a, "b": b}, is_valid=lambda r: bool(r.get("objects"))) == ("b", {"objects": ["cup"]})
+
+
+def test_all_failing_returns_none():
+    providers = {name: FakeProvider(0.0, error=RuntimeError(name)) for name in "abc"}
+    router = ProviderRouter("t")
+    assert _race(router, providers) is None
+    assert all(p.started == 1 for p in providers.values())
+    assert all(router.stats[n].errors == 1 for n in "abc")
+
+
+def test_without_hedging_a_slow_primary_is_awaited(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(pr, "HEDGE_REQUESTS", False)
+    a, b = FakeProvider(HEDGE * 3, "A"), FakeProvider(0.0, "B")
+    assert _race(ProviderRouter("t"), {"a": a, "b": b}) == ("a", "A")
+    assert b.started == 0
+
+
+def test_cancelling_the_race_cancels_every_provider():
+    a, b = FakeProvider(5.0, "A"), FakeProvider(5.0, "B")
+    router = ProviderRouter("t")
+
+    async def run():
+        task = asyncio.ensure_future(router.race({"a": a, "b": b}))
+        await asyncio.sleep(HEDGE * 3)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert (a.started, b.started) == (1, 1)
+    assert (a.cancelled, b.cancelled) == (1, 1)
+
+
+def test_measured_latency_reorders_and_sets_the_hedge_delay(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(pr, "HEDGE_MIN_DELAY", 0.01)
+    monkeypatch.setattr(pr, "HEDGE_MAX_DELAY", 1.0)
+    router = ProviderRouter("t")
+    for _ in range(pr.MIN_SAMPLES):
+        router._stats("a").record(True, 0.8)
+        router._stats("b").record(True, 0.2)
+    assert router.order(["a", "b"]) == ["b", "a"]
+    assert router.hedge_delay("b") == pytest.approx(0.2)
+    router._stats("c").record(True, 0.1)
+    # one provider without enough samples: keep the configured order
+    assert router.order(["c", "b", "a"]) == ["a", "b", "c"]
+
+
+def test_losing_a_hedge_race_is_neutral_for_the_breaker(monkeypatch: pytest.MonkeyPatch):
+    for name in ("a", "b"):
+        monkeypatch.setitem(ac.breakers, name, CircuitBreaker(name, failure_threshold=1, reset_timeout=30))
+    slow, fast = FakeProvider(5.0, "A"), FakeProvider(0.0, "B")
+
+    def guarded(name: str, provider: FakeProvider):
+        async def call(timeout: float):
+            return await provider()
+        return lambda: ac._call_provider_async(name, "perception", call)
+
+    router = ProviderRouter("t")
+    assert _race(router, {"a": guarded("a", slow), "b": guarded("b", fast)}) == ("b", "B")
+    assert slow.cancelled == 1
+    assert ac.breakers["a"].state == CLOSED
+    assert ac.breakers["a"].snapshot()["consecutive_failures"] == 0
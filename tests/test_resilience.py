@@ -0,0 +1,173 @@
+import asyncio
+
+import pytest
+
+from api import agents_chain as ac
+from api import resilience
+from api.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, budget, deadline, remaining
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    c = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", c)
+    return c
+
+
+def _opened(clock: Clock, threshold: int = 2) -> CircuitBreaker:
+    b = CircuitBreaker("p", failure_threshold=threshold, reset_timeout=30)
+    for _ in range(threshold):
+        assert b.allow()
+        b.record_failure()
+    assert b.state == OPEN
+    return b
+
+
+def test_opens_after_consecutive_failures_and_refuses(clock: Clock):
+    b = CircuitBreaker("p", failure_threshold=3, reset_timeout=30)
+    b.record_failure()
+    b.record_failure()
+    b.record_success()
+    b.record_failure()
+    b.record_failure()
+    assert b.state == CLOSED
+    b.record_failure()
+    assert b.state == OPEN and b.is_open()
+    assert not b.allow()
+    assert b.snapshot()["rejected"] == 1
+    assert b.snapshot()["opened"] == 1
+
+
+def test_half_open_lets_a_single_probe_through(clock: Clock):
+    b = _opened(clock)
+    clock.now += 30
+    assert b.state == HALF_OPEN and not b.is_open()
+    assert b.allow()
+    assert not b.allow()
+    assert not b.allow()
+    b.record_success()
+    assert b.state == CLOSED
+    assert b.allow() and b.allow()
+
+
+def test_failed_probe_reopens_for_another_reset_timeout(clock: Clock):
+    b = _opened(clock)
+    clock.now += 30
+    assert b.allow()
+    b.record_failure()
+    assert b.state == OPEN
+    clock.now += 29
+    assert not b.allow()
+    clock.now += 1
+    assert b.allow()
+    assert b.snapshot()["opened"] == 2
+
+
+def test_neutral_probe_frees_the_slot_without_closing(clock: Clock):
+    b = _opened(clock)
+    clock.now += 30
+    assert b.allow()
+    b.record_neutral()
+    assert b.state == HALF_OPEN
+    assert b.allow()
+    assert not b.allow()
+
+
+def test_neutral_outcomes_do_not_reset_or_add_failures(clock: Clock):
+    b = CircuitBreaker("p", failure_threshold=2, reset_timeout=30)
+    b.record_failure()
+    b.record_neutral()
+    assert b.snapshot()["consecutive_failures"] == 1
+    b.record_failure()
+    assert b.state == OPEN
+
+
+def test_deadline_nests_to_the_earliest_and_budget_shares_it():
+    assert remaining() is None
+    assert budget(0.5, 7) == 7
+    with deadline(10):
+        with deadline(100):
+            assert remaining() <= 10
+        with deadline(None):
+            assert remaining() <= 10
+        assert 4 < budget(0.5, 20) <= 5
+        assert budget(0.5, 1) == 1
+    assert remaining() is None
+    with deadline(-1):
+        assert budget(0.5, 7) == 0.0
+
+
+@pytest.fixture
+def breaker(monkeypatch: pytest.MonkeyPatch) -> CircuitBreaker:
+    b = CircuitBreaker("fake", failure_threshold=1, reset_timeout=30)
+    monkeypatch.setitem(ac.breakers, "fake", b)
+    return b
+
+
+def test_cancelled_provider_call_is_neutral(breaker: CircuitBreaker):
+    started = asyncio.Event()
+
+    async def hang(timeout: float):
+        started.set()
+        await asyncio.sleep(60)
+
+    async def run():
+        task = asyncio.ensure_future(ac._call_provider_async("fake", "perception", hang))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()["consecutive_failures"] == 0
+
+
+def test_timeout_at_the_chain_deadline_is_neutral(breaker: CircuitBreaker, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(ac, "MIN_CALL_TIMEOUT", 0.01)
+
+    async def hang(timeout: float):
+        await asyncio.sleep(60)
+
+    async def run():
+        with deadline(0.1):
+            return await ac._call_provider_async("fake", "experience", hang)
+
+    assert asyncio.run(run()) is None
+    assert breaker.state == CLOSED
+
+
+def test_stage_timeout_with_deadline_left_counts_as_failure(breaker: CircuitBreaker, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(ac, "MIN_CALL_TIMEOUT", 0.01)
+    monkeypatch.setitem(ac.STAGE_BUDGET, "perception", 0.1)
+
+    async def hang(timeout: float):
+        await asyncio.sleep(60)
+
+    async def run():
+        with deadline(1.0):
+            return await ac._call_provider_async("fake", "perception", hang)
+
+    assert asyncio.run(run()) is None
+    assert breaker.state == OPEN
+
+
+def test_provider_error_counts_and_open_breaker_skips_the_call(breaker: CircuitBreaker):
+    calls = []
+
+    async def fail(timeout: float):
+        calls.append(timeout)
+        raise RuntimeError("500")
+
+    assert asyncio.run(ac._call_provider_async("fake", "perception", fail)) is None
+    assert breaker.state == OPEN
+    assert asyncio.run(ac._call_provider_async("fake", "perception", fail)) is None
+    assert len(calls) == 1
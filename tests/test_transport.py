@@ -0,0 +1,81 @@
+import asyncio
+
+import httpx
+import pytest
+
+from api import transport
+from api.transport import PoolStats, _AsyncCountingTransport, _CountingTransport
+
+
+def test_streamed_response_stays_in_flight_until_closed():
+    stats = PoolStats("t", 4)
+    inner = httpx.MockTransport(lambda request: httpx.Response(200, content=iter([b"a", b"b"])))
+    with httpx.Client(transport=_CountingTransport(inner, stats)) as client:
+        with client.stream("GET", "http://upstream/") as response:
+            assert stats.in_flight == 1
+            assert b"".join(response.iter_bytes()) == b"ab"
+        assert stats.in_flight == 0
+        client.get("http://upstream/")
+    snap = stats.snapshot()
+    assert (snap["in_flight"], snap["requests"], snap["errors"], snap["peak"]) == (0, 2, 0, 1)
+
+
+def test_async_streamed_response_stays_in_flight_until_closed():
+    stats = PoolStats("t", 4)
+
+    async def body():
+        yield b"a"
+        yield b"b"
+
+    inner = httpx.MockTransport(lambda request: httpx.Response(200, content=body()))
+
+    async def run():
+        async with httpx.AsyncClient(transport=_AsyncCountingTransport(inner, stats)) as client:
+            async with client.stream("GET", "http://upstream/") as response:
+                assert stats.in_flight == 1
+                assert [c async for c in response.aiter_bytes()] == [b"a", b"b"]
+            assert stats.in_flight == 0
+
+    asyncio.run(run())
+    assert stats.snapshot()["errors"] == 0
+
+
+def test_failed_request_is_counted_once():
+    stats = PoolStats("t", 4)
+
+    def refuse(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    with httpx.Client(transport=_CountingTransport(httpx.MockTransport(refuse), stats)) as client:
+        with pytest.raises(httpx.ConnectError):
+            client.get("http://upstream/")
+    snap = stats.snapshot()
+    assert (snap["in_flight"], snap["errors"]) == (0, 1)
+
+
+def test_pools_route_through_environment_proxies(monkeypatch: pytest.MonkeyPatch):
+    for var in ("HTTP_PROXY", "http_proxy", "ALL_PROXY", "all_proxy"):
+        monkeypatch.delenv(var, raising=False)
+    monkeypatch.setenv("HTTPS_PROXY", "proxy.local:3128")
+    monkeypatch.setenv("NO_PROXY", "localhost,.internal,10.0.0.1")
+    assert transport._env_proxies() == {
+        "https://": "http://proxy.local:3128",
+        "all://localhost": None,
+        "all://*.internal": None,
+        "all://10.0.0.1": None,
+    }
+
+    client = transport.get_client("proxy-test")
+    try:
+        direct = client._transport_for_url(httpx.URL("https://svc.internal/"))
+        proxied = client._transport_for_url(httpx.URL("https://api.example.com/"))
+        assert direct is client._transport
+        assert isinstance(proxied, _CountingTransport) and proxied is not direct
+    finally:
+        asyncio.run(transport.shutdown())
+
+
+def test_no_proxy_star_disables_proxies(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("HTTPS_PROXY", "http://proxy.local:3128")
+    monkeypatch.setenv("NO_PROXY", "*")
+    assert transport._env_proxies() == {}
@@ -0,0 +1,234 @@
+import threading
+from typing import Any, Callable, List, Optional
+
+import pytest
+
+from api.write_buffer import WriteBehindBuffer, is_bad_request
+
+
+class Refused(Exception):
+    """A 4xx answer from the store."""
+
+    def __init__(self, status_code: int = 400):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class _Coded(Exception):
+    def __init__(self, code: Any):
+        super().__init__(str(code))
+        self.code = code
+
+
+class _Response:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+
+class _HTTPError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(str(status_code))
+        self.response = _Response(status_code)
+
+
+class Store:
+    """flush_fn double. fail(batch) decides per call: None writes, an exception refuses."""
+
+    def __init__(self, fail: Optional[Callable[[List[Any]], Optional[Exception]]] = None):
+        self.fail = fail
+        self.calls = 0
+        self.rows: List[Any] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, batch: List[Any]) -> None:
+        with self._lock:
+            self.calls += 1
+            err = self.fail(batch) if self.fail else None
+            if err is not None:
+                raise err
+            self.rows.extend(batch)
+
+
+def make(store: Store, **kw: Any) -> WriteBehindBuffer:
+    opts = dict(max_batch=100, flush_interval=60, max_retries=3, retry_backoff=0.001, max_pause=0.01)
+    opts.update(kw)
+    return WriteBehindBuffer("test", store, **opts)
+
+
+def test_flushes_full_batches_and_on_demand():
+    store = Store()
+    buf = make(store, max_batch=10)
+    for i in range(25):
+        assert buf.enqueue(i)
+    assert buf.flush(2)
+    assert sorted(store.rows) == list(range(25))
+    assert store.calls == 3
+    assert buf.stats()["flushed"] == 25
+    buf.close()
+
+
+def test_flush_interval_triggers_a_partial_batch():
+    store = Store()
+    buf = make(store, flush_interval=0.05)
+    buf.enqueue("a")
+    for _ in range(100):
+        if store.rows:
+            break
+        threading.Event().wait(0.01)
+    assert store.rows == ["a"]
+    buf.close()
+
+
+def test_queue_full_is_reported_to_the_caller():
+    gate = threading.Event()
+    store = Store(lambda b: None if gate.wait(2) else None)
+    buf = make(store, max_batch=1, max_queue=2)
+    results = [buf.enqueue(i) for i in range(10)]
+    assert results.count(False) > 0
+    assert buf.stats()["full"] == results.count(False)
+    gate.set()
+    buf.close()
+
+
+def test_outage_requeues_without_bisecting():
+    down = threading.Event()
+    down.set()
+    store = Store(lambda b: ConnectionError("connection refused") if down.is_set() else None)
+    buf = make(store)
+    for i in range(100):
+        buf.enqueue(i)
+    assert not buf.flush(0.2)
+    stats = buf.stats()
+    assert stats["rejected"] == 0
+    assert stats["depth"] == 100
+    # every cycle is max_retries + 1 whole-batch calls, never one call per row
+    cycles = stats["requeued"] // 100
+    assert cycles >= 1
+    assert store.calls <= (cycles + 1) * 4
+    down.clear()
+    assert buf.flush(2)
+    assert sorted(set(store.rows)) == list(range(100))
+    buf.close()
+
+
+def test_outage_pause_grows_between_failed_flushes():
+    store = Store(lambda b: ConnectionError("down"))
+    buf = make(store, max_retries=0, retry_backoff=0.01, max_pause=0.08)
+    buf.enqueue(1)
+    buf.flush(0.6)
+    # pauses 0.01, 0.02, 0.04, 0.08, 0.08, ... instead of a fixed short interval
+    assert 3 <= store.calls <= 12
+    buf.close()
+
+
+def test_bad_row_is_isolated_and_rejected():
+    store = Store(lambda b: Refused(400) if "bad" in b else None)
+    buf = make(store, max_batch=64)
+    rows = list(range(63)) + ["bad"]
+    for r in rows:
+        buf.enqueue(r)
+    assert buf.flush(2)
+    stats = buf.stats()
+    assert stats["rejected"] == 1
+    assert stats["flushed"] == 63
+    assert stats["retries"] == 0
+    assert sorted(store.rows) == list(range(63))
+    # one failed batch, then two calls per bisection level
+    assert store.calls <= 1 + 2 * 6
+    buf.close()
+
+
+def test_outage_during_bisection_does_not_reject_valid_rows():
+    state = {"calls": 0}
+
+    def fail(batch: List[Any]) -> Optional[Exception]:
+        state["calls"] += 1
+        if state["calls"] == 1:
+            return Refused(422)
+        if 2 <= state["calls"] <= 6:
+            return ConnectionError("store went away")
+        return Refused(400) if "bad" in batch else None
+
+    store = Store(fail)
+    buf = make(store, max_batch=8)
+    rows = ["bad"] + list(range(7))
+    for r in rows:
+        buf.enqueue(r)
+    assert buf.flush(2)
+    assert buf.stats()["rejected"] == 1
+    assert sorted(store.rows) == list(range(7))
+    buf.close()
+
+
+def test_valid_rows_behind_a_fully_invalid_batch_are_written():
+    # e.g. /like with analysis_id "x": every row of the first batch fails on uuid syntax
+    store = Store(lambda b: _Coded("22P02") if any(str(r).startswith("bad") for r in b) else None)
+    buf = make(store, max_batch=4)
+    for i in range(4):
+        buf.enqueue(f"bad{i}")
+    for i in range(10):
+        buf.enqueue(i)
+    assert buf.flush(2)
+    stats = buf.stats()
+    assert stats["rejected"] == 4
+    assert stats["flushed"] == 10
+    assert stats["depth"] == 0
+    assert sorted(store.rows) == list(range(10))
+    buf.close()
+
+
+def test_refusal_that_is_not_about_a_row_keeps_rows_queued():
+    denied = threading.Event()
+    denied.set()
+    store = Store(lambda b: _Coded("42501") if denied.is_set() else None)
+    buf = make(store, max_batch=8)
+    for i in range(8):
+        buf.enqueue(i)
+    assert not buf.flush(0.1)
+    assert buf.stats()["rejected"] == 0
+    denied.clear()
+    assert buf.flush(2)
+    assert sorted(set(store.rows)) == list(range(8))
+    buf.close()
+
+
+def test_close_flushes_and_counts_what_could_not_be_written():
+    store = Store()
+    buf = make(store)
+    for i in range(5):
+        buf.enqueue(i)
+    buf.close()
+    assert sorted(store.rows) == list(range(5))
+    assert not buf.enqueue(6)
+
+    dead = Store(lambda b: ConnectionError("down"))
+    buf = make(dead)
+    for i in range(5):
+        buf.enqueue(i)
+    buf.close(2)
+    assert buf.stats()["lost"] == 5
+
+
+@pytest.mark.parametrize("exc,bad", [
+    (Refused(400), True),
+    (Refused(409), True),
+    (Refused(401), False),  # credentials: every row would fail
+    (Refused(403), False),
+    (Refused(404), False),  # missing table
+    (Refused(429), False),
+    (Refused(503), False),
+    (_HTTPError(422), True),
+    (_HTTPError(502), False),
+    (_Coded(400), True),  # google-api-core InvalidArgument
+    (_Coded(503), False),  # google-api-core ServiceUnavailable
+    (_Coded("23502"), True),  # not_null_violation
+    (_Coded("22P02"), True),  # invalid_text_representation
+    (_Coded("42501"), False),  # insufficient_privilege: not a per-row problem
+    (_Coded("42P01"), False),  # undefined_table
+    (ValueError("cannot serialize"), True),
+    (ConnectionError("refused"), False),
+    (TimeoutError("read timed out"), False),
+    (RuntimeError("Supabase client not configured"), False),
+])
+def test_is_bad_request(exc: BaseException, bad: bool):
+    assert is_bad_request(exc) is bad